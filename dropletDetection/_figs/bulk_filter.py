@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import pandas as pd
+import sys
+import os
+import argparse
+from glob import glob
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_io import FORMATS, table_format, read_table, write_table, read_intensity, write_intensity
+from droplet_store import sample_timepoint, store_result
+from bad_filter import get_fnames
+
+'''Filters the artifacts out of every image of a time series in one run, instead of running bad_filter.py or
+good_filter.py and typing the droplet IDs of each timepoint. The IDs are read from one artifact file, with one line
+per timepoint: the timepoint (or the full name of the image, fn) and the comma-separated droplet IDs after a colon,
+    # 50 nM gene
+    0: 3, 17, 42
+    1:
+    fn_t02: 5, 8
+Lines starting with # are ignored. A full name only matches that image. A timepoint matches the image of that
+timepoint of one sample (see sample_timepoint): the only sample in the directory, or the one given with --sample.
+Timepoint lines are an error if the directory holds more than one sample and --sample is not given, so that one line
+never filters the images of several samples.
+
+By default the IDs are the bad droplets, as for bad_filter.py, and every _values file of the samples named in the
+artifact file is filtered: timepoints with no line or no IDs are written out unchanged, so no files have to be
+copied by hand, unless they already have a _val_filtered or _intensity_filtered file, which is kept. Samples the
+artifact file does not name are never touched. With --good the IDs are the droplets to keep, as for good_filter.py,
+and only images with a line in the artifact file are filtered.
+
+    python bulk_filter.py artifacts.txt [--good] [--dir .] [--sample 50nM_gene] [--store results.sqlite]
+
+.csv intensity files are filtered in chunks of --chunksize rows, so a whole _intensity.csv is never held in memory.
+The _val_filtered and _intensity_filtered files are the same as those of the single-file filter scripts.'''
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove the artifacts from every _values file of a time series.')
+    parser.add_argument('artifacts', help='file listing the droplet IDs of each timepoint')
+    parser.add_argument('--good', action='store_true', help='the IDs are the droplets to keep, not the artifacts')
+    parser.add_argument('--dir', default='.', help='directory of the _values and _intensity files')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='rows of a .csv intensity file read at once')
+    parser.add_argument('--store', default='', help='SQLite results store to also add the filtered tables to')
+    parser.add_argument('--sample', default=None, help='sample the timepoint lines are for, if the directory has several')
+    args = parser.parse_args()
+    filter_directory(args.artifacts, args.dir, args.good, args.sample, args.chunksize, args.store)
+    print('Done')
+
+def filter_directory(artifact_file, directory='.', good=False, sample=None, chunksize=1000000, store=''):
+    '''Filters the _values and _intensity files of the directory with the IDs of the artifact file, as described
+    above.'''
+    artifacts = read_artifacts(artifact_file)
+    files = find_values(directory)
+    print("%d _values files found, %d lines in %s" % (len(files), len(artifacts), artifact_file))
+    samples = set(sample_timepoint(get_fnames(fn)[0])[0] for fn in files)
+    sample = timepoint_sample(samples, artifacts, sample)
+    named = set(sample_timepoint(key)[0] for key in artifacts if not isinstance(key, int))
+    if sample is not None:
+        named.add(sample)
+    used = set()
+    for fn in files:
+        fn_short, int_fn, ext_val, ext_int = get_fnames(fn)
+        base = os.path.join(os.path.dirname(fn), fn_short)
+        key = artifact_key(fn_short, artifacts, sample)
+        if key is None:
+            if good or sample_timepoint(fn_short)[0] not in named:
+                print("%s: not in the artifact file, skipped" % fn_short)
+                continue
+            if os.path.exists(base + ext_val) or os.path.exists(base + ext_int):
+                print("%s: no IDs, existing filtered files kept" % fn_short)
+                continue
+        used.add(key)
+        ids = artifacts.get(key, [])
+        num = filter_values(fn, ids, good, base, ext_val, store)
+        filter_intensity(os.path.join(os.path.dirname(fn), int_fn), ids, good, base, ext_int, chunksize, store)
+        print("%s: %d droplets kept" % (fn_short, num))
+    for key in artifacts:
+        if key not in used:
+            print("No _values file found for %s" % key)
+
+def read_artifacts(path):
+    '''Reads the artifact file into a dictionary of the droplet IDs of each line, keyed by the timepoint (an int) or
+    the image name given before the colon. IDs of a key given on more than one line are combined.'''
+    artifacts = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if ':' not in line:
+                raise ValueError("Line without a colon in %s: %s" % (path, line))
+            key, ids = line.split(':', 1)
+            key = key.strip()
+            if key.isdigit():
+                key = int(key)
+            ids = [int(x) for x in ids.split(',') if x.strip()]
+            artifacts[key] = sorted(set(artifacts.get(key, []) + ids))
+    return artifacts
+
+def timepoint_sample(samples, artifacts, sample=None):
+    '''Sample the timepoint lines of the artifact file are for: sample if given, else the only one of samples (the
+    samples of the directory). Raises ValueError if the artifact file has timepoint lines and the directory holds
+    more than one sample, since the lines could not tell them apart.'''
+    if sample is not None or not any(isinstance(key, int) for key in artifacts):
+        return sample
+    if len(samples) > 1:
+        raise ValueError("Timepoint lines in the artifact file match %d samples (%s): give the sample with --sample "
+                         "or use full names" % (len(samples), ', '.join(sorted(samples))))
+    return next(iter(samples), None)
+
+def artifact_key(fn_short, artifacts, sample=None):
+    '''Key of the artifact file line for the image fn_short: its full name if listed, else its timepoint if the image
+    is of the sample the timepoint lines are for (see timepoint_sample), or None.'''
+    if fn_short in artifacts:
+        return fn_short
+    img_sample, timept = sample_timepoint(fn_short)
+    if img_sample == sample and timept in artifacts:
+        return timept
+    return None
+
+def find_values(directory):
+    '''Sorted list of the _values files of the directory, in any format.'''
+    files = []
+    for ext in FORMATS.values():
+        files.extend(glob(os.path.join(directory, '*_values' + ext)))
+    return sorted(files)
+
+def keep_rows(df, ids, good):
+    '''Mask of the rows of the droplets to keep.'''
+    listed = df['droplet number'].isin(ids)
+    return listed if good else ~listed
+
+def filter_values(fname, ids, good, fn_short, ext, store=''):
+    '''Writes the _val_filtered file of one image (fn_short + ext, fn_short with its directory) and returns the
+    number of droplets kept.'''
+    df = read_table(fname)
+    df_filtered = df[keep_rows(df, ids, good)]
+    write_table(df_filtered, fn_short + ext)
+    store_result(store, 'val_filtered', df_filtered, os.path.basename(fn_short))
+    return len(df_filtered)
+
+def filter_intensity(fname, ids, good, fn_short, ext, chunksize, store=''):
+    '''Writes the _intensity_filtered file of one image. .csv files are read and appended chunksize rows at a time;
+    the binary formats hold one row per droplet, so they are small enough to filter at once.'''
+    name = os.path.basename(fn_short)
+    if table_format(fname) != 'csv':
+        df = read_intensity(fname)
+        df_filtered = df[keep_rows(df, ids, good)]
+        write_intensity(df_filtered, fn_short + ext)
+        store_result(store, 'intensity_filtered', df_filtered, name)
+        return
+    first = True
+    for chunk in pd.read_csv(fname, index_col=0, chunksize=chunksize):
+        chunk = chunk[keep_rows(chunk, ids, good)]
+        chunk.to_csv(fn_short + ext, mode='w' if first else 'a', header=first)
+        store_result(store, 'intensity_filtered', chunk, name, replace=first)
+        first = False
+    if first:
+        # a file with no droplets has no chunks
+        empty = pd.read_csv(fname, index_col=0, nrows=0)
+        empty.to_csv(fn_short + ext)
+        store_result(store, 'intensity_filtered', empty, name)
+
+if __name__ == '__main__':
+    main()
@@ -5,40 +5,43 @@ __email__ = "klocke@ucr.edu"
 __version__ = "1.1"
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 
 import sys
 import os
+import argparse
 import imageio
 
-from matplotlib import rcParams
-from skimage import data, color
-from skimage.draw import circle_perimeter
-from skimage.measure import label
-from skimage.color import label2rgb
-from itertools import zip_longest
-from re import sub
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_io import find_table, read_table
+from droplet_render import overlay_image, draw_perimeters, to_rgb, write_png
 
 '''This script is run by calling "python finalDrops_img.py $brightness-adjusted tiff filename$". This script
 draws the finaldetected droplets on an image after the user has filtered out the artifacts of detection
 and generated the "_final_data.csv" file. Both the brightness-adjusted tiff file and the final_data file 
-must be in the same directory as this script.'''
+must be in the same directory as this script. The image is written at the resolution of the tiff file with the
+circles and IDs drawn straight into its pixels (see droplet_render.py); add "--matplotlib" for the 700 dpi
+matplotlib figure instead.'''
 
-def main():
-
-	if len(sys.argv)==1:
-		print("Need to specify file to process as a parameter.")
-		print("   Exiting")
-		exit()
+# colors of the droplet IDs in groups of 100
+FINAL_LABEL_COLORS = [(240, 128, 128),    # lightcoral
+                      (238, 232, 170),    # palegoldenrod
+                      (128, 128, 128),    # gray
+                      (102, 205, 170),    # mediumaquamarine
+                      (135, 206, 250)]    # lightskyblue
 
-	rcParams['font.family'] = 'sans-serif'
-	rcParams['font.sans-serif'] = ['Arial']
+def main():
+	parser = argparse.ArgumentParser(description='Draw the final detected droplets on the brightness-adjusted image.')
+	parser.add_argument('fn', help='brightness-adjusted .tif file')
+	parser.add_argument('--matplotlib', action='store_true', help='make a 700 dpi matplotlib figure')
+	args = parser.parse_args()
 
-	fn = sys.argv[1] 
+	fn = args.fn
 	img, fname, df_vals = read_file(fn)
 
-	comparison_image(img, df_vals, fname)
+	if args.matplotlib:
+		comparison_image(img, df_vals, fname)
+	else:
+		final_image(img, df_vals, fname)
 
 
 def read_file(fn):
@@ -50,29 +53,37 @@ def read_file(fn):
 	img = imageio.imread(fn)
 	img = np.array(img)
 
-	datafile = fname + '_final_data.csv'
-	df = pd.read_csv(datafile, index_col=0)
+	datafile = find_table(fname + '_final_data')
+	df = read_table(datafile)
 	return img, fname, df
 
 
 def draw_circles(comp_img, cx, cy, radii):
 	'''Draw detected circles onto the brightness adjusted .tif image for visual inspection and removal or artifacts. 
-	Removes x,y coordinates which are outside the image.'''
-	img = color.gray2rgb(comp_img)
-	for center_y, center_x, radius in zip(cy, cx, radii):
-		radius = int(radius)
-		circy, circx = circle_perimeter(center_y, center_x, radius)
-		if np.max(circy) < len(img[:,0,0]) and  np.max(circx) < len(img[0,:,0]):
-			img[circy, circx] = (220, 20, 20)
-		else:
-			continue
-	return img
+	Parts of circles outside the image are clipped (see droplet_render.py).'''
+	img = to_rgb(comp_img)
+	return draw_perimeters(img, cx, cy, radii)
+
+
+def final_image(comp_img, df, fn):
+	'''Same image as comparison_image, with the circles and IDs drawn straight into the image pixels, saved at the
+	resolution of the image.'''
+	img = overlay_image(comp_img, df['X (pixels)'], df['Y (pixels)'], df['Radius (pixels)'], df['droplet number'],
+						FINAL_LABEL_COLORS)
+	write_png('%s_finalimg.%s' % (fn.replace("/","__"), 'png'), img)
 
 
 def comparison_image(comp_img, df, fn):
 	'''Prepare a figure of the brightness-adjusted image with detected circles drawn in red and their IDs
 	written near the upper-right side of the circle in colors corresponding to groups of 100. The different
-	colors only aid in distnguishing circle IDs on busy comparison images, to aid removal of artificacts by ID.'''
+	colors only aid in distnguishing circle IDs on busy comparison images, to aid removal of artificacts by ID.
+	matplotlib is only imported here, so the default raster image never loads it.'''
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	plt.rcParams['font.family'] = 'sans-serif'
+	plt.rcParams['font.sans-serif'] = ['Arial']
+
 	cx = df['X (pixels)']
 	cy = df['Y (pixels)']
 	radii = df['Radius (pixels)']
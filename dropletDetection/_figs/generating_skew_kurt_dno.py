@@ -6,38 +6,69 @@ __version__ = "1.0"
 
 import sys
 import os
+import argparse
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_io import read_table, write_table, read_intensity
+from droplet_store import store_result
+from droplet_stats import skew_from_moments, kurtosis_from_moments
+
 def main():
 	'''This code reads in the "intensity.csv" file generated by the nd2_droplet_cy3 python code. The data
 	in the "intensity.csv" is in histogram format, with 256 bins for pixel values in the ROIs (droplets) of the
 	image. To create a more realistic dataset, we first generate random intensities within each bin for 
 	each count. Then we get the skew and kurtosis based on the generated values for each droplet detected
-	in the nd2_droplet_cy3 code. All data is saved in ".csv" format.'''
-
-	if len(sys.argv)==1:
-		print("Need to specify file to process as a parameter.")
-		print("   Exiting")
-		exit()
-
-	fn = sys.argv[1] 
-	df = pd.read_csv(fn, index_col=0)
+	in the nd2_droplet_cy3 code. All data is saved in ".csv" format, or in the binary format of the input file
+	(see droplet_io.py) for the "_final_data" file.
+
+	Options: "--seed N" makes the generated intensities reproducible. "--exact" skips generating intensities and
+	calculates the skew and kurtosis directly from the bin counts (see bin_moments), in which case no
+	"_generated_intensities.csv" file is written. "--pixels" takes the exact skew and kurtosis from the _val_filtered
+	file given (see droplet_stats.py) instead of the intensity file. "--store FILE" also adds the "_final_data" table to
+	that SQLite results store (see droplet_store.py).'''
+
+	parser = argparse.ArgumentParser(description='Skew and kurtosis of the pixel intensities in each droplet.')
+	parser.add_argument('fn', help='_intensity_filtered.csv file to process')
+	parser.add_argument('--seed', type=int, default=None, help='seed for the generated intensities')
+	parser.add_argument('--exact', action='store_true', help='use the bin counts instead of generated intensities')
+	parser.add_argument('--pixels', action='store_true', help='use the exact pixel statistics of the _val_filtered file')
+	parser.add_argument('--store', default='', help='SQLite results store to also add the final data to')
+	args = parser.parse_args()
+
+	skew_kurt_file(args.fn, args.seed, args.exact, args.store, args.pixels)
+	print('Done')
 
+def skew_kurt_file(fn, seed=None, exact=False, store='', pixels=False):
+	'''Runs the steps of main on one _intensity_filtered file and writes its "_final_data" file, and adds it to the
+	results store if one is given. Returns the final data. Also used by benchmark/benchmark_droplets.py.'''
 	fext, fname_trunc = get_names(fn)
-	df_info = import_info_df(fname_trunc)
+	df_info = import_info_df(fname_trunc, fext)
+	if pixels:
+		df_info = pixel_skew_kurt(df_info)
+		write_table(df_info, '%s_final_data%s' % (fname_trunc, fext))
+		store_result(store, 'final_data', df_info, fname_trunc)
+		return df_info
+
+	df = read_intensity(fn)
 	df, bw_df = get_bin_width(df)
 	df, mbw_b = get_mean_bin_width(df)
-	rand_int_df = calc_rand_intensities(df, fname_trunc)
-	skews, df_info = get_skew(rand_int_df, fname_trunc, df_info)
-	kurt, df_info = get_kurtosis(rand_int_df, fname_trunc, df_info)
-
-	df_info.to_csv('%s_final_data.%s' % (fname_trunc, 'csv'))
+	if exact:
+		moments = bin_moments(df)
+	else:
+		rand_int_df = calc_rand_intensities(df, fname_trunc, seed)
+		moments = sample_moments(rand_int_df)
+	skews, df_info = get_skew(moments, fname_trunc, df_info)
+	kurt, df_info = get_kurtosis(moments, fname_trunc, df_info)
+
+	write_table(df_info, '%s_final_data%s' % (fname_trunc, fext))
+	store_result(store, 'final_data', df_info, fname_trunc)
 	# plot_values(skews, kurt, fname)
-	print('Done')
+	return df_info
 
 def get_names(fn):
 	basdir, basename = os.path.split(fn)
@@ -48,9 +79,9 @@ def get_names(fn):
 	fname_trunc = split_char.join(fname_trunc[:-2]) # changed to [-2] now that intensity and vals are filtered
 	return fext, fname_trunc
 
-def import_info_df(fname_trunc):
-	val_fn = str(fname_trunc + '_val_filtered.csv') # changed to 'val_filtered' now that intensity and vals are filtered
-	df_info = pd.read_csv(val_fn, index_col=0)
+def import_info_df(fname_trunc, fext='.csv'):
+	val_fn = str(fname_trunc + '_val_filtered' + fext) # changed to 'val_filtered' now that intensity and vals are filtered
+	df_info = read_table(val_fn)
 	return df_info
 
 def get_bin_width(df):
@@ -71,46 +102,79 @@ def get_mean_bin_width(df):
 	df = df.merge(mean_df[['droplet number', 'Mean Bin Width']], on='droplet number')
 	return df, mean_df
 
-def calc_rand_intensities(df, fname):
-	'''Calculate random intensity values for each count within each bin.'''
-	rand_int_df = []
-
-	n = 0
-	for row in df.index:
-		count = df['count'].iloc[n]
-		binwidth = df['Mean Bin Width'].iloc[n]
-		intensity = df['bin start'].iloc[n]
-		drop_no = df['droplet number'].iloc[n]
-		for i in range(count):
-			r_intensity = intensity - 0.5 * binwidth + binwidth*np.random.random(1)
-			r_intensity = r_intensity.round(3)
-			rand_int_df.append([r_intensity[0], drop_no])
-		n += 1
-	rand_int_df = pd.DataFrame(rand_int_df, columns=['count', 'droplet number'])
+def calc_rand_intensities(df, fname, seed=None):
+	'''Calculate random intensity values for each count within each bin. Every count of a bin is repeated once and
+	drawn uniformly from the bin start +/- half the mean bin width, all in one draw.'''
+	rng = np.random.default_rng(seed)
+	count = df['count'].to_numpy()
+	binwidth = np.repeat(df['Mean Bin Width'].to_numpy(), count)
+	intensity = np.repeat(df['bin start'].to_numpy(), count)
+	drop_no = np.repeat(df['droplet number'].to_numpy(), count)
+
+	r_intensity = intensity - 0.5 * binwidth + binwidth*rng.random(len(intensity))
+	r_intensity = r_intensity.round(3)
+	rand_int_df = pd.DataFrame({'count': r_intensity, 'droplet number': drop_no})
 	rand_int_df.to_csv(fname + '_generated_intensities.csv')
 	return rand_int_df
 
-def get_skew(rand_int_df, fname, df_info):
-	'''Calculate the skew for each droplet based on the generated intensity values. -- which skew'''
-	skews = rand_int_df.groupby(['droplet number'], sort=False)['count'].apply(pd.DataFrame.skew)
-	skews = pd.DataFrame(skews)
+def sample_moments(rand_int_df):
+	'''Count, second, third and fourth central moment sums of the generated intensities of each droplet, found
+	with grouped sums instead of a per-droplet apply.'''
+	drop_no, group = np.unique(rand_int_df['droplet number'].to_numpy(), return_inverse=True)
+	vals = rand_int_df['count'].to_numpy()
+	count = np.bincount(group)
+	mean = np.bincount(group, weights=vals) / count
+	adjusted = vals - mean[group]
+	adjusted2 = adjusted**2
+	m2 = np.bincount(group, weights=adjusted2)
+	m3 = np.bincount(group, weights=adjusted2*adjusted)
+	m4 = np.bincount(group, weights=adjusted2**2)
+	return pd.DataFrame({'droplet number': drop_no, 'n': count, 'm2': m2, 'm3': m3, 'm4': m4})
+
+def bin_moments(df):
+	'''Count and central moment sums of each droplet straight from its histogram. Each bin is treated as its count of
+	intensities spread uniformly over the bin start +/- half the mean bin width, which is the distribution
+	calc_rand_intensities samples from, so the moments are its exact (noise free) values.'''
+	drop_no, group = np.unique(df['droplet number'].to_numpy(), return_inverse=True)
+	weight = df['count'].to_numpy().astype(float)
+	start = df['bin start'].to_numpy()
+	h2 = (0.5 * df['Mean Bin Width'].to_numpy())**2
+	count = np.bincount(group, weights=weight)
+	mean = np.bincount(group, weights=weight*start) / count
+	d = start - mean[group]
+	m2 = np.bincount(group, weights=weight*(d**2 + h2/3.))
+	m3 = np.bincount(group, weights=weight*(d**3 + d*h2))
+	m4 = np.bincount(group, weights=weight*(d**4 + 2.*d**2*h2 + h2**2/5.))
+	return pd.DataFrame({'droplet number': drop_no, 'n': count, 'm2': m2, 'm3': m3, 'm4': m4})
+
+def pixel_skew_kurt(df_info):
+	'''The skew and kurtosis columns of the final data from the exact pixel statistics of the _val_filtered file.'''
+	if 'Intensity skew' not in df_info.columns:
+		raise ValueError('The _val_filtered file has no pixel statistics; run without --pixels')
+	df_info = df_info.copy()
+	df_info['skew'] = df_info['Intensity skew']
+	df_info['kurtosis'] = df_info['Intensity kurtosis']
+	return df_info
+
+def get_skew(moments, fname, df_info):
+	'''Calculate the skew for each droplet from its moment sums. -- which skew: the adjusted Fisher-Pearson
+	coefficient, the same as pd.DataFrame.skew.'''
+	value = skew_from_moments(moments['n'], moments['m2'], moments['m3'])
+	skews = pd.DataFrame({'droplet number': moments['droplet number'], 'value': value})
 	skews = skews.round(decimals=5)
-	skews.reset_index(level=0, inplace=True)
 	skews['Measurement'] = 'Skew'
-	skews = skews.rename(columns={'count': 'value'})
 
 	df_info = df_info.merge(skews[['droplet number', 'value']], on='droplet number')
 	df_info = df_info.rename(columns={'value': 'skew'})
 	return skews, df_info
 
-def get_kurtosis(rand_int_df, fname, df_info):
-	'''Generate the kurtosis for each droplet based on the generated intensity values. -- which kurt'''
-	kurt = rand_int_df.groupby(['droplet number'], sort=False)['count'].apply(pd.DataFrame.kurt)
-	kurt = pd.DataFrame(kurt)
+def get_kurtosis(moments, fname, df_info):
+	'''Generate the kurtosis for each droplet from its moment sums. -- which kurt: Fisher's excess kurtosis with
+	the bias correction of pd.DataFrame.kurt.'''
+	value = kurtosis_from_moments(moments['n'], moments['m2'], moments['m4'])
+	kurt = pd.DataFrame({'droplet number': moments['droplet number'], 'value': value})
 	kurt = kurt.round(decimals=5)
-	kurt.reset_index(level=0, inplace=True)
 	kurt['Measurement'] = 'Kurtosis'
-	kurt = kurt.rename(columns={'count': 'value'})
 
 	df_info = df_info.merge(kurt[['droplet number', 'value']], on='droplet number')
 	df_info = df_info.rename(columns={'value': 'kurtosis'})
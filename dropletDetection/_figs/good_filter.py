@@ -8,24 +8,29 @@ __version__ = "1.0"
 import pandas as pd
 import sys
 import os
+import argparse
 
-'''This file takes in the _values.csv file and separates the "good" droplets which the user gives as input in a comma-separated list.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_io import read_table, write_table, read_intensity, write_intensity
+from droplet_store import store_result
+
+'''This file takes in the _values.csv file (or _values file of a binary format, see droplet_io.py) and separates the "good" droplets which the user gives as input in a comma-separated list.
 It then save the _values.csv and _intensity.csv files with only these "good" values remaining. This is to be used when it is easier 
-to label the correctly-detected droplets.'''
+to label the correctly-detected droplets. With --store $file the filtered tables are also added to that SQLite results store (see droplet_store.py).'''
 
 def main():
-    if len(sys.argv)==1:
-        print("Need to specify file to process as a parameter.")
-        print("   Exiting")
-        exit()
+    parser = argparse.ArgumentParser(description='Keep only the good droplets of a _values file.')
+    parser.add_argument('fn', help='_values file to filter')
+    parser.add_argument('--store', default='', help='SQLite results store to also add the filtered tables to')
+    args = parser.parse_args()
 
-    fn = sys.argv[1] 
+    fn = args.fn
     short_fn, fn_inten, val_ext, int_ext = get_fnames(fn)
     good = list([int(x) for x in input('\nProvide the list of good droplets separated by ",": ').split(',')])
     good.sort()
     good = pd.Series(good).unique()
-    filter_df_val(fn, good, short_fn, val_ext)
-    filter_df_int(fn_inten, good, short_fn, int_ext)
+    filter_df_val(fn, good, short_fn, val_ext, args.store)
+    filter_df_int(fn_inten, good, short_fn, int_ext, args.store)
 
 def get_fnames(fn):
     basdir, basename = os.path.split(fn)
@@ -35,21 +40,24 @@ def get_fnames(fn):
     fn_short = fn_short[:-1]
     fn_short = '_'.join([str(elem) for elem in fn_short])
 
-    int_fn = fn_short + '_intensity.csv'
-    ext_val = '_val_filtered.csv'
-    ext_int = '_intensity_filtered.csv'
+    int_fn = fn_short + '_intensity' + fext
+    ext_val = '_val_filtered' + fext
+    ext_int = '_intensity_filtered' + fext
     return fn_short, int_fn, ext_val, ext_int
 
-def filter_df_val(fname, good, fn_short, ext):
-    df = pd.read_csv(fname, index_col=0)
-    df_filtered = df.filter(items=good, axis=0)
-    df_filtered.to_csv(fn_short + ext)
+def filter_df_val(fname, good, fn_short, ext, store=''):
+    df = read_table(fname)
+    good = df['droplet number'].isin(good)
+    df_filtered = df[good]
+    write_table(df_filtered, fn_short + ext)
+    store_result(store, 'val_filtered', df_filtered, fn_short)
 
-def filter_df_int(fname, good, fn_short, ext):
-    df = pd.read_csv(fname, index_col=0)
+def filter_df_int(fname, good, fn_short, ext, store=''):
+    df = read_intensity(fname)
     good = df['droplet number'].isin(good)
     df_filtered = df[good]
-    df_filtered.to_csv(fn_short + ext)
+    write_intensity(df_filtered, fn_short + ext)
+    store_result(store, 'intensity_filtered', df_filtered, fn_short)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+
+'''NumPy version of the pre-processing/nd2_brightness_adjust_fiji.py steps, so that the brightness-adjusted 8-bit
+image used for circle detection can be made from the raw .nd2 image in memory instead of in Fiji:
+    - to8bit: ImageJ's "8-bit" conversion, which scales the display range (the min and max pixel value of the image
+      when it is opened with Bio-Formats) to 0-255
+    - kota_miura_brightness: the "Auto" brightness/contrast limits of the 8-bit image
+    - apply_min_max: ImageJ's setMinAndMax followed by "Apply LUT"
+auto_brightness runs all three, the same as the Fiji script does before saving the .tif file.'''
+
+def to8bit(img):
+    '''Converts an image to 8-bit the way ImageJ does, scaling the range from the image min to max onto 0-255.
+    8-bit images are returned unchanged.'''
+    img = np.asarray(img)
+    if img.dtype == np.uint8:
+        return img
+    imin = float(np.min(img))
+    imax = float(np.max(img))
+    scale = 256./(imax - imin + 1)
+    img8 = (img.astype(np.float64) - imin)*scale + 0.5
+    img8 = np.clip(img8, 0, 255).astype(np.uint8)
+    return img8
+
+def kota_miura_brightness(img8):
+    '''Taken and updated from script by Kota Miura (2015) found at:
+    http://wiki.cmci.info/documents/120206pyip_cooking/python_imagej_cookbook#automatic_brightnesscontrast_button
+    Same logic as kotaMiuraBrightness in the Fiji script. Bins of the 256-bin histogram with more than a tenth of all
+    pixels are ignored, and hmin and hmax are the first bins from the bottom and from the top with more than
+    1/5000 of all pixels. Returns threshold, limit, hmin, hmax.'''
+    autoThreshold = 5000
+    pixel_count = img8.size
+    limit = int(pixel_count/10)
+    threshold = int(pixel_count/autoThreshold)
+    histogram = np.bincount(img8.ravel(), minlength=256)[:256]
+
+    counts = np.where(histogram > limit, 0, histogram)
+    found = np.flatnonzero(counts > threshold)
+    if len(found) == 0:
+        hmin, hmax = 255, 0
+    else:
+        hmin, hmax = int(found[0]), int(found[-1])
+    return threshold, limit, hmin, hmax
+
+def apply_min_max(img8, hmin, hmax):
+    '''Sets the display range of an 8-bit image to hmin-hmax and applies it to the pixel values (ImageJ's
+    setMinAndMax and "Apply LUT"). As in ImageJ, nothing is changed if hmax is below hmin.'''
+    if hmax < hmin:
+        return img8
+    lut = (256.*(np.arange(256) - hmin)/(hmax - hmin + 1)).astype(int)
+    lut = np.clip(lut, 0, 255).astype(np.uint8)
+    return lut[img8]
+
+def auto_brightness(img):
+    '''Brightness-adjusted 8-bit copy of a raw image, the in-memory equivalent of the .tif files saved by
+    pre-processing/nd2_brightness_adjust_fiji.py.'''
+    img8 = to8bit(img)
+    threshold, limit, hmin, hmax = kota_miura_brightness(img8)
+    return apply_min_max(img8, hmin, hmax)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import pandas as pd
+
+import os
+import time
+import argparse
+import threading
+from glob import glob
+from multiprocessing import Pool
+
+import droplet_hough
+from headless_nd2_scaled_droplet import read_params, read_images, process_file, process_nd2_frames, RADIUS_RANGES
+from droplet_io import FORMATS
+from droplet_pipeline import prefetch, PREFETCH_DEPTH, IO_THREADS
+
+'''Runs headless_nd2_scaled_droplet.py on many .nd2 files at once, for example all timepoints of a time series.
+Files can be given as directories (every .nd2 file in them is used), glob patterns, or file names, and all files are
+processed with the same parameter file. Images are spread over a pool of processes, one image per process at a time.
+
+    python batch_nd2_droplets.py $directory_or_pattern [...] --params $parameter_file --processes 8
+
+The result of every file is recorded in a manifest (_figs/batch_manifest.csv by default) as soon as the file
+finishes. Running the same command again skips the files the manifest lists as done, so an interrupted run resumes
+where it stopped and files which failed are retried. Output files are the same as running the headless script
+on each file, including a _runvalues.csv with the parameters used. With --store, every worker also adds its results
+to one SQLite results store (see droplet_store.py), which is safe to write from many processes at once. With --cache, the workers share one cache directory of edge maps and
+Hough peaks (see droplet_cache.py), so re-running the batch with other filtering parameters skips the Hough search.
+
+Reading is overlapped with detection: the main process reads and decodes the next images (.nd2 and .tif) on
+--io-threads threads while the workers search the current ones, and hands them to the workers as they become free.
+At most --prefetch images wait beyond the ones being processed, so memory stays bounded. Each worker writes its
+results on a writer thread (see droplet_pipeline.py), and a file is only recorded as done once its results are
+written. With --all-frames each worker reads the frames of its file ahead itself. --prefetch 0 lets the workers
+read their own images, as before.'''
+
+MANIFEST_COLUMNS = ['Filename', 'Status', 'Seconds', 'Error']
+
+def main():
+    parser = argparse.ArgumentParser(description='Droplet detection on many .nd2 files.')
+    parser.add_argument('files', nargs='+', help='.nd2 files, glob patterns or directories of .nd2 files')
+    parser.add_argument('--params', default=None, help='parameter file (.csv in the _runvalues.csv format)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of images processed at once')
+    parser.add_argument('--manifest', default='_figs/batch_manifest.csv', help='file recording the status of each file')
+    parser.add_argument('--no-tif', action='store_true', help='brightness-adjust the .nd2 images instead of reading .tif files')
+    parser.add_argument('--all-frames', action='store_true', help='process every frame of multi-frame .nd2 files')
+    parser.add_argument('--format', choices=list(FORMATS), default=None, help='format of the _values and _intensity files')
+    parser.add_argument('--no-figures', action='store_true', help='skip the _compimg and _mask images')
+    parser.add_argument('--radius-range', choices=RADIUS_RANGES, default=None,
+                        help='auto: search only the radii estimated from each image, within min and max radius')
+    parser.add_argument('--store', default=None, help='SQLite file all workers also add the results to')
+    parser.add_argument('--cache', default=None, help='directory all workers cache edge maps and Hough peaks in')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_DEPTH, help='images read ahead of the workers')
+    parser.add_argument('--io-threads', type=int, default=IO_THREADS, help='threads reading images ahead')
+    args = parser.parse_args()
+
+    files = find_files(args.files)
+    done = read_manifest(args.manifest)
+    todo = [fn for fn in files if fn not in done]
+    print("%d files found, %d already done, %d to process" % (len(files), len(files) - len(todo), len(todo)))
+    if len(todo) == 0:
+        return
+
+    params = read_params(args.params)
+    if args.no_tif:
+        params['brightness'] = 'auto'
+    if args.format is not None:
+        params['format'] = args.format
+    if args.no_figures:
+        params['figures'] = 'none'
+    if args.radius_range is not None:
+        params['radius_range'] = args.radius_range
+    if args.store is not None:
+        params['store'] = args.store
+    if args.cache is not None:
+        params['cache'] = args.cache
+    os.makedirs('_figs', exist_ok=True)
+    manifest_dir = os.path.dirname(args.manifest)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    processes = min(args.processes, len(todo))
+    with Pool(processes, initializer=init_worker) as pool:
+        if args.prefetch > 0 and not args.all_frames:
+            # a job holds its images until its result comes back, so one slot per worker bounds the jobs handed out
+            slots = threading.BoundedSemaphore(processes)
+            jobs = prefetched_jobs(todo, params, slots, args.prefetch, args.io_threads)
+        else:
+            slots = None
+            jobs = ((fn, params, args.all_frames, None) for fn in todo)
+        for result in pool.imap_unordered(run_file, jobs):
+            if slots is not None:
+                slots.release()
+            write_manifest(args.manifest, result)
+            print("%s: %s (%.1f s)" % (result['Filename'], result['Status'], result['Seconds']))
+    print('Done')
+
+def prefetched_jobs(files, params, slots, depth, threads):
+    '''Jobs for run_file with the images of each file already read, on threads I/O threads up to depth files
+    ahead. Runs on the task thread of the pool, which takes every job it can: waiting for a free slot before each
+    job is what stops it from reading the whole batch into memory.'''
+    for job in prefetch(lambda fn: read_job(fn, params), files, depth, threads):
+        slots.acquire()
+        yield job
+
+def read_job(fn, params):
+    '''run_file job of one file with its images, or with the read error, which run_file records as its failure.'''
+    try:
+        return fn, params, False, read_images(fn, params)
+    except Exception as e:
+        return fn, params, False, e
+
+def find_files(patterns):
+    '''Expands the directories and glob patterns given on the command line into a sorted list of .nd2 files.'''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(glob(os.path.join(pattern, '*.nd2')))
+        else:
+            files.extend(glob(pattern))
+    return sorted(set(files))
+
+def read_manifest(manifest):
+    '''Returns the set of files the manifest lists as done. A file which was retried after failing is done if its
+    last entry is.'''
+    if not os.path.exists(manifest):
+        return set()
+    df = pd.read_csv(manifest)
+    last = df.drop_duplicates(subset='Filename', keep='last')
+    return set(last.loc[last['Status'] == 'done', 'Filename'])
+
+def write_manifest(manifest, result):
+    '''Appends the result of one file to the manifest. Only the main process writes the manifest, so lines from
+    different workers can not interleave.'''
+    df = pd.DataFrame([result], columns=MANIFEST_COLUMNS)
+    header = not os.path.exists(manifest)
+    df.to_csv(manifest, mode='a', header=header, index=False)
+
+def init_worker():
+    '''Pool initializer. Limits scipy.fft to one thread per worker, as droplet_hough does for its own pools, so that
+    the processes do not each start a thread for every core.'''
+    droplet_hough.FFT_WORKERS = 1
+
+def run_file(job):
+    '''Runs in a pool worker: processes one file and returns its manifest entry. Errors are caught and recorded
+    so that one bad file does not stop the batch. Radii groups are searched in this one process (workers=1),
+    since the pool already keeps every core busy. images are the images read ahead by the main process (or the
+    error reading them), or None to read them here.'''
+    fn, params, all_frames, images = job
+    start = time.time()
+    try:
+        if isinstance(images, Exception):
+            raise images
+        if all_frames:
+            process_nd2_frames(fn, params, workers=1)
+        else:
+            process_file(fn, params, workers=1, images=images)
+        status, error = 'done', ''
+    except Exception as e:
+        status, error = 'failed', '%s: %s' % (type(e).__name__, e)
+    return {'Filename': fn, 'Status': status, 'Seconds': round(time.time() - start, 2), 'Error': error}
+
+
+if __name__ == '__main__':
+    main()
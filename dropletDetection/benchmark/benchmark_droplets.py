@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import itertools
+from contextlib import contextmanager
+from multiprocessing import Pool
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '_figs'))
+from synthetic_droplets import synthetic_image
+from droplet_trace import peak_rss_mb, StageTrace
+from auto_brightness import auto_brightness
+from headless_nd2_scaled_droplet import read_params, group_radii, sequential_drop_detection, remove_low_accum
+from headless_nd2_scaled_droplet import remove_overlap, write_drops_csv, circle_mask, mask_image, intensity_of_droplets
+from headless_nd2_scaled_droplet import comparison_image
+from generating_skew_kurt_dno import skew_kurt_file
+
+'''Speed and accuracy benchmark of the droplet detection pipeline on synthetic images (synthetic_droplets.py) with a
+known answer. Every combination of image size, number of droplets and radius range given is one case:
+
+    python benchmark_droplets.py --sizes 512,1024,2048 --drops 50,200 --radii 12-40 [--params $parameter_file]
+                                 [--voting gradient]
+
+Each case runs the same steps as headless_nd2_scaled_droplet.py on one image (the full single process search of
+sequential_drop_detection with the same parameters, on the brightness-adjusted image made by auto_brightness.py),
+followed by the skew and kurtosis script, and times each stage on its own (hough_circle is the building of the
+accumulators and hough_circle_peaks the peak search of each radii group, the 'hough' and 'peaks' stages of the
+trace; see TRACE_STAGES):
+    canny, hough_circle, hough_circle_peaks, remove_low_accum, remove_overlap, circle_mask,
+    intensity_of_droplets, figures (_compimg and _mask images) and skew_kurtosis (generating_skew_kurt_dno.py)
+Time spent between the stages (sorting peaks, writing the _values file, ...) is reported as "other".
+
+Detected droplets are matched one to one with the true droplets (see match_droplets) to give the recall (fraction of
+true droplets found) and precision (fraction of detected droplets which are real), the mean radius error, and the
+mean skew and kurtosis error of the matched droplets. Each case runs in a fresh process so that its peak memory
+(RSS) is its own. All output files and benchmark_results.csv are written to --outdir.'''
+
+STAGES = ['canny', 'hough_circle', 'hough_circle_peaks', 'remove_low_accum', 'remove_overlap', 'circle_mask',
+          'intensity_of_droplets', 'figures', 'skew_kurtosis']
+# benchmark stage of each droplet_trace stage recorded by the detection
+TRACE_STAGES = {'edges': 'canny', 'hough': 'hough_circle', 'peaks': 'hough_circle_peaks',
+                'remove_low_accum': 'remove_low_accum', 'remove_overlap': 'remove_overlap'}
+MATCH_CENTER = 0.2      # largest center distance of a match, as a fraction of the true radius (at least 3 px)
+MATCH_RADIUS = 0.1      # largest radius difference of a match, as a fraction of the true radius (at least 2 px)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark droplet detection on synthetic images.')
+    parser.add_argument('--sizes', default='512,1024,2048', help='comma-separated image widths (and heights) in pixels')
+    parser.add_argument('--drops', default='50,200', help='comma-separated numbers of droplets')
+    parser.add_argument('--radii', default='12-40', help='comma-separated droplet radius ranges, min-max in pixels')
+    parser.add_argument('--params', default=None, help='parameter file for detection (radii are set from each case)')
+    parser.add_argument('--figures', choices=['raster', 'matplotlib', 'none'], default='raster', help='figure output')
+    parser.add_argument('--voting', choices=['circle', 'gradient'], default=None, help='Hough voting of the search')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic images')
+    parser.add_argument('--outdir', default='_bench', help='directory for output files and benchmark_results.csv')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    drops = [int(n) for n in args.drops.split(',')]
+    radii = [tuple(int(r) for r in rr.split('-')) for rr in args.radii.split(',')]
+    params = read_params(args.params)
+    params['figures'] = args.figures
+    if args.voting is not None:
+        params['voting'] = args.voting
+    cases = [(size, num, rmin, rmax, args.seed, params) for size, num, (rmin, rmax)
+             in itertools.product(sizes, drops, radii)]
+
+    os.makedirs(os.path.join(args.outdir, '_figs'), exist_ok=True)
+    os.chdir(args.outdir)
+    results = []
+    with Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+            print("%s: %.2f s, recall %.3f, precision %.3f, peak RSS %.0f MB" % (result['Case'],
+                  result['Total (s)'], result['Recall'], result['Precision'], result['Peak RSS (MB)']))
+
+    df = pd.DataFrame(results)
+    df.to_csv('benchmark_results.csv')
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df.drop(columns=['Case']).round(3).to_string())
+    print('Done')
+
+@contextmanager
+def stage(times, name):
+    '''Adds the wall time of the with-block to times[name].'''
+    start = time.perf_counter()
+    yield
+    times[name] += time.perf_counter() - start
+
+def run_case(case):
+    '''Runs in a fresh pool process: makes the synthetic image of one case, runs and times every stage, and scores
+    the detected droplets against the ground truth. Returns one row of benchmark_results.csv.'''
+    size, num, rmin, rmax, seed, params = case
+    name = 'bench_s%d_n%d_r%d-%d' % (size, num, rmin, rmax)
+    params = dict(params, min_rad=max(rmin - 2, 1), max_rad=rmax + 3)
+    start_rss = peak_rss_mb()
+
+    raw, truth = synthetic_image((size, size), num, rmin, rmax, seed)
+    comp_img = auto_brightness(raw)
+
+    times = dict.fromkeys(STAGES, 0.)
+    start = time.perf_counter()
+    drops = detect(raw, comp_img, params, times, name)
+    cx, cy, radii = drops['X (pixels)'], drops['Y (pixels)'], drops['Radius (pixels)']
+    with stage(times, 'circle_mask'):
+        mask, drop_pix = circle_mask(comp_img, cx, cy, radii, name, 'none')
+    with stage(times, 'intensity_of_droplets'):
+        intensity_of_droplets(raw, drop_pix, radii, name)
+    with stage(times, 'figures'):
+        mask_image(comp_img, mask, name, params['figures'])
+        comparison_image(comp_img, cx, cy, radii, drops['Probability count'], name, params['figures'])
+    final = skew_kurtosis(name, times)
+    total = time.perf_counter() - start
+
+    result = {'Case': name, 'Image size (px)': size, 'Droplets': len(truth), 'Min radius (px)': rmin,
+              'Max radius (px)': rmax}
+    for s in STAGES:
+        result['%s (s)' % s] = times[s]
+    result['other (s)'] = total - sum(times.values())
+    result['Total (s)'] = total
+    result['Start RSS (MB)'] = start_rss
+    result['Peak RSS (MB)'] = peak_rss_mb()
+    result.update(score(final, truth))
+    return result
+
+def detect(raw, comp_img, params, times, name):
+    '''Detection as in process_frame: sequential_drop_detection (the full search in one process, as the CLI runs
+    it with the same params) followed by the final remove_low_accum and remove_overlap over all radii groups. The
+    time of each stage is taken from its StageTrace records (see TRACE_STAGES). Writes the _values.csv file and
+    returns the detected droplets.'''
+    hr_group = group_radii(np.arange(params['min_rad'], params['max_rad'], params['step']))
+    min_ac_relative = params['min_ac_relative']
+    trace = StageTrace(name=name)
+
+    drops_df, num_drops = sequential_drop_detection(raw, comp_img, hr_group, min_ac_relative, name,
+                                                    params['num_drops'], 1, None, params, trace)
+    cx = np.array(drops_df['X (pixels)'])
+    cy = np.array(drops_df['Y (pixels)'])
+    radii = np.array(drops_df['Radius (pixels)'])
+    accums = np.array(drops_df['Probability count'])
+    with trace.stage('remove_low_accum', radii='all'):
+        cx, cy, radii, accums = remove_low_accum(accums, cx, cy, radii, min_ac_relative, name)
+    with trace.stage('remove_overlap', radii='all'):
+        cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums)
+    for rec in trace.records:
+        times[TRACE_STAGES[rec['stage']]] += rec['wall_s']
+    write_drops_csv(cx, cy, radii, accums, name, '0', 1.)
+    return pd.DataFrame({'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii, 'Probability count': accums})
+
+def skew_kurtosis(name, times):
+    '''Runs the skew and kurtosis script on the unfiltered results, copied to the _filtered names the script
+    expects (as when there are no artifacts to remove). Returns the final data.'''
+    os.chdir('_figs')
+    try:
+        shutil.copy('%s_values.csv' % name, '%s_val_filtered.csv' % name)
+        shutil.copy('%s_intensity.csv' % name, '%s_intensity_filtered.csv' % name)
+        with stage(times, 'skew_kurtosis'):
+            final = skew_kurt_file('%s_intensity_filtered.csv' % name, seed=0)
+    finally:
+        os.chdir('..')
+    return final
+
+def match_droplets(found, truth):
+    '''Matches detected droplets to true droplets one to one. In detection order, each detected droplet is matched
+    to the nearest unmatched true droplet whose center is within MATCH_CENTER and radius within MATCH_RADIUS of the
+    true radius. Returns the indices of the matched found and true droplets.'''
+    t_xy = truth[['X (pixels)', 'Y (pixels)']].to_numpy(dtype=float)
+    t_r = truth['Radius (pixels)'].to_numpy(dtype=float)
+    f_xy = found[['X (pixels)', 'Y (pixels)']].to_numpy(dtype=float)
+    f_r = found['Radius (pixels)'].to_numpy(dtype=float)
+    if len(t_r) == 0 or len(f_r) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    tree = cKDTree(t_xy)
+    reach = max(3., MATCH_CENTER*t_r.max())
+    taken = np.zeros(len(t_r), dtype=bool)
+    f_match, t_match = [], []
+    for i, near in enumerate(tree.query_ball_point(f_xy, reach)):
+        near = np.array(near, dtype=int)
+        if len(near) == 0:
+            continue
+        dist = np.hypot(*(t_xy[near] - f_xy[i]).T)
+        ok = (~taken[near] & (dist <= np.maximum(3., MATCH_CENTER*t_r[near]))
+              & (np.abs(f_r[i] - t_r[near]) <= np.maximum(2., MATCH_RADIUS*t_r[near])))
+        if np.any(ok):
+            j = near[ok][np.argmin(dist[ok])]
+            taken[j] = True
+            f_match.append(i)
+            t_match.append(j)
+    return np.array(f_match, dtype=int), np.array(t_match, dtype=int)
+
+def score(final, truth):
+    '''Accuracy of the final data against the ground truth.'''
+    final = final.reset_index(drop=True)
+    f_match, t_match = match_droplets(final, truth)
+    matched_f, matched_t = final.iloc[f_match], truth.iloc[t_match]
+
+    def mean_error(col):
+        if len(f_match) == 0:
+            return np.nan
+        return np.nanmean(np.abs(matched_f[col].to_numpy(dtype=float) - matched_t[col].to_numpy(dtype=float)))
+
+    return {'Detected': len(final), 'Matched': len(f_match),
+            'Recall': len(f_match)/max(len(truth), 1), 'Precision': len(f_match)/max(len(final), 1),
+            'Radius error (px)': mean_error('Radius (pixels)'), 'Skew error': mean_error('skew'),
+            'Kurtosis error': mean_error('kurtosis')}
+
+
+if __name__ == '__main__':
+    main()
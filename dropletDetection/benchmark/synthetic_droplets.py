@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import scipy.ndimage as ndi
+
+import os
+import sys
+import argparse
+import imageio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from auto_brightness import auto_brightness
+
+'''Synthetic droplet micrographs with a known answer, for benchmark_droplets.py and for trying parameters without
+a microscope image. Each image is a 16-bit "raw" image like a single .nd2 frame: a dim, noisy background with
+non-overlapping bright droplets of random radius. The pixel values inside each droplet follow a gamma distribution
+with its own mean and shape, so that droplets have different skew and kurtosis, the same way droplets with more
+or less assembled nanotubes do. Droplet rims are slightly blurred and camera noise is added last.
+
+The ground truth of every droplet is its center, radius, and the mean, skew and kurtosis of the final image pixels
+inside it (the pixels circle_pixels in headless_nd2_scaled_droplet.py picks for a perfectly detected circle), with
+the same skew and kurtosis formulas as the _final_data files. Run on its own, the script saves an image set:
+
+    python synthetic_droplets.py $name --size 1024 --drops 100 --min-rad 12 --max-rad 40 --seed 0
+
+which writes $name.tif (raw, 16-bit), $name_8bit.tif (brightness adjusted, like the Fiji .tif files) and
+$name_truth.csv.'''
+
+BACKGROUND = 400            # mean background pixel value of the raw image
+NOISE = 25                  # standard deviation of the camera noise
+DROP_MEAN = (1500, 3500)    # range of the mean pixel value of a droplet
+DROP_SHAPE = (2, 30)        # range of the gamma shape of a droplet: skew 2/sqrt(shape), excess kurtosis 6/shape
+RIM_BLUR = 0.7              # sigma of the blur of the droplet rims
+GAP = 2                     # smallest distance between the perimeters of two droplets
+
+TRUTH_COLUMNS = ['droplet number', 'X (pixels)', 'Y (pixels)', 'Radius (pixels)', 'Mean', 'skew', 'kurtosis']
+
+def main():
+    parser = argparse.ArgumentParser(description='Make a synthetic droplet image with its ground truth.')
+    parser.add_argument('name', help='name of the files to write')
+    parser.add_argument('--size', type=int, default=1024, help='image width and height in pixels')
+    parser.add_argument('--drops', type=int, default=100, help='number of droplets')
+    parser.add_argument('--min-rad', type=int, default=12, help='smallest droplet radius in pixels')
+    parser.add_argument('--max-rad', type=int, default=40, help='largest droplet radius in pixels')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    raw, truth = synthetic_image((args.size, args.size), args.drops, args.min_rad, args.max_rad, args.seed)
+    write_image_set(args.name, raw, truth)
+    print('%d droplets written to %s' % (len(truth), args.name))
+
+def place_droplets(shape, num_drops, min_rad, max_rad, rng, tries=50):
+    '''Random centers and radii of up to num_drops droplets which lie fully inside the image and are at least GAP
+    pixels apart. Candidates are drawn in batches and accepted one at a time; fewer droplets are returned if the
+    image is too crowded to fit them all after tries batches.'''
+    rows, cols = shape
+    cx, cy, radii = np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    for attempt in range(tries):
+        need = num_drops - len(radii)
+        if need <= 0:
+            break
+        r = rng.integers(min_rad, max_rad + 1, 2*need)
+        x = rng.integers(r, cols - r)
+        y = rng.integers(r, rows - r)
+        for xi, yi, ri in zip(x, y, r):
+            if len(radii) >= num_drops:
+                break
+            if np.all((cx - xi)**2 + (cy - yi)**2 >= (radii + ri + GAP)**2):
+                cx, cy, radii = np.append(cx, xi), np.append(cy, yi), np.append(radii, ri)
+    return cx, cy, radii
+
+def disk_pixels(shape, cx, cy, radius):
+    '''Rows and columns of the pixels inside a circle, by the same rule as circle_pixels.'''
+    y0, y1 = max(cy - radius, 0), min(cy + radius + 1, shape[0])
+    x0, x1 = max(cx - radius, 0), min(cx + radius + 1, shape[1])
+    y, x = np.ogrid[y0:y1, x0:x1]
+    circy, circx = np.nonzero((x - cx)**2 + (y - cy)**2 < radius**2)
+    return circy + y0, circx + x0
+
+def pixel_stats(vals):
+    '''Mean, skew and excess kurtosis of pixel values, with the bias corrections of pd.Series.skew and .kurt.'''
+    vals = pd.Series(vals.astype(float))
+    return vals.mean(), vals.skew(), vals.kurt()
+
+def synthetic_image(shape, num_drops, min_rad, max_rad, seed=0):
+    '''Makes a raw 16-bit droplet image and its ground truth (a DataFrame with TRUTH_COLUMNS).'''
+    rng = np.random.default_rng(seed)
+    cx, cy, radii = place_droplets(shape, num_drops, min_rad, max_rad, rng)
+
+    signal = np.zeros(shape)
+    inside = np.zeros(shape, dtype=bool)
+    pix = []
+    for x, y, r in zip(cx, cy, radii):
+        rows, cols = disk_pixels(shape, x, y, r)
+        k = rng.uniform(*DROP_SHAPE)
+        signal[rows, cols] = rng.uniform(*DROP_MEAN)*rng.gamma(k, 1./k, len(rows))
+        inside[rows, cols] = True
+        pix.append((rows, cols))
+
+    # blur only the rims, so the texture inside the droplets keeps its distribution
+    blurred = ndi.gaussian_filter(signal, RIM_BLUR)
+    rim = inside ^ ndi.binary_erosion(inside, iterations=2)
+    signal[rim] = blurred[rim]
+    raw = BACKGROUND + signal + rng.normal(0, NOISE, shape)
+    raw = np.clip(np.rint(raw), 0, 65535).astype(np.uint16)
+
+    stats = np.array([pixel_stats(raw[rows, cols]) for rows, cols in pix]).reshape(-1, 3)
+    truth = pd.DataFrame({'droplet number': np.arange(len(radii)), 'X (pixels)': cx, 'Y (pixels)': cy,
+                          'Radius (pixels)': radii, 'Mean': stats[:, 0], 'skew': stats[:, 1],
+                          'kurtosis': stats[:, 2]}, columns=TRUTH_COLUMNS)
+    return raw, truth
+
+def write_image_set(name, raw, truth):
+    '''Saves the raw image, its brightness-adjusted 8-bit version and the ground truth.'''
+    imageio.imwrite(name + '.tif', raw)
+    imageio.imwrite(name + '_8bit.tif', auto_brightness(raw))
+    truth.to_csv(name + '_truth.csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+
+import os
+import time
+import hashlib
+import tempfile
+
+from droplet_hough import detect_edges, tiled_edges, radius_peaks, hough_peaks_parallel, sort_peaks
+from droplet_hough import CANNY_SIGMA, CANNY_LOW, CANNY_HIGH
+
+'''On-disk cache of the edge map and the raw Hough peaks of every radius of an image, so that re-running an image
+with different filtering parameters (min_ac_relative, num_drops, the overlap factor) skips edge detection and the
+Hough search and only redoes the filtering. Entries are content-addressed:
+    - the edge map by a hash of the brightness-adjusted pixels and the Canny parameters (tiled_edges gives the same
+      edge map as detect_edges, so the tile size is not part of the key),
+    - the peaks of each radius by the key of the edge map they come from and the radius,
+so a changed image or parameter can never be given a stale entry, and a re-run with a wider radius range only
+searches the radii it has not seen. The peaks are all the peaks of each radius (slice_peaks with its default
+threshold), so they serve any filtering parameters.
+
+Each entry is one .npz file in the cache directory. Files are written under a temporary name and renamed into place,
+so several batch workers can share a cache without locks: a reader only ever sees complete files, and two workers
+writing the same entry write the same content. Reading an entry updates its modification time, and evict removes
+the least recently used entries once the directory is over its size budget. An entry another worker evicts while it
+is read is simply a miss.'''
+
+# Bump to invalidate every existing entry when the edge detection or the peak search changes
+CACHE_VERSION = 2
+# Temporary files older than this (in seconds) were left by a worker which died while writing, and are removed
+STALE_TMP_S = 3600
+
+def cache_key(*parts):
+    '''Hex digest of the parts, numpy arrays by their shape, type and bytes and everything else by its repr.'''
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(str((part.shape, part.dtype.str)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def edges_key(img):
+    '''Key of the edge map of the brightness-adjusted image img (detect_edges, or tiled_edges).'''
+    return cache_key('edges', img, CANNY_SIGMA, CANNY_LOW, CANNY_HIGH)
+
+def peaks_key(edge_key, radius):
+    '''Key of the raw peaks of one radius found in the edge map with key edge_key.'''
+    return cache_key('peaks', edge_key, int(radius))
+
+def load_arrays(cache_dir, key):
+    '''Arrays of the cache entry key as a dict, or None if the entry is missing. Marks the entry as recently used.'''
+    path = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return arrays
+
+def save_arrays(cache_dir, key, **arrays):
+    '''Writes the cache entry key, replacing it atomically if another worker wrote it first.'''
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, os.path.join(cache_dir, key + '.npz'))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def evict(cache_dir, max_mb):
+    '''Removes the least recently used entries until the cache directory holds at most max_mb megabytes, and any
+    temporary files left behind by workers which died while writing. Files another worker removed first are
+    skipped.'''
+    entries, total = [], 0
+    now = time.time()
+    try:
+        scan = list(os.scandir(cache_dir))
+    except FileNotFoundError:
+        return
+    for entry in scan:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith('.tmp'):
+            if now - stat.st_mtime > STALE_TMP_S:
+                _remove(entry.path)
+            continue
+        if entry.name.endswith('.npz'):
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_mb*2**20:
+            break
+        _remove(path)
+        total -= size
+
+def _remove(path):
+    '''os.remove which ignores files already removed by another worker.'''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def cached_edges(img, cache_dir, tile=None):
+    '''Edge map of img (tiled_edges if tile is given, else detect_edges), read from the cache if it holds it and
+    added to it otherwise. Edge maps are stored as packed bits. Returns the edge map, its key and whether it was
+    found in the cache.'''
+    key = edges_key(img)
+    arrays = load_arrays(cache_dir, key)
+    if arrays is not None:
+        edges = np.unpackbits(arrays['bits'], count=img.size).reshape(img.shape).astype(bool)
+        return edges, key, True
+    edges = tiled_edges(img, tile) if tile is not None else detect_edges(img)
+    save_arrays(cache_dir, key, bits=np.packbits(edges))
+    return edges, key, False
+
+def cached_peaks(edges, edge_key, hr_group, cache_dir, workers=1):
+    '''All peaks of every radius in hr_group, the same as hough_peaks_all_radii, sorted strongest first. The peaks
+    of radii held in the cache are read from it, and only the other radii are searched (in parallel over their
+    radii groups with workers > 1) and added to the cache. Returns accums, cx, cy, radii and the number of radii
+    found in the cache.'''
+    hough_radii = [int(r) for r in np.concatenate(hr_group)]
+    peaks = {}
+    for radius in hough_radii:
+        arrays = load_arrays(cache_dir, peaks_key(edge_key, radius))
+        if arrays is not None:
+            peaks[radius] = arrays
+    hits = len(peaks)
+
+    missing = [[int(r) for r in group if int(r) not in peaks] for group in hr_group]
+    missing = [group for group in missing if group]
+    if missing:
+        if workers > 1:
+            accums, cx, cy, radii = hough_peaks_parallel(edges, missing, workers)
+        else:
+            accums, cx, cy, radii = radius_peaks(edges, np.concatenate(missing))
+        for radius in np.concatenate(missing):
+            # the peaks of one radius keep their slice_peaks order through the stable sort of the pooled peaks
+            found = radii == radius
+            peaks[int(radius)] = {'accums': accums[found], 'cx': cx[found], 'cy': cy[found]}
+            save_arrays(cache_dir, peaks_key(edge_key, radius), **peaks[int(radius)])
+
+    accums = np.concatenate([peaks[r]['accums'] for r in hough_radii])
+    cx = np.concatenate([peaks[r]['cx'] for r in hough_radii]).astype(int)
+    cy = np.concatenate([peaks[r]['cy'] for r in hough_radii]).astype(int)
+    radii = np.concatenate([np.full(len(peaks[r]['accums']), r) for r in hough_radii]).astype(int)
+    accums, cx, cy, radii = sort_peaks(accums, cx, cy, radii)
+    return accums, cx, cy, radii, hits
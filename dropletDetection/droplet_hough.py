@@ -0,0 +1,707 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import ctypes
+
+from multiprocessing import Pool, RawArray
+from scipy import fft
+from scipy import ndimage as ndi
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.transform import hough_circle, downscale_local_mean
+from skimage.feature import canny
+from skimage.draw import circle_perimeter
+
+'''Circle detection engine used by headless_nd2_scaled_droplet.py. Instead of calling canny and hough_circle
+once per radii group, the edge map is computed a single time and the Hough accumulator for each radius is built from
+it one radius at a time, so only one accumulator slice is held in memory and the full radius range can be searched
+in one pass. Each slice is built either by direct voting (skimage hough_circle on that one radius) or by convolving
+the edge map with a ring kernel in Fourier space, whichever is cheaper: voting costs (edge pixels x perimeter points)
+and grows with the radius, the convolution costs about the same for every radius. The Fourier transform of the edge
+map is computed once and reused. Slices hold the integer vote counts in the smallest type that fits them (uint8 or
+uint16, see vote_dtype) rather than 8 byte floats, and are released as soon as their peaks are found. Peaks are
+normalized with vote_values, which gives values identical to skimage's hough_circle (normalize=True) for both ways.
+
+The radii groups can also be spread over a pool of worker processes with hough_peaks_parallel. The edge map is put
+in shared memory once and every worker reads it from there instead of receiving its own pickled copy.
+
+Overlapping circles are removed with suppress_overlap, a greedy non-maximum suppression which only compares circles
+that a KD-tree of the centers finds within reach of each other.
+
+For time series, seeded_peaks searches only small windows around the droplets found in the previous timepoint, over
+a narrow band of radii around each droplet's radius. uncovered_edges removes the edges of the circles it finds, and
+uncovered_peaks searches only the regions around the edges that are left.
+
+Images too large to search at once (stitched mosaics) can be processed in tiles with a bounded amount of memory:
+tiled_edges and tiled_peaks run edge detection and the Hough search on one tile at a time, each tile carrying a halo
+of extra pixels so that every circle with its center in the tile is found exactly as in the whole image. The tile
+size follows from a memory budget (tile_size), and tiles can be searched in parallel like the radii groups.
+
+pyramid_peaks searches the large radii on a downsampled image and refines each droplet found there at full
+resolution with seeded_peaks.
+
+estimate_radii proposes the radius range to search from a coarse search of the downsampled image.
+
+Peaks are taken out of each accumulator by slice_peaks, which gives the same peaks as skimage's hough_circle_peaks
+but only looks at the pixels above the threshold. bounded_peaks uses that to search a radii group with the
+threshold raised as it goes: to min_ac_relative times the strongest peak found so far (remove_low_accum drops
+anything weaker) and, once enough candidates are held, to the weakest one held, so weak peaks are never collected.
+
+gradient_accumulators is an alternative to hough_accumulators with the same output, in which each edge pixel only
+votes for centers along its gradient direction (edge_normals) instead of all around it: about a tenth of the votes,
+and sharper peaks in dense droplet fields, where the edges of neighbouring droplets no longer add up to false
+circles.'''
+
+# Canny smoothing and hysteresis thresholds of detect_edges, the values used for all data in 2020 paper
+CANNY_SIGMA = 3
+CANNY_LOW = 10
+CANNY_HIGH = 20
+# Approximate cost of one Fourier convolution per (padded) pixel, in units of single hough_circle votes
+FFT_VOTES_PER_PIXEL = 5
+# Threads used by scipy.fft, -1 is all cores. Set to 1 inside pool workers so processes do not compete for cores
+FFT_WORKERS = -1
+# Two circles overlap if their centers are closer than this fraction of the sum of their radii
+OVERLAP_FACTOR = 3./4.
+# Approximate peak memory of edge detection and of the Hough search of one radius, in bytes per pixel of a tile.
+# Edge detection needs the most, the search of one radius about 10 (voting) to 37 (convolution)
+TILE_BYTES_PER_PIXEL = 48
+# Extra pixels around each tile for edge detection, enough for the Gaussian smoothing (sigma=3) used by canny
+EDGE_HALO = 16
+# Downsampling factor of the coarse image searched by pyramid_peaks
+PYRAMID_SCALE = 2
+# Coarse circles weaker than this fraction of the strongest coarse circle are not refined by pyramid_peaks
+PYRAMID_THRESHOLD = 0.3
+# Downsampling factor, smallest coarse radius and fraction of the strongest coarse circle kept by estimate_radii
+ESTIMATE_SCALE = 4
+ESTIMATE_MIN_RAD = 2
+ESTIMATE_THRESHOLD = 0.45
+# Candidate circles held per radii group by bounded_peaks, as a multiple of num_drops
+PEAK_CAP_FACTOR = 4
+# Largest angle (radians) between the gradient at an edge pixel and the directions it votes along, with gradient voting
+GRADIENT_TOLERANCE = np.deg2rad(6)
+# Edge pixels whose gradient votes are cast at once, to bound the memory of the votes
+GRADIENT_CHUNK = 2**16
+
+_shared_edges = None
+
+def detect_edges(img, sigma=CANNY_SIGMA):
+    '''Canny filter on the brightness-adjusted image. These are the values used for all data in 2020 paper.
+    sigma is only changed for downsampled images, so the smoothing stays the same in full resolution pixels.'''
+    edges = canny(img, sigma=sigma, low_threshold=CANNY_LOW, high_threshold=CANNY_HIGH)
+    return edges
+
+def ring_kernel(radius):
+    '''Returns the (2r+1, 2r+1) kernel of votes one edge pixel casts for a circle of the given radius, and the number
+    of perimeter points used by hough_circle to normalize the accumulator. circle_perimeter returns a few points
+    twice, and hough_circle counts those votes twice, so the kernel is built with np.add.at to match it exactly.
+    A center gets at most one vote per perimeter point, so the votes of a radius fit in vote_dtype(num_points).'''
+    radius = int(radius)
+    kernel = np.zeros((2*radius + 1, 2*radius + 1))
+    circy, circx = circle_perimeter(radius, radius, radius)
+    np.add.at(kernel, (circy, circx), 1)
+    return kernel, len(circy)
+
+def vote_dtype(num_points):
+    '''Smallest unsigned integer type holding the votes of a radius with num_points perimeter points: uint8 up to
+    radius 44, uint16 up to radius ~11000.'''
+    return np.min_scalar_type(num_points)
+
+def vote_values(num_points):
+    '''Accumulator value of 0 to num_points votes, so that vote_values(num_points)[votes] is the normalized
+    accumulator. hough_circle adds 1/num_points for every vote, which is not always exactly votes/num_points in
+    floating point, so the values are summed the same way to match it bit for bit. They increase strictly with the
+    number of votes.'''
+    return np.concatenate(([0.], np.cumsum(np.full(num_points, 1./num_points))))
+
+def hough_accumulators(edges, hough_radii):
+    '''Generator over the radii which yields (radius, votes, num_points) for one radius at a time: the votes of every
+    center, as the compact integer type of vote_dtype (1 or 2 bytes per pixel instead of the 8 of a float
+    accumulator), and the number of perimeter points. vote_values turns votes into the accumulator of hough_circle;
+    slice_peaks finds the peaks on the votes and only normalizes the peaks. For the convolution, the edge map is padded by the
+    largest radius so that the circular convolution does not wrap around, and it is only transformed the first time
+    a radius needs it. Votes are whole numbers, so the convolution result is rounded to remove floating point noise
+    from the transform, and its float buffers are released before the slice is yielded.'''
+    rows, cols = edges.shape
+    pad = int(np.max(hough_radii))
+    fshape = (fft.next_fast_len(rows + 2*pad, real=True), fft.next_fast_len(cols + 2*pad, real=True))
+    num_edges = np.count_nonzero(edges)
+    edges_ft = None
+
+    for radius in hough_radii:
+        radius = int(radius)
+        kernel, num_points = ring_kernel(radius)
+        if num_edges*num_points < FFT_VOTES_PER_PIXEL*fshape[0]*fshape[1]:
+            votes = hough_circle(edges, radius, normalize=False)[0].astype(vote_dtype(num_points))
+        else:
+            if edges_ft is None:
+                edges_ft = fft.rfft2(edges.astype(np.float64), fshape, workers=FFT_WORKERS)
+            kernel_ft = fft.rfft(kernel, fshape[1], axis=1, workers=FFT_WORKERS)
+            kernel_ft = fft.fft(kernel_ft, fshape[0], axis=0, workers=FFT_WORKERS)
+            kernel_ft *= edges_ft
+            acc = fft.irfft2(kernel_ft, fshape, workers=FFT_WORKERS)
+            del kernel_ft
+            votes = np.rint(acc[radius:radius + rows, radius:radius + cols]).astype(vote_dtype(num_points))
+            del acc
+        yield radius, votes, num_points
+
+def edge_normals(img, edges, sigma=CANNY_SIGMA):
+    '''Rows, columns and gradient direction (radians, from the x axis towards the rows) of every edge pixel, for
+    gradient_accumulators. The gradient is the Sobel gradient of the image smoothed with the same Gaussian as
+    detect_edges, which is how canny finds the direction of its edges. The center of a droplet lies along this
+    direction or against it, depending on whether the droplet is brighter or darker than the background. The Sobel
+    kernels are only applied at the edge pixels.'''
+    ys, xs = np.nonzero(edges)
+    smooth = np.pad(ndi.gaussian_filter(img.astype(np.float32), sigma), 1, mode='symmetric')
+    gy, gx = np.zeros(len(ys)), np.zeros(len(ys))
+    for dy, dx, weight in [(-1, -1, 1), (-1, 0, 2), (-1, 1, 1), (1, -1, 1), (1, 0, 2), (1, 1, 1)]:
+        gy += dy*weight*smooth[ys + 1 + dy, xs + 1 + dx]
+        gx += dy*weight*smooth[ys + 1 + dx, xs + 1 + dy]
+    return ys, xs, np.arctan2(gy, gx)
+
+def gradient_accumulators(normals, shape, hough_radii, tolerance=GRADIENT_TOLERANCE):
+    '''Generator like hough_accumulators, yielding (radius, votes, num_points) for one radius at a time, but each edge
+    pixel only votes for the centers along its gradient direction (normals from edge_normals), both ways and within
+    tolerance radians, instead of for every center on a circle around it. The directions are sampled about a pixel
+    apart at the radius and an edge pixel votes for each center at most once, so a center still gets one vote per
+    edge pixel of its circle (capped at num_points) and vote_values normalizes the votes as for hough_circle. An
+    edge pixel casts about 4*tolerance*radius votes instead of about 5.7*radius, and edges which cross a circle
+    without following it vote elsewhere, which makes the peaks sharper. shape is the shape of the edge map.'''
+    ys, xs, theta = normals
+    rows, cols = shape
+    # single precision is plenty for positions rounded to whole pixels, and halves the memory traffic
+    ys, xs = ys.astype(np.float32), xs.astype(np.float32)
+    sin_t, cos_t = np.sin(theta).astype(np.float32), np.cos(theta).astype(np.float32)
+    for radius in hough_radii:
+        radius = int(radius)
+        num_points = ring_kernel(radius)[1]
+        steps = int(np.ceil(tolerance*radius))
+        fan = np.linspace(-tolerance, tolerance, 2*steps + 1)
+        sin_f, cos_f = (radius*np.sin(fan)).astype(np.float32), (radius*np.cos(fan)).astype(np.float32)
+        centers = []
+        for start in range(0, len(theta), GRADIENT_CHUNK):
+            chunk = slice(start, start + GRADIENT_CHUNK)
+            s, c = sin_t[chunk, np.newaxis], cos_t[chunk, np.newaxis]
+            dy = s*cos_f + c*sin_f
+            dx = c*cos_f - s*sin_f
+            y, x = ys[chunk, np.newaxis], xs[chunk, np.newaxis]
+            # both polarities: centers along the gradient and against it
+            cy = np.rint(np.hstack((y + dy, y - dy))).astype(np.int64)
+            cx = np.rint(np.hstack((x + dx, x - dx))).astype(np.int64)
+            center = np.where((cy >= 0) & (cy < rows) & (cx >= 0) & (cx < cols), cy*cols + cx, -1)
+            # one vote per edge pixel and center: drop repeats within each row of sorted centers
+            center.sort(axis=1)
+            first = np.ones(center.shape, dtype=bool)
+            first[:, 1:] = center[:, 1:] != center[:, :-1]
+            centers.append(center[first & (center >= 0)])
+        votes = np.bincount(np.concatenate(centers), minlength=rows*cols)
+        del centers
+        votes = np.minimum(votes, num_points, out=votes).astype(vote_dtype(num_points)).reshape(rows, cols)
+        yield radius, votes, num_points
+
+def radius_accumulators(edges, hough_radii, normals=None):
+    '''hough_accumulators of the edge map, or gradient_accumulators if the normals of its edge pixels are given.'''
+    if normals is None:
+        return hough_accumulators(edges, hough_radii)
+    return gradient_accumulators(normals, edges.shape, hough_radii)
+
+def slice_peaks(acc, threshold=None, num_points=None):
+    '''Same peaks as hough_circle_peaks(acc[np.newaxis], [radius], threshold=threshold) with its default 3 x 3
+    neighbourhood (threshold defaults to half the maximum), looking only at the pixels above threshold instead of
+    filtering and labelling the whole accumulator and building a regionprops object per local maximum, so the higher
+    the threshold the less work is done. Returns accums, cx, cy sorted strongest first (ties as in sort_peaks).
+    With num_points, acc is the votes of hough_accumulators: threshold is still an accumulator value, the search
+    runs on the votes with the largest vote count not above threshold, and only the peaks found are normalized.
+    The local maxima above threshold are grouped as skimage labels them (8-connected), and each group gets its
+    center and value. skimage visits the groups strongest first (ties in reverse raster order) and suppresses the
+    3 x 3 neighbourhood of every peak it keeps, which only matters for groups whose centers fall in one another's
+    neighbourhood. Those few are visited one by one exactly as skimage does; all other groups are kept if their value
+    at the center is above threshold. Two touching local maxima always have the same value, so a group is a
+    plateau: raising the threshold drops whole groups and never splits one, which lets bounded_peaks raise it
+    during a search. Accumulator values and thresholds are never negative.'''
+    rows, cols = acc.shape
+    values = None
+    if num_points is not None:
+        values = vote_values(num_points)
+        if threshold is None:
+            threshold = 0.5*values[np.max(acc)]
+        threshold = np.searchsorted(values, threshold, 'right') - 1
+    elif threshold is None:
+        threshold = 0.5*np.max(acc)
+    above = np.flatnonzero(acc > threshold)
+    ys, xs = np.divmod(above, cols)
+    is_max = acc.ravel()[above] == _hood_max(acc, ys, xs)
+    pix, ys, xs = above[is_max], ys[is_max], xs[is_max]
+    if len(pix) == 0:
+        return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # group touching maxima, numbered in raster order of their first pixel as skimage's label does (pix is sorted)
+    group = np.arange(len(pix))
+    pairs = []
+    for dy, dx in [(0, 1), (1, -1), (1, 0), (1, 1)]:
+        nb = pix + dy*cols + dx
+        j = np.minimum(np.searchsorted(pix, nb), len(pix) - 1)
+        touch = (pix[j] == nb) & (xs + dx >= 0) & (xs + dx < cols)
+        pairs.append((np.flatnonzero(touch), j[touch]))
+    first, second = [np.concatenate(col) for col in zip(*pairs)]
+    if len(first) > 0:
+        graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(len(pix), len(pix)))
+        group = connected_components(graph, directed=False)[1]
+        start = np.full(group.max() + 1, len(pix))
+        np.minimum.at(start, group, np.arange(len(pix)))
+        group = np.argsort(np.argsort(start))[group]
+    size = np.bincount(group)
+    cy = np.round(np.bincount(group, weights=ys)/size).astype(int)
+    cx = np.round(np.bincount(group, weights=xs)/size).astype(int)
+    value = np.zeros(len(size))
+    value[group] = acc[ys, xs]
+    # skimage sorts the groups by value (a stable sort) and reverses the list
+    order = np.argsort(value, kind='stable')[::-1]
+    cy, cx = cy[order], cx[order]
+    # a plateau's center can fall off the plateau, skimage then takes the maximum filter value at the center
+    accums = np.where(size[order] == 1, value[order], _hood_max(acc, cy, cx))
+
+    # the neighbourhood skimage suppresses around each center: rows 1 to rows - 1, columns wrapped around the border
+    ny = cy[:, np.newaxis] + np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+    nx = cx[:, np.newaxis] + np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+    inside = (ny > 0) & (ny < rows)
+    wrap = (nx < 0) | (nx >= cols)
+    ny = np.where(wrap, rows - ny, ny)
+    nx = np.where(nx < 0, nx + cols, np.where(nx >= cols, nx - cols, nx))
+    hood = np.where(inside, ny*cols + nx, -1)
+    center = cy*cols + cx
+    sorted_center = np.sort(center)
+    others = (np.searchsorted(sorted_center, hood, 'right') - np.searchsorted(sorted_center, hood, 'left')
+              - (hood == center[:, np.newaxis]))
+    near = np.any(others > 0, axis=1) | np.isin(center, hood[others > 0])
+    if min(rows, cols) < 3:
+        near[:] = True
+
+    keep = accums > threshold
+    suppressed = set()
+    for i in np.flatnonzero(near):
+        keep[i] = center[i] not in suppressed and accums[i] > threshold
+        if keep[i]:
+            suppressed.update(hood[i][hood[i] >= 0].tolist())
+
+    accums, cx, cy = accums[keep], cx[keep], cy[keep]
+    s = np.argsort(-accums, kind='stable')
+    if values is not None:
+        accums = values[accums.astype(int)]
+    return accums[s], cx[s], cy[s]
+
+def _hood_max(acc, ys, xs):
+    '''Largest value in the 3 x 3 neighbourhood of each pixel (ys, xs), counting pixels outside acc as zero, the same
+    as the maximum filter skimage uses to find local maxima but only at the given pixels.'''
+    rows, cols = acc.shape
+    best = np.full(len(ys), -np.inf)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            ny, nx = ys + dy, xs + dx
+            inside = (ny >= 0) & (ny < rows) & (nx >= 0) & (nx < cols)
+            val = acc[np.clip(ny, 0, rows - 1), np.clip(nx, 0, cols - 1)]
+            np.maximum(best, np.where(inside, val, 0), out=best)
+    return best
+
+def bounded_peaks(radius_accs, min_ac_relative, num_drops, max_peaks):
+    '''Peaks of one radii group from (radius, votes, num_points), such as a slice of hough_accumulators, keeping
+    only the peaks which can pass remove_low_accum and lim_num_drops. The strongest peak found so far is kept while
+    scanning, and each accumulator is searched with its threshold raised to min_ac_relative times that peak, since
+    a weaker peak would be dropped by remove_low_accum anyway. The candidates held are bounded too: whenever there
+    are more than 2*max_peaks, only the max_peaks strongest (and their ties) are kept, and from then on the weakest
+    one held is also a threshold, so weaker peaks are never taken out of the accumulators at all. Returns the peaks
+    sorted strongest first, and whether they are complete: either no candidate was left out for lack of room, or
+    at least num_drops circles are left after overlap removal, so that the num_drops circles lim_num_drops keeps
+    are the same as with every peak.'''
+    accums, cx, cy, radii = [np.zeros(0)], [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+    top, floor, held, dropped = 0., None, 0, False
+    for radius, acc, num_points in radius_accs:
+        threshold = max(0.5*vote_values(num_points)[np.max(acc)], min_ac_relative*top)
+        if floor is not None and floor > threshold:
+            # keep peaks equal to the weakest one held
+            threshold = np.nextafter(floor, -np.inf)
+            dropped = True
+        h_p, x_p, y_p = slice_peaks(acc, threshold, num_points)
+        del acc
+        if len(h_p) == 0:
+            continue
+        top = max(top, h_p[0])
+        accums.append(h_p)
+        cx.append(x_p)
+        cy.append(y_p)
+        radii.append(np.full(len(h_p), int(radius)))
+        held += len(h_p)
+        if held > 2*max_peaks:
+            pooled = _strongest(accums, cx, cy, radii, min_ac_relative*top, max_peaks)
+            accums, cx, cy, radii = [[col] for col in pooled[:4]]
+            held, floor, dropped = len(pooled[0]), pooled[0].min(), dropped or pooled[4]
+
+    accums, cx, cy, radii = _strongest(accums, cx, cy, radii, min_ac_relative*top, np.inf)[:4]
+    accums, cx, cy, radii = sort_peaks(accums, cx, cy, radii)
+    complete = not dropped or len(suppress_overlap(cx, cy, radii)) >= num_drops
+    return accums, cx, cy, radii, complete
+
+def _strongest(accums, cx, cy, radii, min_accum, max_peaks):
+    '''Pools lists of peak arrays, and keeps the peaks above min_accum, or if there are more than max_peaks of those,
+    the max_peaks strongest and every peak tied with the weakest of them. Returns the pooled arrays (in their pooled
+    order) and whether any peak above min_accum was dropped.'''
+    accums, cx, cy, radii = [np.concatenate(col) for col in (accums, cx, cy, radii)]
+    good = accums > min_accum
+    accums, cx, cy, radii = accums[good], cx[good], cy[good], radii[good]
+    if len(accums) <= max_peaks:
+        return accums, cx, cy, radii, False
+    kth = np.partition(accums, len(accums) - max_peaks)[len(accums) - max_peaks]
+    good = accums >= kth
+    return accums[good], cx[good], cy[good], radii[good], not np.all(good)
+
+def bounded_group_peaks(edges, hough_radii, min_ac_relative, num_drops):
+    '''bounded_peaks of one radii group, holding at most PEAK_CAP_FACTOR*num_drops candidates. In the rare case that
+    is not enough (see bounded_peaks), every peak of the group is found again with radius_peaks.'''
+    accums, cx, cy, radii, complete = bounded_peaks(hough_accumulators(edges, hough_radii), min_ac_relative,
+                                                    num_drops, PEAK_CAP_FACTOR*num_drops)
+    if not complete:
+        return radius_peaks(edges, hough_radii)
+    return accums, cx, cy, radii
+
+def radius_peaks(edges, hough_radii, normals=None):
+    '''Finds the hough_circle_peaks of every radius in hough_radii from a single edge map (with slice_peaks). Peaks
+    are found on each accumulator as soon as it is built and the accumulator is then discarded. Peaks are returned in
+    radius order. With normals (see edge_normals), the accumulators come from gradient voting.'''
+    accums, cx, cy, radii = [], [], [], []
+    for radius, acc, num_points in radius_accumulators(edges, hough_radii, normals):
+        h_p, x_p, y_p = slice_peaks(acc, None, num_points)
+        del acc
+        accums.append(h_p)
+        cx.append(x_p)
+        cy.append(y_p)
+        radii.append(np.full(len(h_p), int(radius)))
+
+    accums = np.concatenate(accums)
+    cx = np.concatenate(cx).astype(int)
+    cy = np.concatenate(cy).astype(int)
+    radii = np.concatenate(radii).astype(int)
+    return accums, cx, cy, radii
+
+def sort_peaks(accums, cx, cy, radii):
+    '''Sorts pooled peaks by accum value, strongest first. Peaks of equal value keep the order they were pooled in
+    (by radius, then as slice_peaks found them), so the order does not depend on which other peaks are pooled with
+    them. hough_circle_peaks leaves that order to np.argsort, which can change when weaker peaks are left out.'''
+    s = np.argsort(-accums, kind='stable')
+    return accums[s], cx[s], cy[s], radii[s]
+
+def hough_peaks_all_radii(edges, hough_radii):
+    '''Peaks for the full radius range from one edge map, sorted strongest first.'''
+    return sort_peaks(*radius_peaks(edges, hough_radii))
+
+def _init_worker(raw_edges, shape):
+    '''Pool initializer. Keeps a view of the shared edge map in the worker and limits scipy.fft to one thread.'''
+    global _shared_edges, FFT_WORKERS
+    _shared_edges = np.frombuffer(raw_edges, dtype=np.uint8).reshape(shape).view(bool)
+    FFT_WORKERS = 1
+
+def _group_peaks(job):
+    '''Runs in a pool worker: radius_peaks, or bounded_group_peaks if min_ac_relative is given, for one radii group
+    on the shared edge map.'''
+    hough_radii, min_ac_relative, num_drops = job
+    if min_ac_relative is None:
+        return radius_peaks(_shared_edges, hough_radii)
+    return bounded_group_peaks(_shared_edges, hough_radii, min_ac_relative, num_drops)
+
+def _tile_peaks(job):
+    '''Runs in a pool worker: tile_peaks for one tile of the shared edge map.'''
+    box, hough_radii = job
+    return tile_peaks(_shared_edges, box, hough_radii)
+
+def shared_edges(edges):
+    '''Copies the edge map into a RawArray which pool workers can read without receiving a copy (see _init_worker).'''
+    raw_edges = RawArray(ctypes.c_uint8, edges.size)
+    np.frombuffer(raw_edges, dtype=np.uint8)[:] = edges.ravel()
+    return raw_edges
+
+def hough_peaks_parallel(edges, hr_group, workers, min_ac_relative=None, num_drops=None):
+    '''Same result as hough_peaks_all_radii(edges, all radii in hr_group), with each radii group searched by one of
+    "workers" processes. The edge map is copied once into a shared RawArray which the workers read without copying.
+    Group results come back in hr_group order and are pooled in radius order before sorting, exactly as in the single
+    process search, so the merged peaks do not depend on the number of workers or on which worker finishes first.
+    If min_ac_relative and num_drops are given, each group only returns the peaks which can pass remove_low_accum
+    and lim_num_drops (bounded_group_peaks).'''
+    raw_edges = shared_edges(edges)
+    jobs = [(group, min_ac_relative, num_drops) for group in hr_group]
+    with Pool(workers, initializer=_init_worker, initargs=(raw_edges, edges.shape)) as pool:
+        group_peaks = pool.map(_group_peaks, jobs, chunksize=1)
+
+    accums, cx, cy, radii = [np.concatenate(col) for col in zip(*group_peaks)]
+    return sort_peaks(accums, cx, cy, radii)
+
+def suppress_overlap(cx, cy, radii):
+    '''Greedy non-maximum suppression of overlapping circles. Circles are visited in the order given (strongest
+    first), and each circle which is kept removes every later circle closer than OVERLAP_FACTOR times the sum of the
+    two radii. Candidate pairs come from a KD-tree query with the largest possible overlap distance
+    (2*OVERLAP_FACTOR*max radius), so only nearby circles are ever compared. Returns the indices of the kept circles,
+    in order.'''
+    num = len(cx)
+    if num == 0:
+        return np.arange(0)
+    cx = np.asarray(cx, dtype=float)
+    cy = np.asarray(cy, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+
+    tree = cKDTree(np.column_stack((cx, cy)))
+    pairs = tree.query_pairs(2*OVERLAP_FACTOR*np.max(radii), output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    dist = np.sqrt((cx[j]-cx[i])**2 + (cy[j]-cy[i])**2)
+    ovr = dist < OVERLAP_FACTOR*(radii[i] + radii[j])
+    first = np.minimum(i, j)[ovr]
+    later = np.maximum(i, j)[ovr]
+
+    # later circles overlapping each circle, grouped by circle
+    order = np.argsort(first, kind='stable')
+    first, later = first[order], later[order]
+    starts = np.searchsorted(first, np.arange(num + 1))
+
+    bad = np.zeros(num, dtype=bool)
+    for n in range(num):
+        if bad[n]:
+            continue
+        bad[later[starts[n]:starts[n + 1]]] = True
+    return np.flatnonzero(~bad)
+
+def seeded_peaks(edges, prior_cx, prior_cy, prior_radii, hough_radii, band, window):
+    '''Finds the strongest circle near each prior droplet (for example from the previous timepoint). For every prior
+    droplet the accumulator is only built for centers within +/- window pixels of the prior center and for the radii
+    of hough_radii within +/- band of the prior radius, using the edge map cropped to that window plus the largest of
+    those radii, which holds every edge pixel that can vote for those centers. Returns one peak per prior droplet
+    (if any radius of hough_radii is in its band), sorted strongest first like hough_peaks_all_radii.'''
+    rows, cols = edges.shape
+    hough_radii = np.asarray(hough_radii)
+    accums, cx, cy, radii = [], [], [], []
+
+    for x0, y0, r0 in zip(prior_cx, prior_cy, prior_radii):
+        x0, y0 = int(x0), int(y0)
+        rads = hough_radii[np.abs(hough_radii - r0) <= band]
+        if len(rads) == 0:
+            continue
+        reach = window + int(np.max(rads))
+        ya, yb = max(y0 - reach, 0), min(y0 + reach + 1, rows)
+        xa, xb = max(x0 - reach, 0), min(x0 + reach + 1, cols)
+        wya, wyb = max(y0 - window, 0) - ya, min(y0 + window + 1, rows) - ya
+        wxa, wxb = max(x0 - window, 0) - xa, min(x0 + window + 1, cols) - xa
+        if wyb <= wya or wxb <= wxa:
+            continue
+
+        hspace = hough_circle(edges[ya:yb, xa:xb], rads)[:, wya:wyb, wxa:wxb]
+        ri, yi, xi = np.unravel_index(np.argmax(hspace), hspace.shape)
+        accums.append(hspace[ri, yi, xi])
+        cx.append(xi + wxa + xa)
+        cy.append(yi + wya + ya)
+        radii.append(rads[ri])
+
+    accums = np.array(accums, dtype=float)
+    return sort_peaks(accums, np.array(cx, dtype=int), np.array(cy, dtype=int), np.array(radii, dtype=int))
+
+def uncovered_edges(edges, cx, cy, radii, margin=2):
+    '''Copy of the edge map without the edge pixels which lie on the given circles (within +/- margin pixels of
+    their perimeter), normally the circles seeded_peaks found. What remains are edges of droplets which are new or
+    moved further than the seeded search window. Only the ring around each perimeter is removed so that the edges
+    of touching neighbours are left intact.'''
+    rows, cols = edges.shape
+    free = edges.copy()
+    for x0, y0, r0 in zip(cx, cy, radii):
+        x0, y0, r0 = int(x0), int(y0), int(r0)
+        reach = r0 + margin
+        ya, yb = max(y0 - reach, 0), min(y0 + reach + 1, rows)
+        xa, xb = max(x0 - reach, 0), min(x0 + reach + 1, cols)
+        y, x = np.ogrid[ya:yb, xa:xb]
+        dist = np.sqrt((x-x0)**2 + (y-y0)**2)
+        free[ya:yb, xa:xb][np.abs(dist - r0) <= margin] = False
+    return free
+
+def uncovered_peaks(free, hough_radii, tile=None):
+    '''Full search of an edge map from uncovered_edges, limited to the regions with edges left in it. Every connected
+    group of edge pixels long enough to be at least half the perimeter of the smallest radius is searched on its own,
+    in a crop padded by the largest radius so that every circle it could belong to is inside. If the crops cover more
+    than half of the image, the whole image is searched at once instead (in tiles of this size if tile is given).
+    Returns peaks sorted strongest first.'''
+    rows, cols = free.shape
+    min_pixels = np.pi*np.min(hough_radii)
+    pad = int(np.max(hough_radii))
+    labels, num = ndi.label(free, structure=np.ones((3, 3)))
+    sizes = np.bincount(labels.ravel(), minlength=num + 1)
+
+    boxes = []
+    for k, sl in enumerate(ndi.find_objects(labels), 1):
+        if sizes[k] < min_pixels:
+            continue
+        ya, yb = max(sl[0].start - pad, 0), min(sl[0].stop + pad, rows)
+        xa, xb = max(sl[1].start - pad, 0), min(sl[1].stop + pad, cols)
+        boxes.append((ya, yb, xa, xb))
+
+    if len(boxes) == 0:
+        return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    if sum((yb - ya)*(xb - xa) for ya, yb, xa, xb in boxes) > rows*cols/2:
+        if tile is not None:
+            return tiled_peaks(free, hough_radii, tile)
+        return hough_peaks_all_radii(free, hough_radii)
+
+    peaks = []
+    for ya, yb, xa, xb in boxes:
+        accums, cx, cy, radii = radius_peaks(free[ya:yb, xa:xb], hough_radii)
+        peaks.append((accums, cx + xa, cy + ya, radii))
+    return sort_peaks(*[np.concatenate(col) for col in zip(*peaks)])
+
+def coarse_peaks(edges, hough_radii, threshold=PYRAMID_THRESHOLD, significance=False):
+    '''Local maxima (at least the smallest radius apart) of the best accumulator value over all radii, above
+    threshold times the strongest. With significance, radii compete by standard deviations above the edge density.'''
+    best = np.full(edges.shape, -np.inf)
+    best_radius = np.zeros(edges.shape, dtype=int)
+    density = np.count_nonzero(edges)/edges.size
+    for radius, votes, num_points in hough_accumulators(edges, hough_radii):
+        acc = vote_values(num_points)[votes]
+        if significance:
+            acc = (acc - density)*np.sqrt(num_points/(density*(1 - density)))
+        better = acc > best
+        best[better] = acc[better]
+        best_radius[better] = radius
+
+    size = 2*int(np.min(hough_radii)) + 1
+    peak = (best == ndi.maximum_filter(best, size=size, mode='constant')) & (best > threshold*np.max(best))
+    cy, cx = np.nonzero(peak)
+    return sort_peaks(best[cy, cx], cx, cy, best_radius[cy, cx])
+
+def pyramid_peaks(comp_img, edges, hough_radii, min_coarse_rad, scale=PYRAMID_SCALE):
+    '''Peaks of radii below min_coarse_rad from edges, and of the others from comp_img downsampled by scale, refined
+    at full resolution within scale pixels of each coarse circle. Sorted strongest first.'''
+    hough_radii = np.asarray(hough_radii)
+    fine = hough_radii[hough_radii < min_coarse_rad]
+    large = hough_radii[hough_radii >= min_coarse_rad]
+    peaks = []
+    if len(fine) > 0:
+        peaks.append(radius_peaks(edges, fine))
+
+    coarse_radii = np.unique(np.rint(large/scale).astype(int))
+    coarse_radii = coarse_radii[coarse_radii > 0]
+    if len(coarse_radii) > 0:
+        coarse_img = downscale_local_mean(comp_img, (scale, scale))
+        coarse_edges = detect_edges(coarse_img, sigma=3./scale)
+        accums, cx, cy, radii = coarse_peaks(coarse_edges, coarse_radii)
+        keep = suppress_overlap(cx, cy, radii)
+        # center of the block of full resolution pixels each coarse pixel was averaged from
+        offset = (scale - 1)//2
+        peaks.append(seeded_peaks(edges, cx[keep]*scale + offset, cy[keep]*scale + offset, radii[keep]*scale,
+                                  large, scale, scale))
+
+    if len(peaks) == 0:
+        return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return sort_peaks(*[np.concatenate(col) for col in zip(*peaks)])
+
+def estimate_radii(comp_img, min_rad, max_rad, step=1, auto_step=False, scale=ESTIMATE_SCALE):
+    '''Radius range of the droplets in comp_img within the given one, from a coarse search downsampled by scale.
+    Returns min_rad, max_rad, step (about 1/25 of min_rad with auto_step) and the number of circles found.'''
+    coarse_img = downscale_local_mean(comp_img, (scale, scale))
+    coarse_edges = detect_edges(coarse_img, sigma=3./scale)
+    coarse_radii = np.arange(max(int(min_rad)//scale, ESTIMATE_MIN_RAD), -(-int(max_rad)//scale) + 1)
+    if len(coarse_radii) == 0 or not np.any(coarse_edges) or np.all(coarse_edges):
+        return min_rad, max_rad, step, 0
+
+    accums, cx, cy, radii = coarse_peaks(coarse_edges, coarse_radii, ESTIMATE_THRESHOLD, significance=True)
+    keep = suppress_overlap(cx, cy, radii)
+    radii = radii[keep]*scale
+    if len(radii) == 0:
+        return min_rad, max_rad, step, 0
+
+    lo = max(int(np.floor(np.percentile(radii, 1))) - scale - 1, min_rad)
+    hi = min(int(np.ceil(np.percentile(radii, 99))) + scale + 2, max_rad)
+    if hi <= lo:
+        return min_rad, max_rad, step, 0
+    if auto_step:
+        step = max(step, lo//25)
+    return lo, hi, step, len(radii)
+
+def tile_size(memory_mb, max_rad):
+    '''Side length of the square tiles which keep the search of one tile, halo included, within memory_mb
+    megabytes. Tiles are never made smaller than twice the largest radius, even if that exceeds the budget.'''
+    side = int(np.sqrt(memory_mb*2**20/TILE_BYTES_PER_PIXEL)) - 2*(int(max_rad) + 1)
+    return max(side, 2*int(max_rad))
+
+def tile_boxes(shape, tile):
+    '''Splits an image of the given shape into tiles of at most tile x tile pixels. Returns the (y0, y1, x0, x1)
+    bounds of each tile, row by row.'''
+    rows, cols = shape
+    return [(y0, min(y0 + tile, rows), x0, min(x0 + tile, cols))
+            for y0 in range(0, rows, tile) for x0 in range(0, cols, tile)]
+
+def tiled_edges(img, tile):
+    '''Same edge map as detect_edges, with the filtering done one tile at a time. Each tile is filtered together
+    with EDGE_HALO pixels around it, and gives the edge pixels above the low and above the high threshold (canny
+    with both thresholds equal). The hysteresis, which keeps the weak edges connected to a strong one however far
+    away, is then run on the whole image as canny runs it, on two boolean maps and their labels (about 7 bytes per
+    pixel of the whole image, on top of the tile).'''
+    rows, cols = img.shape
+    weak = np.zeros(img.shape, dtype=bool)
+    strong = np.zeros(img.shape, dtype=bool)
+    for y0, y1, x0, x1 in tile_boxes(img.shape, tile):
+        ya, yb = max(y0 - EDGE_HALO, 0), min(y1 + EDGE_HALO, rows)
+        xa, xb = max(x0 - EDGE_HALO, 0), min(x1 + EDGE_HALO, cols)
+        crop, inner = img[ya:yb, xa:xb], (slice(y0 - ya, y1 - ya), slice(x0 - xa, x1 - xa))
+        weak[y0:y1, x0:x1] = canny(crop, sigma=CANNY_SIGMA, low_threshold=CANNY_LOW, high_threshold=CANNY_LOW)[inner]
+        strong[y0:y1, x0:x1] = canny(crop, sigma=CANNY_SIGMA, low_threshold=CANNY_HIGH,
+                                     high_threshold=CANNY_HIGH)[inner]
+    labels, count = ndi.label(weak, structure=np.ones((3, 3), dtype=bool))
+    good = np.zeros(count + 1, dtype=bool)
+    good[labels[strong]] = True
+    good[0] = False
+    return good[labels]
+
+def tile_peaks(edges, box, hough_radii):
+    '''Peaks of every radius centered inside one tile. The edge map is cropped to the tile plus a halo of the
+    largest radius and one pixel, which holds every edge pixel that can vote for a center in the tile and for its
+    neighbours used in the peak search, and only peaks centered inside the tile are returned. Each radius is
+    searched above half its largest value inside the tile, which is never above the threshold of the whole image.
+    Returns the peaks, and that largest value of each radius for tiled_peaks to apply the whole-image threshold.'''
+    rows, cols = edges.shape
+    y0, y1, x0, x1 = box
+    halo = int(np.max(hough_radii)) + 1
+    # crops start at even pixels, so that plateau centers rounded half to even round as in the whole image
+    ya, yb = max(y0 - halo, 0) // 2 * 2, min(y1 + halo, rows)
+    xa, xb = max(x0 - halo, 0) // 2 * 2, min(x1 + halo, cols)
+    accums, cx, cy, radii, tops = [], [], [], [], []
+    for radius, acc, num_points in hough_accumulators(edges[ya:yb, xa:xb], hough_radii):
+        top = vote_values(num_points)[np.max(acc[y0 - ya:y1 - ya, x0 - xa:x1 - xa])]
+        h_p, x_p, y_p = slice_peaks(acc, 0.5*top, num_points)
+        del acc
+        accums.append(h_p)
+        cx.append(x_p + xa)
+        cy.append(y_p + ya)
+        radii.append(np.full(len(h_p), radius))
+        tops.append(top)
+    accums, cx, cy, radii = [np.concatenate(col) for col in (accums, cx, cy, radii)]
+    inside = (cy >= y0) & (cy < y1) & (cx >= x0) & (cx < x1)
+    return accums[inside], cx[inside], cy[inside], radii[inside], np.array(tops)
+
+def tiled_peaks(edges, hough_radii, tile, workers=1):
+    '''Peaks for the full radius range searched one tile at a time, sorted strongest first. Every peak belongs to
+    exactly one tile, and circles which cross a tile border are merged by remove_overlap like any other overlapping
+    circles. With workers > 1 the tiles are searched in parallel processes reading the edge map from shared
+    memory. Each radius keeps the peaks above half its largest value in any tile, the threshold of the whole image,
+    and equal accums are ordered as in the whole image (by radius, then in reverse raster order as skimage visits
+    them), so the result is that of hough_peaks_all_radii whatever the tiles and the number of workers. The only
+    exceptions are plateaus of equal accumulator values: one more than a pixel across a tile border can be found
+    differently, and ties with a plateau can be in another order.'''
+    boxes = tile_boxes(edges.shape, tile)
+    if workers > 1 and len(boxes) > 1:
+        raw_edges = shared_edges(edges)
+        with Pool(workers, initializer=_init_worker, initargs=(raw_edges, edges.shape)) as pool:
+            peaks = pool.map(_tile_peaks, [(box, hough_radii) for box in boxes], chunksize=1)
+    else:
+        peaks = [tile_peaks(edges, box, hough_radii) for box in boxes]
+    accums, cx, cy, radii = [np.concatenate(col) for col in list(zip(*peaks))[:4]]
+    tops = np.max([p[4] for p in peaks], axis=0)
+    order = np.argsort(hough_radii)
+    keep = accums > 0.5*tops[order[np.searchsorted(hough_radii, radii, sorter=order)]]
+    accums, cx, cy, radii = accums[keep], cx[keep], cy[keep], radii[keep]
+    s = np.lexsort((-(cy*edges.shape[1] + cx), radii, -accums))
+    return accums[s], cx[s], cy[s], radii[s]
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+
+import os
+
+'''Reading and writing of the result files (_values, _intensity, _val_filtered, _intensity_filtered, _final_data) in
+.csv or in one of the binary column formats, which are much smaller and faster to read than the text files:
+    - parquet or feather: typed columns, need the pyarrow package
+    - npz: compressed numpy arrays, no extra package needed
+The format of a file is given by its extension. Tables are stored column by column with their types. Intensity
+histograms are stored as one row per droplet, with the 256 counts and the 256 bin starts of the droplet as a dense
+droplets x 256 matrix, instead of 256 text rows per droplet. read_intensity returns them in the same long format
+as the _intensity.csv files, so scripts can use either.'''
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'npz': '.npz'}
+INTENSITY_COLUMNS = ['bin number', 'bin start', 'count', 'radius', 'droplet number']
+
+def table_format(path):
+    '''Format name of a result file from its extension.'''
+    fext = os.path.splitext(path)[1]
+    for fmt, ext in FORMATS.items():
+        if fext == ext:
+            return fmt
+    raise ValueError("Unknown result file format: %s" % path)
+
+def find_table(base):
+    '''Returns the result file base + extension of the first format found on disk, csv first.'''
+    for ext in FORMATS.values():
+        if os.path.exists(base + ext):
+            return base + ext
+    raise FileNotFoundError("No result file found for %s" % base)
+
+def write_table(df, path):
+    '''Writes a table (_values, _val_filtered, _final_data) in the format given by the extension of path. .csv files
+    are written exactly as before, with the index in the first column.'''
+    fmt = table_format(path)
+    if fmt == 'csv':
+        df.to_csv(path)
+    elif fmt == 'parquet':
+        df.reset_index(drop=True).to_parquet(path, index=False)
+    elif fmt == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        arrays = {col: _npz_column(df[col]) for col in df.columns}
+        np.savez_compressed(path, _columns=np.array(df.columns, dtype=str), **arrays)
+
+def read_table(path):
+    '''Reads a table written by write_table.'''
+    fmt = table_format(path)
+    if fmt == 'csv':
+        return pd.read_csv(path, index_col=0)
+    elif fmt == 'parquet':
+        return pd.read_parquet(path)
+    elif fmt == 'feather':
+        return pd.read_feather(path)
+    with np.load(path, allow_pickle=False) as data:
+        return pd.DataFrame({col: data[col] for col in data['_columns']})
+
+def _npz_column(col):
+    '''Column as a numpy array which np.load can read back without pickling (text columns become unicode arrays).'''
+    if col.dtype == object:
+        return col.to_numpy().astype(str)
+    return col.to_numpy()
+
+def intensity_long(drop_no, radius, counts, starts):
+    '''Long (_intensity.csv) format of dense histograms: one row per bin of each droplet.'''
+    num_drops, bins = counts.shape
+    dict = {'bin number': np.tile(np.arange(bins), num_drops), 'bin start': starts.ravel(), 'count': counts.ravel(),
+            'radius': np.repeat(np.asarray(radius), bins), 'droplet number': np.repeat(np.asarray(drop_no), bins)}
+    return pd.DataFrame(dict, columns=INTENSITY_COLUMNS)
+
+def intensity_dense(df):
+    '''Dense histograms from the long format. Rows of each droplet must be in bin order, as they are written.
+    Returns the droplet numbers, radii, counts and bin starts, the last two as (droplets, bins) arrays.'''
+    drop_no, first = np.unique(df['droplet number'].to_numpy(), return_index=True)
+    order = np.argsort(first)
+    drop_no, first = drop_no[order], first[order]
+    bins = len(df) // max(len(drop_no), 1)
+    radius = df['radius'].to_numpy()[first]
+    counts = df['count'].to_numpy().reshape(len(drop_no), bins)
+    starts = df['bin start'].to_numpy().reshape(len(drop_no), bins)
+    return drop_no, radius, counts, starts
+
+def write_intensity_matrix(path, drop_no, radius, counts, starts):
+    '''Writes dense droplet histograms. For .csv files the long format is written, exactly as before.'''
+    fmt = table_format(path)
+    if fmt == 'csv':
+        intensity_long(drop_no, radius, counts, starts).to_csv(path)
+    elif fmt == 'npz':
+        np.savez_compressed(path, droplet_number=np.asarray(drop_no), radius=np.asarray(radius),
+                            count=counts, bin_start=starts)
+    else:
+        bins = counts.shape[1]
+        df = pd.DataFrame({'droplet number': np.asarray(drop_no), 'radius': np.asarray(radius)})
+        count_df = pd.DataFrame(counts, columns=['count %d' % i for i in range(bins)])
+        start_df = pd.DataFrame(starts, columns=['bin start %d' % i for i in range(bins)])
+        df = pd.concat([df, count_df, start_df], axis=1)
+        if fmt == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_feather(path)
+
+def read_intensity_matrix(path):
+    '''Reads dense droplet histograms from any format. Returns the droplet numbers, radii, counts and bin starts.'''
+    fmt = table_format(path)
+    if fmt == 'csv':
+        return intensity_dense(pd.read_csv(path, index_col=0))
+    elif fmt == 'npz':
+        with np.load(path, allow_pickle=False) as data:
+            return data['droplet_number'], data['radius'], data['count'], data['bin_start']
+    df = pd.read_parquet(path) if fmt == 'parquet' else pd.read_feather(path)
+    counts = df[[col for col in df.columns if col.startswith('count ')]].to_numpy()
+    starts = df[[col for col in df.columns if col.startswith('bin start ')]].to_numpy()
+    return df['droplet number'].to_numpy(), df['radius'].to_numpy(), counts, starts
+
+def write_intensity(df, path):
+    '''Writes histograms given in the long format. .csv files are written as is, keeping the index.'''
+    if table_format(path) == 'csv':
+        df.to_csv(path)
+    else:
+        write_intensity_matrix(path, *intensity_dense(df))
+
+def read_intensity(path):
+    '''Reads histograms from any format in the long (_intensity.csv) format.'''
+    if table_format(path) == 'csv':
+        return pd.read_csv(path, index_col=0)
+    return intensity_long(*read_intensity_matrix(path))
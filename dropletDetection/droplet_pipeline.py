@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import sys
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+'''Overlapping of reading, detection and writing, so that a run does not wait on the disk (or a network share) while
+the processor is idle. Reading .nd2 and .tif files and writing result files and images mostly waits on I/O, which
+Python threads can do while the main thread runs the Hough search:
+    - prefetch reads the next images of a list on I/O threads while the current one is processed, at most "depth"
+      images ahead, so memory stays bounded,
+    - read_ahead does the same for a generator, such as the frames of a multi-frame .nd2 file,
+    - OutputWriter writes results on a writer thread. Its queue holds at most "depth" writes; handing it another
+      one waits until there is room (back-pressure), so a slow disk slows the run down instead of filling memory.
+Errors are never lost: a read error is raised where its image is used, and a write error is kept under the name of
+the job which submitted it, to be collected with take_errors or raised once by close.'''
+
+# Images read ahead of the one being processed, and threads reading them
+PREFETCH_DEPTH = 2
+IO_THREADS = 2
+# Writes the writer thread may have waiting before submit waits for it
+WRITE_DEPTH = 4
+
+def prefetch(func, items, depth=PREFETCH_DEPTH, threads=IO_THREADS):
+    '''Generator over func(item) for every item, in order, with up to depth calls running ahead on threads I/O
+    threads while the caller works on the current result.'''
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_ahead(iterable, depth=PREFETCH_DEPTH):
+    '''Generator over iterable, which is advanced on a background thread up to depth items ahead of the caller.
+    An exception raised by iterable is raised here when its item is reached.'''
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(entry):
+        # gives up once the caller has stopped, instead of blocking on the full queue
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+class OutputWriter:
+    '''Runs writes (any function and its arguments) in order on one writer thread. Use as:
+        with OutputWriter() as writer:
+            writer.submit(write_table, df, path)
+    Leaving the with-block waits for every write to finish. Arguments are used as they are when the write runs, so
+    they must not be changed after they are submitted. A write which fails does not stop the later ones: its error
+    is kept with the job name (writer.name when it was submitted, such as the image name) until take_errors or close
+    hands it over, once.'''
+
+    def __init__(self, depth=WRITE_DEPTH):
+        self.jobs = queue.Queue(maxsize=depth)
+        self.name = None
+        self.errors = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                name, func, args, kwargs = job
+                try:
+                    func(*args, **kwargs)
+                except BaseException as e:
+                    with self.lock:
+                        self.errors.append((name, e))
+            finally:
+                self.jobs.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        '''Queues func(*args, **kwargs) under the current job name, waiting while the queue is full.'''
+        self.jobs.put((self.name, func, args, kwargs))
+
+    def wait(self):
+        '''Waits until every write submitted so far has run.'''
+        self.jobs.join()
+
+    def take_errors(self):
+        '''Returns the (job name, error) of every write which failed since the last call, and forgets them.'''
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        '''Waits for every queued write and raises the first write error not taken yet, if any.'''
+        if self.thread.is_alive():
+            self.jobs.put(None)
+            self.thread.join()
+        errors = self.take_errors()
+        if errors:
+            raise errors[0][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # already failing: wait for the writes but keep the original error
+            try:
+                self.close()
+            except BaseException as e:
+                print("Write error after an earlier error: %s" % e, file=sys.stderr)
+        return False
+
+def output(writer, func, *args, **kwargs):
+    '''func(*args, **kwargs) on the writer thread of writer, or right away if writer is None.'''
+    if writer is None:
+        func(*args, **kwargs)
+    else:
+        writer.submit(func, *args, **kwargs)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+
+from skimage.draw import circle_perimeter
+
+'''Drawing of the detected droplets straight into the image pixels, for the _compimg, _finalimg and _mask .png files.
+This is much faster than a 700 dpi matplotlib figure with one text label per droplet:
+    - draw_perimeters: the perimeters of all circles in one indexing step, clipped at the image border so that
+      circles touching the border are drawn in part instead of left out
+    - draw_labels: droplet IDs written from a small bitmap font (GLYPHS), each digit scaled up by a whole number
+    - write_png: saves the image at its own resolution, one image pixel per .png pixel
+overlay_image draws both the circles and the IDs on a brightness-adjusted image.'''
+
+CIRCLE_COLOR = (220, 20, 20)
+# colors of the droplet IDs in groups of 100, as in the matplotlib comparison image
+LABEL_COLORS = [(128, 128, 128),    # gray
+                (238, 232, 170),    # palegoldenrod
+                (240, 128, 128),    # lightcoral
+                (102, 205, 170),    # mediumaquamarine
+                (135, 206, 250)]    # lightskyblue
+LABEL_GROUPS = [101, 201, 301, 401]
+
+# 5 x 7 bitmap digits, one string per row
+GLYPH_ROWS = {
+    '0': ['01110', '10001', '10011', '10101', '11001', '10001', '01110'],
+    '1': ['00100', '01100', '00100', '00100', '00100', '00100', '01110'],
+    '2': ['01110', '10001', '00001', '00010', '00100', '01000', '11111'],
+    '3': ['11111', '00010', '00100', '00010', '00001', '10001', '01110'],
+    '4': ['00010', '00110', '01010', '10010', '11111', '00010', '00010'],
+    '5': ['11111', '10000', '11110', '00001', '00001', '10001', '01110'],
+    '6': ['00110', '01000', '10000', '11110', '10001', '10001', '01110'],
+    '7': ['11111', '00001', '00010', '00100', '01000', '01000', '01000'],
+    '8': ['01110', '10001', '10001', '01110', '10001', '10001', '01110'],
+    '9': ['01110', '10001', '10001', '01111', '00001', '00010', '01100'],
+}
+GLYPHS = {char: np.array([[c == '1' for c in row] for row in rows]) for char, rows in GLYPH_ROWS.items()}
+GLYPH_HEIGHT, GLYPH_WIDTH = 7, 5
+
+def label_scale(shape):
+    '''Whole-number size of the ID digits for an image, about 1.5 % of the image height (at least 1).'''
+    return max(1, int(round(0.015*min(shape[:2])/GLYPH_HEIGHT)))
+
+def to_rgb(img):
+    '''RGB copy of a grayscale or RGB 8-bit image.'''
+    img = np.asarray(img)
+    if img.ndim == 2:
+        return np.repeat(img[:, :, np.newaxis], 3, axis=2)
+    return img[:, :, :3].copy()
+
+def perimeter_pixels(shape, cx, cy, radii):
+    '''Pixels of the perimeters of all circles, clipped to the image. The perimeter offsets of each radius are
+    found once with circle_perimeter and added to the centers of all circles of that radius. Returns rows, cols.'''
+    cx = np.asarray(cx, dtype=int)
+    cy = np.asarray(cy, dtype=int)
+    radii = np.asarray(radii, dtype=int)
+    rows, cols = [], []
+    for radius in np.unique(radii):
+        circy, circx = circle_perimeter(0, 0, radius)
+        same = radii == radius
+        rows.append((cy[same, np.newaxis] + circy).ravel())
+        cols.append((cx[same, np.newaxis] + circx).ravel())
+    if len(rows) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    return rows[inside], cols[inside]
+
+def draw_perimeters(img, cx, cy, radii, color=CIRCLE_COLOR):
+    '''Draws the perimeters of all circles onto an RGB image in place.'''
+    rows, cols = perimeter_pixels(img.shape, cx, cy, radii)
+    img[rows, cols] = color
+    return img
+
+def glyph_offsets(scale):
+    '''Pixel offsets (rows, cols) of every digit, scaled up by scale, from the lower-left corner of the digit.'''
+    offsets = {}
+    for char, glyph in GLYPHS.items():
+        big = np.kron(glyph, np.ones((scale, scale), dtype=bool))
+        rows, cols = np.nonzero(big)
+        offsets[char] = (rows - big.shape[0] + 1, cols)
+    return offsets
+
+def label_colors(ids, colors=LABEL_COLORS, groups=LABEL_GROUPS):
+    '''Color of each ID: the first color below groups[0], the second below groups[1], and so on.'''
+    return np.asarray(colors)[np.searchsorted(groups, ids, side='right')]
+
+def draw_labels(img, x, y, ids, colors=LABEL_COLORS, scale=None):
+    '''Writes each ID with its lower-left corner at (x, y), the same place matplotlib's ax.text puts it, onto an RGB
+    image in place. Digits running over the image border are clipped.'''
+    if scale is None:
+        scale = label_scale(img.shape)
+    offsets = glyph_offsets(scale)
+    advance = (GLYPH_WIDTH + 1)*scale
+    id_colors = label_colors(ids, colors)
+    rows, cols, pix_colors = [], [], []
+    for x0, y0, text, color in zip(np.asarray(x, dtype=int), np.asarray(y, dtype=int), ids, id_colors):
+        for n, char in enumerate(str(int(text))):
+            drow, dcol = offsets[char]
+            rows.append(y0 + drow)
+            cols.append(x0 + n*advance + dcol)
+            pix_colors.append(np.broadcast_to(color, (len(drow), 3)))
+    if len(rows) == 0:
+        return img
+    rows, cols, pix_colors = np.concatenate(rows), np.concatenate(cols), np.concatenate(pix_colors)
+    inside = (rows >= 0) & (rows < img.shape[0]) & (cols >= 0) & (cols < img.shape[1])
+    img[rows[inside], cols[inside]] = pix_colors[inside]
+    return img
+
+def overlay_image(comp_img, cx, cy, radii, ids=None, colors=LABEL_COLORS):
+    '''RGB copy of the brightness-adjusted image with the circles drawn in red and their IDs (droplet numbers by
+    default) written at the circle centers.'''
+    if ids is None:
+        ids = np.arange(len(cx))
+    img = to_rgb(comp_img)
+    draw_perimeters(img, cx, cy, radii)
+    draw_labels(img, cx, cy, ids, colors)
+    return img
+
+def write_png(path, img):
+    '''Saves an 8-bit grayscale or RGB image as .png at the image resolution. imageio is only imported when an image
+    is written, so runs without figures do not load it.'''
+    import imageio
+    imageio.imwrite(path, np.asarray(img, dtype=np.uint8))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+
+'''Exact statistics of the raw pixel values of every droplet, added as columns of the _values file: Pixel count,
+Intensity mean, median, std, skew, kurtosis and p$q for each percentile q, with the estimators pandas uses.'''
+
+# Percentiles added as columns by default, as given in the 'Intensity percentiles' run parameter
+PERCENTILES = '5 25 75 95'
+
+def parse_percentiles(text):
+    '''List of percentiles from a space separated string such as "5 25 75 95". Empty gives no percentiles.'''
+    return [float(q) for q in str(text).split()]
+
+def percentile_column(q):
+    '''Column name of the percentile q: Intensity p5, Intensity p2.5.'''
+    return 'Intensity p%s' % ('%g' % q)
+
+def skew_from_moments(n, m2, m3):
+    '''Adjusted Fisher-Pearson skew (as pd.DataFrame.skew) from the count and the second and third central moment
+    sums. 0 for constant values, NaN for fewer than 3 values.'''
+    n, m2, m3 = np.asarray(n, dtype=float), np.asarray(m2, dtype=float), np.asarray(m3, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = (n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2**1.5)
+    value = np.where(m2 == 0, 0, value)
+    return np.where(n < 3, np.nan, value)
+
+def kurtosis_from_moments(n, m2, m4):
+    '''Fisher's excess kurtosis with the bias correction of pd.DataFrame.kurt, from the count and the second and
+    fourth central moment sums. 0 for constant values, NaN for fewer than 4 values.'''
+    n, m2, m4 = np.asarray(n, dtype=float), np.asarray(m2, dtype=float), np.asarray(m4, dtype=float)
+    numerator = n * (n + 1) * (n - 1) * m4
+    denominator = (n - 2) * (n - 3) * m2**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = numerator / denominator - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+    value = np.where(denominator == 0, 0, value)
+    return np.where(n < 4, np.nan, value)
+
+def pixel_stats(img, drop_pix, num_drops, percentiles=()):
+    '''Statistics of the raw pixel values of each droplet, from the pixels of circle_pixels. Returns a DataFrame
+    with one row per droplet number (0 to num_drops - 1) and the columns listed above. Percentiles interpolate
+    linearly between pixel values, as np.percentile does.'''
+    pix_idx, drop_no = drop_pix
+    vals = img.ravel()[pix_idx].astype(float)
+
+    n = np.bincount(drop_no, minlength=num_drops)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(drop_no, weights=vals, minlength=num_drops) / n
+        d = vals - mean[drop_no]
+        d2 = d**2
+        m2 = np.bincount(drop_no, weights=d2, minlength=num_drops)
+        m3 = np.bincount(drop_no, weights=d2*d, minlength=num_drops)
+        m4 = np.bincount(drop_no, weights=d2**2, minlength=num_drops)
+        std = np.sqrt(m2 / (n - 1))
+    std[n < 2] = np.nan
+
+    # pixels are grouped by droplet, so sorting the values within each droplet gives every order statistic
+    vals = vals[np.lexsort((vals, drop_no))]
+    starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+
+    stats = {'Pixel count': n, 'Intensity mean': mean, 'Intensity median': _percentile(vals, starts, n, 50.),
+             'Intensity std': std, 'Intensity skew': skew_from_moments(n, m2, m3),
+             'Intensity kurtosis': kurtosis_from_moments(n, m2, m4)}
+    for q in percentiles:
+        stats[percentile_column(q)] = _percentile(vals, starts, n, q)
+    df = pd.DataFrame(stats)
+    cols = [c for c in df.columns if c != 'Pixel count']
+    df[cols] = df[cols].round(decimals=5)
+    return df
+
+def _percentile(vals, starts, n, q):
+    '''Percentile q of each droplet from the pixel values sorted within each droplet, droplet i holding the n[i]
+    values from starts[i] on. NaN for droplets without pixels.'''
+    full = n > 0
+    pos = q / 100. * (n[full] - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, n[full] - 1)
+    below, above = vals[starts[full] + lo], vals[starts[full] + hi]
+    value = np.full(len(n), np.nan)
+    value[full] = below + (above - below)*(pos - lo)
+    return value
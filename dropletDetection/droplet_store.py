@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+from re import sub
+
+'''One SQLite file holding the results of every image of an experiment, as an alternative to globbing and
+concatenating hundreds of files in _figs. Each kind of result file is one table of the store:
+    values, runvalues, intensity, val_filtered, intensity_filtered, final_data
+with the same columns as the files, plus the sample and timepoint of the image they came from (see
+sample_timepoint). Tables are indexed by sample, timepoint and droplet number. Writing the results of an image
+again (for example after filtering out more droplets) replaces its earlier rows in that table.
+
+Several batch workers can write to the same store at once: the store uses SQLite's write-ahead log, and each write
+is a single transaction which waits (up to TIMEOUT seconds) for any other writer to finish, so readers are never
+blocked and writes never interleave. The store should be on a local disk, not a network drive.
+
+To read results back as DataFrames, for example the radius and kurtosis of every droplet of one sample:
+    query('results.sqlite', 'final_data', ['Radius (pixels)', 'kurtosis'], sample='50nM_gene')
+samples lists the samples and timepoints stored, and read_sql runs any SQL query.'''
+
+STORE_TABLES = ['values', 'runvalues', 'intensity', 'val_filtered', 'intensity_filtered', 'final_data']
+KEY_COLUMNS = ['sample', 'timepoint']
+DROPLET_COLUMN = 'droplet number'
+TIMEOUT = 120   # seconds a write waits for other writers
+
+def sample_timepoint(fname):
+    '''Sample name and timepoint of a result name (a file name without the result suffix and extension). The
+    timepoint is the number in the last "_" separated part of the name, as in read_names of the headless script,
+    and the sample is the rest: "50nM_gene_t05" is sample "50nM_gene" at timepoint 5, and the frame
+    "timelapse_v0_c1_t3" is sample "timelapse_v0_c1" at timepoint 3. Names without a number have no timepoint.'''
+    parts = fname.split('_')
+    timept = sub(r'\D', '', parts[-1])
+    if len(parts) == 1:
+        return fname, int(timept) if timept else None
+    return '_'.join(parts[:-1]), int(timept) if timept else None
+
+def connect(path):
+    '''Connection to the store at path (created if needed) in write-ahead log mode. Transactions are started
+    explicitly by write_store.'''
+    con = sqlite3.connect(path, timeout=TIMEOUT, isolation_level=None)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    return con
+
+def _quote(name):
+    '''Column or table name quoted for SQL, as result columns have spaces and parentheses.'''
+    return '"%s"' % str(name).replace('"', '""')
+
+def _sql_type(col):
+    '''SQLite column type of a DataFrame column.'''
+    if pd.api.types.is_bool_dtype(col) or pd.api.types.is_integer_dtype(col):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(col):
+        return 'REAL'
+    return 'TEXT'
+
+def _sql_value(v):
+    '''Plain Python value of a query parameter, with NaN as NULL.'''
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and np.isnan(v):
+        return None
+    return v
+
+def table_columns(con, table):
+    '''Column names of a table of the store, empty if the table does not exist.'''
+    return [row[1] for row in con.execute('PRAGMA table_info(%s)' % _quote(table))]
+
+def write_store(path, table, df, sample, timepoint, replace=True):
+    '''Writes the rows of one image (sample, timepoint) to a table of the store, replacing any rows it had before
+    (or adding to them with replace=False, to write a large table in chunks). The table is made from the columns of
+    the first DataFrame written to it, and columns first seen later (such as extra trace columns of a _runvalues
+    file) are added to it. The DataFrame index is not stored.'''
+    if table not in STORE_TABLES:
+        raise ValueError("Unknown store table: %s" % table)
+    df = df.reset_index(drop=True)
+    con = connect(path)
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        columns = table_columns(con, table)
+        if not columns:
+            cols = ['%s TEXT' % _quote('sample'), '%s INTEGER' % _quote('timepoint')]
+            cols += ['%s %s' % (_quote(c), _sql_type(df[c])) for c in df.columns if c not in KEY_COLUMNS]
+            con.execute('CREATE TABLE %s (%s)' % (_quote(table), ', '.join(cols)))
+            key = KEY_COLUMNS + ([DROPLET_COLUMN] if DROPLET_COLUMN in df.columns else [])
+            con.execute('CREATE INDEX %s ON %s (%s)' % (_quote('idx_' + table), _quote(table),
+                                                         ', '.join(_quote(c) for c in key)))
+            columns = table_columns(con, table)
+        for c in df.columns:
+            if c not in columns:
+                con.execute('ALTER TABLE %s ADD COLUMN %s %s' % (_quote(table), _quote(c), _sql_type(df[c])))
+
+        if replace:
+            con.execute('DELETE FROM %s WHERE sample IS ? AND timepoint IS ?' % _quote(table), (sample, timepoint))
+        cols = [c for c in df.columns if c not in KEY_COLUMNS]
+        # tolist gives plain Python values, and sqlite3 stores NaN as NULL
+        rows = zip([sample]*len(df), [timepoint]*len(df), *[df[c].tolist() for c in cols])
+        names = ', '.join(_quote(c) for c in KEY_COLUMNS + cols)
+        con.executemany('INSERT INTO %s (%s) VALUES (%s)' % (_quote(table), names, ', '.join(['?']*(len(cols) + 2))),
+                        rows)
+        con.execute('COMMIT')
+    except BaseException:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+def store_result(path, table, df, fname, replace=True):
+    '''write_store for the results of the image named fname (see sample_timepoint). Does nothing if path is empty,
+    so it can be called with the store parameter whether a store is used or not.'''
+    if not path:
+        return
+    sample, timepoint = sample_timepoint(fname)
+    write_store(path, table, df, sample, timepoint, replace)
+
+def query(path, table='final_data', columns=None, sample=None, timepoints=None, droplets=None):
+    '''Rows of a table of the store as a DataFrame, with the sample, timepoint and droplet number columns first and
+    then the columns asked for (all columns if None). sample (one name or a list), timepoints and droplets (lists of
+    numbers) select rows; None selects all. Rows are sorted by sample, timepoint and droplet number, and keep the
+    order they were written in within a droplet.'''
+    con = connect(path)
+    try:
+        available = table_columns(con, table)
+        if not available:
+            raise ValueError("Table %s is not in the store %s" % (table, path))
+        key = KEY_COLUMNS + ([DROPLET_COLUMN] if DROPLET_COLUMN in available else [])
+        if columns is None:
+            columns = [c for c in available if c not in key]
+        missing = [c for c in columns if c not in available]
+        if missing:
+            raise ValueError("Columns not in table %s: %s" % (table, ', '.join(missing)))
+
+        where, args = [], []
+        for col, values in [('sample', sample), ('timepoint', timepoints), (DROPLET_COLUMN, droplets)]:
+            if values is None:
+                continue
+            if isinstance(values, (str, int, np.integer)):
+                values = [values]
+            values = [_sql_value(v) for v in values]
+            where.append('%s IN (%s)' % (_quote(col), ', '.join(['?']*len(values))))
+            args += values
+        sql = 'SELECT %s FROM %s' % (', '.join(_quote(c) for c in key + [c for c in columns if c not in key]),
+                                     _quote(table))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        # rowid keeps the rows of a droplet (the bins of a histogram) in the order they were written
+        sql += ' ORDER BY ' + ', '.join(_quote(c) for c in key) + ', rowid'
+        return pd.read_sql_query(sql, con, params=args)
+    finally:
+        con.close()
+
+def samples(path, table='values'):
+    '''The samples and timepoints in a table of the store, with the number of rows (droplets) of each.'''
+    return read_sql(path, 'SELECT sample, timepoint, COUNT(*) AS rows FROM %s GROUP BY sample, timepoint '
+                          'ORDER BY sample, timepoint' % _quote(table))
+
+def read_sql(path, sql, params=()):
+    '''Runs any SQL query on the store and returns the result as a DataFrame. Column names with spaces need double
+    quotes, e.g. SELECT "Radius (pixels)" FROM final_data.'''
+    con = connect(path)
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:     # not available on Windows, peak memory is then not recorded
+    resource = None
+
+'''Timing and memory records of the stages of one run of headless_nd2_scaled_droplet.py (reading, edge detection,
+the Hough pass and peak search of each radii group, filtering, mask, intensities and figures), so that slow runs can
+be traced to the stage responsible. Each stage gets one record with its wall time, CPU time of this process, the
+peak memory (RSS) of the process at the end of the stage, the number of candidate circles coming out of it, and
+for the per-group stages the radii searched.
+
+The records of an image are written to _figs/$name_trace.jsonl, one JSON object per line, and the totals per stage
+are added as columns of _runvalues.csv (see StageTrace.summary). To combine many runs:
+    pd.concat([pd.read_json(fn, lines=True) for fn in glob('_figs/*_trace.jsonl')])'''
+
+def peak_rss_mb():
+    '''Peak resident memory of this process so far in MB (NaN where the resource module is missing).'''
+    if resource is None:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':     # bytes on macOS, kilobytes on Linux
+        return peak/1024.**2
+    return peak/1024.
+
+class StageTrace:
+    '''Stage records of one image. Use as:
+        with trace.stage('edges'):
+            ...
+    or, to add up a stage run in many pieces (the Hough pass of each radius of a group), make the record first
+    with trace.record and give it to every trace.stage call. Stage records are dicts which can be given extra
+    fields, such as 'candidates'.'''
+
+    def __init__(self, fn=None, name=None):
+        self.fn = fn
+        self.name = name
+        self.records = []
+
+    def record(self, stage, **info):
+        '''New, empty record of stage.'''
+        rec = {'stage': stage, 'wall_s': 0., 'cpu_s': 0., 'peak_rss_mb': np.nan}
+        rec.update(info)
+        self.records.append(rec)
+        return rec
+
+    @contextmanager
+    def stage(self, stage, rec=None, **info):
+        '''Times the with-block and adds it to rec, or to a new record of stage. Yields the record.'''
+        if rec is None:
+            rec = self.record(stage, **info)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield rec
+        finally:
+            rec['wall_s'] += time.perf_counter() - wall
+            rec['cpu_s'] += time.process_time() - cpu
+            rec['peak_rss_mb'] = peak_rss_mb()
+
+    def summary(self):
+        '''Totals for _runvalues.csv: the wall time of each stage summed over its records, total wall and CPU time,
+        peak memory, and the number of candidate circles after the peak search and in the final result.'''
+        cols = {}
+        for rec in self.records:
+            col = 'Time %s (s)' % rec['stage']
+            cols[col] = round(cols.get(col, 0.) + rec['wall_s'], 4)
+        cols['Time total (s)'] = round(sum(rec['wall_s'] for rec in self.records), 4)
+        cols['CPU total (s)'] = round(sum(rec['cpu_s'] for rec in self.records), 4)
+        cols['Peak RSS (MB)'] = round(max([rec['peak_rss_mb'] for rec in self.records] + [peak_rss_mb()]), 1)
+        # the full search counts candidates in its 'peaks' records, the other searches in their single 'hough' record
+        peaks = [rec['candidates'] for rec in self.records if rec['stage'] in ('hough', 'peaks') and 'candidates' in rec]
+        cols['Candidates found'] = int(sum(peaks))
+        final = [rec['candidates'] for rec in self.records if 'candidates' in rec]
+        if final:
+            cols['Candidates kept'] = int(final[-1])
+        return cols
+
+    def write(self, path):
+        '''Writes the records as JSON lines, each with the file and image name.'''
+        with open(path, 'w') as f:
+            for rec in self.records:
+                line = {'file': self.fn, 'name': self.name}
+                line.update({k: _json_value(v) for k, v in rec.items()})
+                f.write(json.dumps(line) + '\n')
+
+def _json_value(v):
+    '''Plain Python value of numpy numbers, with NaN written as null.'''
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and np.isnan(v):
+        return None
+    return v
@@ -6,51 +6,271 @@ __version__ = "1.1"
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-import sys
 import os
-import imageio
-from nd2reader import ND2Reader
-
-from skimage import data, color
-from skimage.transform import hough_circle, hough_circle_peaks
-from skimage.feature import canny
-from skimage.draw import circle_perimeter
-from skimage.measure import label
-from skimage.color import label2rgb
+import argparse
+
 from itertools import zip_longest
 from re import sub
 
+from auto_brightness import auto_brightness
+from droplet_render import overlay_image, draw_perimeters, to_rgb, write_png
+from droplet_trace import StageTrace
+from droplet_io import FORMATS, read_table, write_table, write_intensity_matrix, intensity_long
+from droplet_store import store_result
+from droplet_cache import cached_edges, cached_peaks, evict
+from droplet_stats import pixel_stats, parse_percentiles, PERCENTILES
+from droplet_pipeline import OutputWriter, output, read_ahead
+from droplet_hough import detect_edges, hough_peaks_parallel, suppress_overlap, OVERLAP_FACTOR
+from droplet_hough import seeded_peaks, uncovered_edges, uncovered_peaks, sort_peaks
+from droplet_hough import tile_size, tiled_edges, tiled_peaks, pyramid_peaks, estimate_radii
+from droplet_hough import slice_peaks, bounded_peaks, radius_peaks, PEAK_CAP_FACTOR
+from droplet_hough import edge_normals, radius_accumulators
+
 #make file executable chmod u+x filename
 
 '''This script runs without user input. Once runvalues for min and max rad, step size, and # of circles to limit
-search to are determined, those values can be edited directly here and the code will run by just calling:
-python headless_nd2_scaled_droplet.py $filename
+search to are determined, those values can be edited directly in RUN_PARAMS here, or saved in a parameter file, and
+the code will run by just calling:
+python headless_nd2_scaled_droplet.py $filename [--params $parameter_file]
+
+The parameter file is a .csv file in the same format as the _runvalues.csv files this script writes (a header row
+with the RUN_PARAMS column names and one row of values), so the _runvalues.csv of an earlier run can be reused to
+repeat it. Missing columns keep the defaults below. To process many files at once, see batch_nd2_droplets.py.
 
 To run this script, have both the raw .nd2 file as well as an auto brightness-adjusted .tif file scaled to 8-bit in 
-Fiji in the same directory as this script. All output files will be saved to a "./_figs/" directory created by
-running the script.'''
+Fiji in the same directory as the .nd2 file. All output files will be saved to a "./_figs/" directory created by
+running the script. With --no-tif (or 'auto' as the brightness source in the parameter file) the .tif file is not
+needed: the brightness-adjusted image is made from the raw .nd2 image in memory by auto_brightness.py, which
+repeats the Fiji pre-processing steps.
+
+When the script is run once per image, importing its modules is a fixed cost of every image, so modules only needed
+for some outputs are imported where they are used: matplotlib (with the non-interactive Agg backend, see pyplot) only
+for figures='matplotlib', imageio only to read the .tif file or write the raster .png images, and nd2reader only to
+read an .nd2 file. Detection only (--no-tif --no-figures) never imports matplotlib or imageio itself, but opening an
+.nd2 file with nd2reader imports pims, which loads both; so only processes given images already read, such as the
+workers of batch_nd2_droplets.py, run without them.
+
+Multi-frame .nd2 files (time-lapse, multi-point or multi-channel acquisitions) can be processed without splitting
+them first with --all-frames: frames are read one at a time by nd2_frames and each frame goes through detection and
+intensity extraction before the next one is read. Results of each frame are named by its coordinates in the file,
+"$filename_v$position_c$channel_t$timepoint", and the Time column is the frame's timepoint. --channel limits this to
+one or more channels.
+
+Droplets barely move between timepoints, so detection of a timepoint can be seeded with the droplets of the previous
+one: only windows around the previous droplets and a narrow band of radii are searched, plus a full search of the
+edges no previous droplet explains (see sequential_drop_detection). With --all-frames this is done automatically for
+every timepoint except every "refresh"-th one, which gets a full search. For single files, give the _values.csv of
+the previous timepoint with --seed-from.
+
+The wall time, CPU time, peak memory and number of candidate circles of every stage of a run are written to
+_figs/$filename_trace.jsonl, and the totals per stage are added to the _runvalues.csv (see droplet_trace.py).
+
+With --store (or a 'Results store' in the parameter file) the _values, _intensity and _runvalues tables of every
+image are also added to one SQLite file, indexed by sample, timepoint and droplet number, which can be written by
+several batch workers at once and queried as DataFrames (see droplet_store.py).
+
+With --cache (or a 'Cache directory' in the parameter file) the edge map and the peaks of every radius are kept on
+disk, keyed by the image and the edge and radius parameters (see droplet_cache.py), so re-running an image with
+other filtering parameters (Min accum relative, Number of droplets) skips edge detection and the Hough search.
+
+The _values file also holds exact statistics of the raw pixel values of each droplet (see droplet_stats.py).
+
+Result files and images are written on a writer thread (droplet_pipeline.OutputWriter) while the next steps run, and
+with --all-frames the next frame is read and brightness-adjusted on a background thread while the current one is
+searched. batch_nd2_droplets.py also reads the next images ahead of the workers. In the trace, the output stages
+then record the time to hand their writes over, and 'read' the time spent waiting for an image.'''
+
+# parameter name: (_runvalues.csv column, default value)
+RUN_PARAMS = {
+    'min_rad': ('Min radius (px)', 12),                 #### edit min rad here
+    'max_rad': ('Max radius (px)', 60),                 #### edit max rad here
+    'step': ('Step size (px)', 1),                      #### edit step size here
+    'num_drops': ('Number of droplets', 400),           #### edit limit of circles in each radii group here
+    'min_ac_relative': ('Min accum relative', 0.45),    #### edit fraction of weakest circles dropped here
+    'brightness': ('Brightness source', 'tif'),         #### 'tif' reads the Fiji .tif file, 'auto' skips it
+    'seed_band': ('Seed radius band (px)', 2),          #### edit radius change allowed between timepoints here
+    'seed_window': ('Seed window (px)', 5),             #### edit center movement allowed between timepoints here
+    'refresh': ('Full search interval', 10),            #### edit how often (in timepoints) a full search is run here
+    'memory_mb': ('Memory budget (MB)', 0),             #### edit to search large images in tiles, 0 searches at once
+    'pyramid_rad': ('Pyramid min radius (px)', 0),      #### edit to search radii from here up coarse-to-fine, 0 is off
+    'radius_range': ('Radius range', 'fixed'),          #### fixed, auto or auto_step (see estimate_radii)
+    'format': ('Output format', 'csv'),                 #### csv, parquet, feather or npz (see droplet_io.py)
+    'figures': ('Figures', 'raster'),                   #### raster, matplotlib or none (see comparison_image)
+    'store': ('Results store', ''),                     #### SQLite file results are also added to (see droplet_store.py)
+    'cache': ('Cache directory', ''),                   #### directory edges and peaks are cached in (see droplet_cache.py)
+    'cache_mb': ('Cache size (MB)', 2000),              #### edit the size the cache directory is kept within here
+    'percentiles': ('Intensity percentiles', PERCENTILES),  #### edit the pixel value percentiles in _values here
+    'voting': ('Hough voting', 'circle'),               #### circle or gradient (see droplet_hough.gradient_accumulators)
+}
+
+FIGURES = ['raster', 'matplotlib', 'none']
+RADIUS_RANGES = ['fixed', 'auto', 'auto_step']
+VOTING = ['circle', 'gradient']
 
 def main():
     '''Main function executes the script by calling on the functions in this file and using the parameters defined
-    below on the file named in the command line.'''
-    if len(sys.argv)==1:
-        print("Need to specify file to process as a parameter.")
-        print("   Exiting")
-        exit()
+    in RUN_PARAMS, or read from the parameter file, on the file named in the command line.'''
+    parser = argparse.ArgumentParser(description='Detect droplets in an .nd2 image and extract their intensities.')
+    parser.add_argument('fn', help='.nd2 file to process')
+    parser.add_argument('--params', default=None, help='parameter file (.csv in the _runvalues.csv format)')
+    parser.add_argument('--workers', type=int, default=1, help='processes searching radii groups in parallel')
+    parser.add_argument('--no-tif', action='store_true', help='brightness-adjust the .nd2 image instead of reading the .tif')
+    parser.add_argument('--all-frames', action='store_true', help='process every frame of a multi-frame .nd2 file')
+    parser.add_argument('--channel', type=int, action='append', default=None, help='with --all-frames, only this channel')
+    parser.add_argument('--seed-from', default=None, help='_values.csv of the previous timepoint to seed detection with')
+    parser.add_argument('--format', choices=list(FORMATS), default=None, help='format of the _values and _intensity files')
+    parser.add_argument('--figures', choices=FIGURES, default=None, help='how the _compimg and _mask images are made')
+    parser.add_argument('--no-figures', action='store_true', help='skip the _compimg and _mask images')
+    parser.add_argument('--radius-range', choices=RADIUS_RANGES, default=None,
+                        help='auto: search only the radii estimated from the image, within min and max radius')
+    parser.add_argument('--store', default=None, help='SQLite file to also add the results to')
+    parser.add_argument('--cache', default=None, help='directory to cache edge maps and Hough peaks in')
+    parser.add_argument('--voting', choices=VOTING, default=None,
+                        help='gradient: edge pixels vote only along their gradient in the full search')
+    args = parser.parse_args()
+
+    params = read_params(args.params)
+    if args.no_tif:
+        params['brightness'] = 'auto'
+    if args.format is not None:
+        params['format'] = args.format
+    if args.figures is not None:
+        params['figures'] = args.figures
+    if args.no_figures:
+        params['figures'] = 'none'
+    if args.radius_range is not None:
+        params['radius_range'] = args.radius_range
+    if args.store is not None:
+        params['store'] = args.store
+    if args.cache is not None:
+        params['cache'] = args.cache
+    if args.voting is not None:
+        params['voting'] = args.voting
+    if args.all_frames:
+        process_nd2_frames(args.fn, params, args.workers, args.channel)
+    else:
+        prior = None
+        if args.seed_from is not None:
+            prior = read_table(args.seed_from)
+        process_file(args.fn, params, args.workers, prior)
+    print('Done')
 
-    fn = sys.argv[1] 
-    min_ac_relative = 0.45 
-    os.system("mkdir _figs")
+def read_params(fn=None):
+    '''Returns the run parameters as a dict of RUN_PARAMS names to values. Values are the defaults in RUN_PARAMS,
+    replaced by any RUN_PARAMS column found in the parameter file fn. Other columns of the file, and empty values,
+    are ignored.'''
+    params = {name: default for name, (col, default) in RUN_PARAMS.items()}
+    if fn is None:
+        return params
+
+    df = pd.read_csv(fn)
+    for name, (col, default) in RUN_PARAMS.items():
+        if col in df.columns and not pd.isna(df[col].iloc[0]):
+            params[name] = type(default)(df[col].iloc[0])
+    return params
+
+def process_file(fn, params, workers=1, prior=None, images=None):
+    '''Runs the full detection and intensity extraction on one .nd2 file with the given run parameters
+    (see read_params) and writes all results to the _figs directory. prior optionally holds the droplets of the
+    previous timepoint to seed detection with. images, if given, are the images of the file already read by
+    read_images (as batch_nd2_droplets.py does ahead of time). Returns the detected droplets once all results are
+    written.'''
+    os.makedirs('_figs', exist_ok=True)
+    trace = StageTrace(fn)
 
     print("\nOpening file: ", fn)
-    comp_img, fname, timept = read_file(fn)
+    with trace.stage('read', prefetched=images is not None):
+        if images is None:
+            images = read_images(fn, params)
+    full_img, comp_img, fname, timept, pix_micron = images
+    with OutputWriter() as writer:
+        return process_frame(fn, full_img, comp_img, fname, timept, pix_micron, params, workers, prior, trace,
+                             writer)
+
+def read_images(fn, params):
+    '''Reads the raw image of an .nd2 file and its brightness-adjusted version (the .tif file, or auto_brightness
+    with params['brightness'] 'auto'). Returns the raw and adjusted images, the result name, the time point and
+    the pixel to micron conversion.'''
     full_img, pix_micron = nd2_read(fn)
+    if params['brightness'] == 'auto':
+        fname, timept = read_names(fn)
+        comp_img = auto_brightness(full_img)
+    else:
+        comp_img, fname, timept = read_file(fn)
+    return full_img, comp_img, fname, timept, pix_micron
+
+def process_nd2_frames(fn, params, workers=1, channels=None):
+    '''Runs detection and intensity extraction on every frame of a multi-frame .nd2 file as it is read (see
+    nd2_frames). The brightness-adjusted image of each frame is always made in memory, as there are no .tif files
+    for single frames. Each frame is seeded with the droplets of the previous timepoint at the same position and
+    channel, except every params['refresh']-th timepoint, which is searched in full. The next frames are read and
+    brightness-adjusted on a background thread (droplet_pipeline.read_ahead) while the current one is processed,
+    and results are written on a writer thread. A frame which fails, in detection or in writing its results, is
+    reported under its own name and skipped, and once every other frame is done a RuntimeError names the failed
+    frames, so that batch runs record the file as failed.'''
+    os.makedirs('_figs', exist_ok=True)
+    params = dict(params, brightness='auto')
+    fname, timept = read_names(fn)
+
+    previous = {}
+    failed = []
 
-    min_rad = np.int(12)                #### edit min rad here
-    max_rad = np.int(60)                #### edit max rad here
-    step = np.int(1)                    #### edit step size here
+    print("\nOpening file: ", fn)
+    frames = read_ahead((coords, full_img, auto_brightness(full_img), pix_micron)
+                        for coords, full_img, pix_micron in nd2_frames(fn, channels))
+    with OutputWriter() as writer:
+        while True:
+            trace = StageTrace(fn)
+            with trace.stage('read'):
+                frame = next(frames, None)
+            if frame is None:
+                break
+            coords, full_img, comp_img, pix_micron = frame
+            frame_name = '%s_v%d_c%d_t%d' % (fname, coords['v'], coords['c'], coords['t'])
+            print("Frame: ", frame_name)
+            prior = None
+            if params['refresh'] > 0 and coords['t'] % params['refresh'] != 0:
+                prior = previous.get((coords['v'], coords['c']))
+            try:
+                previous[(coords['v'], coords['c'])] = process_frame(fn, full_img, comp_img, frame_name,
+                                                                     str(coords['t']), pix_micron, params, workers,
+                                                                     prior, trace, writer)
+            except Exception as e:
+                # one bad frame does not stop the rest of the file; the next timepoint is searched in full
+                previous.pop((coords['v'], coords['c']), None)
+                frame_failed(failed, frame_name, e)
+            for name, e in writer.take_errors():
+                frame_failed(failed, name, e)
+        writer.wait()
+        for name, e in writer.take_errors():
+            frame_failed(failed, name, e)
+    if failed:
+        raise RuntimeError('%d frames failed: %s' % (len(failed), ', '.join(failed)))
+
+def frame_failed(failed, frame_name, e):
+    '''Reports the error of a frame and adds the frame to the list of failed frames, once.'''
+    print("Frame %s failed: %s: %s" % (frame_name, type(e).__name__, e))
+    if frame_name not in failed:
+        failed.append(frame_name)
+
+def process_frame(fn, full_img, comp_img, fname, timept, pix_micron, params, workers=1, prior=None, trace=None,
+                  writer=None):
+    '''Detection and intensity extraction for one raw image (full_img) and its brightness-adjusted version
+    (comp_img). Results are written to the _figs directory under the name fname, on the thread of writer (a
+    droplet_pipeline.OutputWriter) if one is given, in which case they may still be being written when this
+    returns. prior optionally holds droplets (X, Y and Radius columns of a _values.csv) to seed detection with.
+    Every stage is recorded in trace (a droplet_trace.StageTrace, which may already hold the reading of the image).
+    Returns the detected droplets in the same columns.'''
+    if trace is None:
+        trace = StageTrace(fn)
+    trace.name = fname
+    if writer is not None:
+        writer.name = fname
+    min_ac_relative = params['min_ac_relative']
+    min_rad = params['min_rad']
+    max_rad = params['max_rad']
+    step = params['step']
 
     '''Because the range of radii searched across in the image is generally very large, and computational time and resources
     grow greatly if searching across the whole range at once, circles are first detected using sequential_drop_detection
@@ -63,9 +283,20 @@ def main():
     t is impossible to visually inspect the image with detected circles to remove any artifacts which may have been included 
     in results.'''
 
+    # with the 'auto' radius range, only the range estimate_radii finds within min and max radius is searched
+    estimate = None
+    if params['radius_range'] != 'fixed':
+        with trace.stage('radius_range') as rec:
+            min_rad, max_rad, step, num_circles = estimate_radii(comp_img, min_rad, max_rad, step,
+                                                                 params['radius_range'] == 'auto_step')
+            rec['candidates'] = num_circles
+        estimate = {'Auto min radius (px)': min_rad, 'Auto max radius (px)': max_rad, 'Auto step (px)': step}
+        print("Searching radii %d to %d (step %d)" % (min_rad, max_rad, step))
+
     hr = np.arange(min_rad, max_rad, step)
     hr_group = group_radii(hr)
-    drops_df, num_drops = sequential_drop_detection(full_img, comp_img, hr_group, min_ac_relative, fname)
+    drops_df, num_drops = sequential_drop_detection(full_img, comp_img, hr_group, min_ac_relative, fname,
+                                                    params['num_drops'], workers, prior, params, trace)
 
     '''After circles are detected and sorted in small radii groups above, all circles are pooled together to 
     remove the weakest 45% of circles (as determined by their accums value), remove overlapping circles, and save
@@ -75,10 +306,19 @@ def main():
     cy = np.array(drops_df['Y (pixels)'])
     radii = np.array(drops_df['Radius (pixels)'])
     accums = np.array(drops_df['Probability count'])
-    cx, cy, radii, accums = remove_low_accum(accums, cx, cy, radii, min_ac_relative, fname)
-    cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums)
-    write_drops_csv(cx, cy, radii, accums, fname, timept, pix_micron)
-    write_run_info_csv(fn, fname, pix_micron, min_rad, max_rad, step, num_drops)
+    with trace.stage('remove_low_accum', radii='all') as rec:
+        cx, cy, radii, accums = remove_low_accum(accums, cx, cy, radii, min_ac_relative, fname)
+        rec['candidates'] = len(radii)
+    with trace.stage('remove_overlap', radii='all') as rec:
+        cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums)
+        rec['candidates'] = len(radii)
+    with trace.stage('mask'):
+        mask, drop_pix = circle_mask(comp_img, cx, cy, radii, fname, 'none')
+    with trace.stage('stats'):
+        stats = pixel_stats(full_img, drop_pix, len(radii), parse_percentiles(params['percentiles']))
+    with trace.stage('write'):
+        output(writer, write_drops_csv, cx, cy, radii, accums, fname, timept, pix_micron, params['format'],
+               params['store'], stats)
 
     '''The lines below are used to: 
     - extract pixel brightness values from within the detected circles and save the results to a .csv file
@@ -87,35 +327,66 @@ def main():
     - plot diagnostics plots: a histogram of radii and the results from the edge detection and hough_circle functions.'''
 
     print("Making figures")
-    mask, ind_mask = circle_mask(comp_img, cx, cy, radii, fname)
-    intensity_of_droplets(full_img, ind_mask, radii, fname)
+    with trace.stage('intensity'):
+        intensity_of_droplets(full_img, drop_pix, radii, fname, params['format'], params['store'], writer)
 
-    comparison_image(comp_img, cx, cy, radii, accums, fname)
+    with trace.stage('figures'):
+        output(writer, mask_image, comp_img, mask, fname, params['figures'])
+        output(writer, comparison_image, comp_img, cx, cy, radii, accums, fname, params['figures'])
     # radii_hist(radii, pix_micron, fname)
     # diagnostics_plot(edges, hough_res,fname)
 
-    print('Done')
+    output(writer, write_run_info_csv, fn, fname, pix_micron, params, prior is not None, trace, estimate)
+    output(writer, trace.write, '_figs/%s_trace.jsonl' % fname.replace("/","__"))
 
-def read_file(fn):
-    '''Reads in the brightness adjust .tif file for detection of circles. 
-    Returns the image as numpy.array and the time point for further result filenames.'''
+    return pd.DataFrame({'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii})
+
+def read_names(fn):
+    '''Returns the file name without extension, used for all result filenames, and the time point, which is the
+    number in the last "_" separated part of the file name.'''
     basdir, basename = os.path.split(fn)
     fname, fext = os.path.splitext(basename)
     split_char = '_'
     timept = fname.split(split_char)
     timept = sub(r'\D', '', timept[-1])
-    img = imageio.imread(fname + '.tif')
+    return fname, timept
+
+def read_file(fn):
+    '''Reads in the brightness adjust .tif file for detection of circles. 
+    Returns the image as numpy.array and the time point for further result filenames.'''
+    basdir, basename = os.path.split(fn)
+    fname, timept = read_names(fn)
+    import imageio
+    img = imageio.imread(os.path.join(basdir, fname + '.tif'))
     img = np.array(img)
     return img, fname, timept
 
 def nd2_read(fn):
     '''Reads raw .nd2 file with full bit depth for pixel intensity extraction.
     Reads the conversion for pixels to microns for the image from metadata.'''
+    from nd2reader import ND2Reader
     img = ND2Reader(fn)
     pix_micron = img.metadata['pixel_microns']
     img = np.array(img[0])
     return img, pix_micron
 
+def nd2_frames(fn, channels=None):
+    '''Generator over the frames of an .nd2 file, by timepoint, then position, then channel. Yields the coordinates
+    of the frame as a dict with keys 't', 'v' and 'c', the frame as a numpy array with full bit depth, and the pixel
+    to micron conversion. Only one frame is read from the file at a time. For z-stacks only the first plane is used.
+    channels, if given, is a list of the channel numbers to read.'''
+    from nd2reader import ND2Reader
+    with ND2Reader(fn) as images:
+        pix_micron = images.metadata['pixel_microns']
+        sizes = images.sizes
+        if channels is None:
+            channels = range(sizes.get('c', 1))
+        for t in range(sizes.get('t', 1)):
+            for v in range(sizes.get('v', 1)):
+                for c in channels:
+                    frame = np.array(images.get_frame_2D(c=c, t=t, v=v))
+                    yield {'t': t, 'v': v, 'c': c}, frame, pix_micron
+
 def grouper(iterable, chunksize):
     args = [iter(iterable)] * chunksize
     return zip_longest(*args, fillvalue=None)
@@ -123,7 +394,9 @@ def grouper(iterable, chunksize):
 def group_radii(hr):
     '''Groups the radii into small groups spanning chunksize steps. The final group of largest radii will span
     whatever remaining steps are left, which may be chunksize or less depending on the number of radii searched
-    I left chunksize as 10 for all data processed for 2020 nanotubes in droplets paper.'''
+    I left chunksize as 10 for all data processed for 2020 nanotubes in droplets paper.
+    The groups only set how circles are filtered (remove_low_accum and num_drops per group), not memory: the search
+    holds one radius at a time whatever the group size, and memory is bounded by params['memory_mb'] tiling.'''
     # removed the Nones in a clunky way. Try to for and can improve if necessary later
     chunksize = 10
     hr_group = list(grouper(hr, chunksize))
@@ -134,35 +407,161 @@ def group_radii(hr):
         hr_group_filtered.append(item)
     return hr_group_filtered
 
-def sequential_drop_detection(img, comp_img, hr_group, min_ac_relative, fn):
+def sequential_drop_detection(img, comp_img, hr_group, min_ac_relative, fn, num_drops=400, workers=1, prior=None,
+                              params=None, trace=None):
     '''Full description of this function above in main. The short version is this function breaks the very large and
     computationally heavy search of circles over a large range (ex. 10-50, step size 1) into smaller groups.
     Circles detected within these groups are compared and removed based on strength, overlapping, and a total
     cap on the number of circles allowed in each group (num_drops). The results from each small group are compiled
-    into one large dataframe which contains accums, cx, cy, radius of each circle for further processing.'''
+    into one large dataframe which contains accums, cx, cy, radius of each circle for further processing.
+    The search used (seeded by prior, tiled, pyramid, gradient, cached or parallel) follows params and workers.'''
 
     df = pd.DataFrame()
-    num_drops = np.int(400)
     # print("\nFinding circles and etracting intensities")
+    if trace is None:
+        trace = StageTrace()
+
+    hough_radii = np.concatenate(hr_group)
+    tile = None
+    cache = params['cache'] if params is not None else ''
+    with trace.stage('edges') as rec:
+        if params is not None and params['memory_mb'] > 0:
+            tile = tile_size(params['memory_mb'], np.max(hough_radii))
+        if cache:
+            edges, edge_key, rec['cached'] = cached_edges(comp_img, cache, tile)
+        elif tile is not None:
+            edges = tiled_edges(comp_img, tile)
+        else:
+            edges = detect_edges(comp_img)
+
+    if prior is not None and len(prior) > 0:
+        with trace.stage('hough', search='seeded') as rec:
+            p_cx = np.array(prior['X (pixels)'])
+            p_cy = np.array(prior['Y (pixels)'])
+            p_radii = np.array(prior['Radius (pixels)'])
+            band, window = params['seed_band'], params['seed_window']
+            seeded = seeded_peaks(edges, p_cx, p_cy, p_radii, hough_radii, band, window)
+            free = uncovered_edges(edges, seeded[1], seeded[2], seeded[3])
+            new = uncovered_peaks(free, hough_radii, tile)
+            all_accums, all_cx, all_cy, all_radii = sort_peaks(*[np.concatenate(col) for col in zip(seeded, new)])
+            rec['candidates'] = len(all_radii)
+    elif tile is not None:
+        with trace.stage('hough', search='tiled') as rec:
+            all_accums, all_cx, all_cy, all_radii = tiled_peaks(edges, hough_radii, tile, workers)
+            rec['candidates'] = len(all_radii)
+    elif params is not None and params['pyramid_rad'] > 0:
+        with trace.stage('hough', search='pyramid') as rec:
+            all_accums, all_cx, all_cy, all_radii = pyramid_peaks(comp_img, edges, hough_radii, params['pyramid_rad'])
+            rec['candidates'] = len(all_radii)
+    elif params is not None and params['voting'] == 'gradient':
+        with trace.stage('edges', normals=True):
+            normals = edge_normals(comp_img, edges)
+        all_accums, all_cx, all_cy, all_radii = hough_peaks_groups(edges, hr_group, trace, min_ac_relative, num_drops,
+                                                                   normals)
+    elif cache:
+        with trace.stage('hough', search='cached') as rec:
+            all_accums, all_cx, all_cy, all_radii, rec['cached'] = cached_peaks(edges, edge_key, hr_group, cache,
+                                                                                workers)
+            rec['candidates'] = len(all_radii)
+    elif workers > 1:
+        with trace.stage('hough', search='parallel') as rec:
+            all_accums, all_cx, all_cy, all_radii = hough_peaks_parallel(edges, hr_group, workers, min_ac_relative,
+                                                                         num_drops)
+            rec['candidates'] = len(all_radii)
+    else:
+        all_accums, all_cx, all_cy, all_radii = hough_peaks_groups(edges, hr_group, trace, min_ac_relative, num_drops)
 
     for i in hr_group:
-        accums, cx, cy, radii, edges, hough_res = find_droplets(comp_img, i)
-        # diagnostics_plot(edges, hough_res, fn, i)		### Will plot the hough intensities for each HR group
-        cx, cy, radii, accums_prob = remove_low_accum(accums, cx, cy, radii, min_ac_relative, fn)
-        cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums_prob)
+        in_group = np.isin(all_radii, i)
+        if not np.any(in_group):
+            continue
+        group = '%d-%d' % (i[0], i[-1])
+        accums, cx, cy, radii = all_accums[in_group], all_cx[in_group], all_cy[in_group], all_radii[in_group]
+        with trace.stage('remove_low_accum', radii=group) as rec:
+            cx, cy, radii, accums_prob = remove_low_accum(accums, cx, cy, radii, min_ac_relative, fn)
+            rec['candidates'] = len(radii)
+        with trace.stage('remove_overlap', radii=group) as rec:
+            cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums_prob)
+            rec['candidates'] = len(radii)
         cx, cy, radii, accums = lim_num_drops(cx, cy, radii, accums, num_drops)
         accums = np.round(accums, decimals=5)
         dict_vals = {'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii, 'Probability count': accums}
         temp_df = pd.DataFrame(dict_vals)
         df = pd.concat([df, temp_df], sort=False)
 
+    if cache:
+        evict(cache, params['cache_mb'])
+
+    if df.empty:
+        # no circles in any group, e.g. a blank frame
+        df = pd.DataFrame({'X (pixels)': np.zeros(0, dtype=int), 'Y (pixels)': np.zeros(0, dtype=int),
+                           'Radius (pixels)': np.zeros(0, dtype=int), 'Probability count': np.zeros(0)})
     df = df.reset_index(drop=True)
     df = df.reset_index()
     df = df.rename(columns={'index': 'droplet number'})
     return df, num_drops
 
-def write_drops_csv(cx, cy, radii, accums, fn, timept, pix_micron):
-    '''Save all information about final detected circles to a .csv file.'''
+def hough_peaks_groups(edges, hr_group, trace, min_ac_relative=None, num_drops=None, normals=None):
+    '''Same peaks as droplet_hough.hough_peaks_all_radii, with the building of the accumulators ('hough') and the
+    peak search ('peaks') of each hr_group recorded apart in trace. The accumulators of all groups still come from
+    one hough_accumulators generator, so the edge map is transformed only once.
+    If min_ac_relative and num_drops are given, each group only keeps the peaks which can pass remove_low_accum and
+    lim_num_drops (droplet_hough.bounded_peaks), so weak peaks are never taken out of the accumulators. The result
+    after filtering is the same as with every peak; a group whose bounded result is not complete is searched again
+    in full, which is recorded as complete=False in its 'peaks' record.
+    With normals (see droplet_hough.edge_normals) the accumulators come from gradient voting.'''
+    accumulators = radius_accumulators(edges, np.concatenate(hr_group), normals)
+    accums, cx, cy, radii = [], [], [], []
+    for i in hr_group:
+        group = '%d-%d' % (i[0], i[-1])
+        hough_rec = trace.record('hough', radii=group, search='full' if normals is None else 'gradient')
+        peaks_rec = trace.record('peaks', radii=group, candidates=0)
+        if min_ac_relative is not None:
+            with trace.stage('peaks', peaks_rec):
+                h_p, x_p, y_p, r_p, complete = bounded_peaks(timed_accumulators(accumulators, len(i), trace, hough_rec),
+                                                             min_ac_relative, num_drops, PEAK_CAP_FACTOR*num_drops)
+                if not complete:
+                    h_p, x_p, y_p, r_p = radius_peaks(edges, i, normals)
+            # the accumulators were built inside the peak search, count that time only under 'hough'
+            peaks_rec['wall_s'] -= hough_rec['wall_s']
+            peaks_rec['cpu_s'] -= hough_rec['cpu_s']
+            peaks_rec['complete'] = complete
+            peaks_rec['candidates'] = len(h_p)
+            accums.append(h_p)
+            cx.append(x_p)
+            cy.append(y_p)
+            radii.append(r_p)
+            continue
+        for r in i:
+            with trace.stage('hough', hough_rec):
+                radius, acc, num_points = next(accumulators)
+            with trace.stage('peaks', peaks_rec):
+                h_p, x_p, y_p = slice_peaks(acc, None, num_points)
+            del acc
+            peaks_rec['candidates'] += len(h_p)
+            accums.append(h_p)
+            cx.append(x_p)
+            cy.append(y_p)
+            radii.append(np.full(len(h_p), radius))
+
+    accums = np.concatenate(accums)
+    cx = np.concatenate(cx).astype(int)
+    cy = np.concatenate(cy).astype(int)
+    radii = np.concatenate(radii).astype(int)
+    return sort_peaks(accums, cx, cy, radii)
+
+def timed_accumulators(accumulators, num, trace, rec):
+    '''Takes the next num (radius, votes, num_points) slices from accumulators, adding the time to build each one to
+    the 'hough' record rec.'''
+    for n in range(num):
+        with trace.stage('hough', rec):
+            item = next(accumulators)
+        yield item
+
+def write_drops_csv(cx, cy, radii, accums, fn, timept, pix_micron, fmt='csv', store='', stats=None):
+    '''Save all information about final detected circles to a .csv file, or a binary file of the format fmt
+    (see droplet_io.py). If store is given, the table is also added to that results store (see droplet_store.py).
+    stats, the pixel statistics of each circle (droplet_stats.pixel_stats), are added as columns if given.'''
     vol = []
     for i in range(cx.shape[0]):
         temp = volume(radii[i], pix_micron)
@@ -172,32 +571,35 @@ def write_drops_csv(cx, cy, radii, accums, fn, timept, pix_micron):
     accums = np.round(accums, decimals=5)
     dict_vals = {'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii, 'Probability count': accums, 'Time': timept, 'Volume (pL)': vol}
     df = pd.DataFrame(dict_vals)
+    if stats is not None:
+        df = pd.concat([df, stats.reset_index(drop=True)], axis=1)
     df = df.reset_index()
     df = df.rename(columns={'index': 'droplet number'})
-    df.to_csv('_figs/%s_values.%s' % (fn.replace("/","__"), 'csv'))
-
-def write_run_info_csv(fn, fname, pix_micron, min_rad, max_rad, step, num_drops):
-    '''This function saves all input parameters given by the user for each run of the code including the filename, 
-    the conversion factor from pixels to microns for the inout image, min and max radius searched through, 
-    the step size used to determine which discrete radius values to search for between the min and max value, and the 
-    limit on the number of circles found for each radii group (num_drops in sequential_drop_detection).'''
-    dict_vals = {'Filename': fn, 'Pix to micron': pix_micron, 'Min radius (px)': min_rad, 'Max radius (px)': max_rad, 'Step size (px)': step, 'Number of droplets': num_drops}
+    write_table(df, '_figs/%s_values%s' % (fn.replace("/","__"), FORMATS[fmt]))
+    store_result(store, 'values', df, fn)
+
+def write_run_info_csv(fn, fname, pix_micron, params, seeded=False, trace=None, estimate=None):
+    '''This function saves all input parameters used for each run of the code including the filename, 
+    the conversion factor from pixels to microns for the inout image, and every run parameter in RUN_PARAMS: min and
+    max radius searched through, the step size used to determine which discrete radius values to search for between
+    the min and max value, the limit on the number of circles found for each radii group (num_drops in
+    sequential_drop_detection) and the fraction of weakest circles dropped (min_ac_relative). The file can be given
+    back to this script as a parameter file to repeat the run. Seeded records whether detection was seeded with the
+    droplets of the previous timepoint. If a trace is given, its per stage totals (StageTrace.summary) are added as
+    extra columns, which are ignored when the file is used as a parameter file. So are the columns of estimate, the
+    radius range searched with the 'auto' radius range, as min and max radius keep the bounds it was estimated in.'''
+    dict_vals = {'Filename': fn, 'Pix to micron': pix_micron}
+    for name, (col, default) in RUN_PARAMS.items():
+        dict_vals[col] = params[name]
+    dict_vals['Seeded'] = seeded
+    if estimate is not None:
+        dict_vals.update(estimate)
+    if trace is not None:
+        dict_vals.update(trace.summary())
     df = pd.DataFrame([dict_vals])
     # df = df.reset_index()
     df.to_csv('_figs/%s_runvalues.%s' % (fname.replace("/","__"), 'csv'))
-
-def find_droplets(img, hr):
-    '''First a Canny filter (canny) is used to detect edges in the image and returns a boolean image. 
-    Then the Circular Hough Transform (hough_circle) transforms the boolean image to hough space for a range of radii. 
-    Peaks where circles are likely to be located in the hough space array (hough_res) are found with the hough_circle_peaks 
-    unction. For the range of radii given, the strengrh of different circle peaks is detemined through "votes", and the
-    peak strength value (accums) is returned along with the center (x,y) corrdinates and radius for 
-    each detected circle. See http://scikit-image.org/ for more information on each function.'''
-    edges = canny(img, sigma=3, low_threshold=10, high_threshold=20)            #These are the values used for all data in 2020 paper
-    hough_radii = hr
-    hough_res = hough_circle(edges, hough_radii)
-    accums, cx, cy, radii = hough_circle_peaks(hough_res, hough_radii)
-    return accums, cx, cy, radii, edges, hough_res
+    store_result(params['store'], 'runvalues', df, fname)
 
 def volume(radius, pix_micron):
     '''Calculates the volume of the droplet in femtoliters using the radius of a given circle.'''
@@ -210,7 +612,7 @@ def distance(x0, y0, r0, x1, y1, r1):
     if they are closer than 3/4 the sum of each radius. This does leave more possibility for large overlapping 
     circles to remain, but those can be removed after visual inspection after the code has run.'''
     dist = np.sqrt((x1-x0)**2+(y1-y0)**2)
-    ovr = dist < (3./4.)*(r1+r0)
+    ovr = dist < OVERLAP_FACTOR*(r1+r0)
     return ovr
 
 def remove_low_accum(accums, cx, cy, radii, min_ac_relative,fname):
@@ -218,7 +620,9 @@ def remove_low_accum(accums, cx, cy, radii, min_ac_relative,fname):
     min_ac_relative is hardcoded at the beginning of the main script. For all data processed for the 2020 nanotube
     in circles paper, it was set to 0.45, so that the bottom 45% of detected objects were dropped.
     Optional code at the end of the function to plot a histogram of the accums values for all detected objects 
-    with a vertical line at the cut-off value use_min.'''
+    with a vertical line at the cut-off value use_min. With no circles at all, the empty arrays are returned.'''
+    if len(accums) == 0:
+        return cx, cy, radii, accums
     use_min=min_ac_relative*accums[0]
 
     good = accums > use_min
@@ -237,23 +641,14 @@ def remove_low_accum(accums, cx, cy, radii, min_ac_relative,fname):
 
 def remove_overlap(cx, cy, radii, accums_prob):
     '''Removes accums, cx, cy and radii for overlapping objects determined by the two circles radii using the 
-    distance function above.'''
-    good = []
-    bad = []
-
-    for i in range(np.array(cx.shape[0])):
-        if i in bad:
-            continue
-        for j in range(i+1, np.array(cx.shape[0])):
-            ovr = distance(cx[i], cy[i], radii[i], cx[j], cy[j], radii[j])
-            if ovr == True:
-                bad.append(j)
-        good.append(i)
-
-    cx_nodup = np.array([cx[i] for i in good])
-    cy_nodup = np.array([cy[i] for i in good])
-    radii_nodup = np.array([radii[i] for i in good])
-    accums_nodup = np.array([accums_prob[i] for i in good])
+    same rule as the distance function above. Circles are expected sorted by accums, strongest first, and the stronger
+    of two overlapping circles is kept (droplet_hough.suppress_overlap).'''
+    good = suppress_overlap(cx, cy, radii)
+
+    cx_nodup = np.asarray(cx)[good]
+    cy_nodup = np.asarray(cy)[good]
+    radii_nodup = np.asarray(radii)[good]
+    accums_nodup = np.asarray(accums_prob)[good]
     return cx_nodup, cy_nodup, radii_nodup, accums_nodup
 
 def lim_num_drops(cx, cy, radii, accums, num_drops):
@@ -266,100 +661,121 @@ def lim_num_drops(cx, cy, radii, accums, num_drops):
 
 def draw_circles(comp_img, cx, cy, radii):
     '''Draw detected circles onto the brightness adjusted .tif image for visual inspection and removal or artifacts. 
-    Removes x,y coordinates which are outside the image.'''
-    img = color.gray2rgb(comp_img)
-    for center_y, center_x, radius in zip(cy, cx, radii):
-        radius = int(radius)
-        circy, circx = circle_perimeter(center_y, center_x, radius)
-        if np.max(circy) < len(img[:,0,0]) and  np.max(circx) < len(img[0,:,0]):
-            img[circy, circx] = (220, 20, 20)
-        else:
-            continue
-    return img
-
-def circle_mask(img, cx, cy, radii, fn):
-    '''Create a mask using all detected circles, and a list of individual masks for each circle.'''
-    y, x = img.shape
-    mask = np.zeros((y,x))
-    y, x  = np.indices((y,x))
-    ind_mask = []
+    Parts of circles outside the image are clipped (see droplet_render.py).'''
+    img = to_rgb(comp_img)
+    return draw_perimeters(img, cx, cy, radii)
+
+def circle_pixels(shape, cx, cy, radii):
+    '''Finds the pixels inside each circle by only looking at the bounding box of that circle. Returns the flat
+    (raveled) image index of every pixel inside a circle, and the droplet number of the circle it belongs to.
+    Pixels are grouped by droplet in droplet number order. Droplets which overlap each share the overlapping pixels.'''
+    rows, cols = shape
+    pix_idx = []
+    drop_no = []
     num = 0
 
     for center_y, center_x, radius in zip(cy, cx, radii):
-        radius = int(radius)
+        center_y, center_x, radius = int(center_y), int(center_x), int(radius)
+        y0, y1 = max(center_y - radius, 0), min(center_y + radius + 1, rows)
+        x0, x1 = max(center_x - radius, 0), min(center_x + radius + 1, cols)
+        y, x = np.ogrid[y0:y1, x0:x1]
         circle = (x-center_x)**2 + (y-center_y)**2 < radius**2
-        ind_mask.append(circle)
-        mask += circle
+        circy, circx = np.nonzero(circle)
+        pix_idx.append((circy + y0)*cols + circx + x0)
+        drop_no.append(np.full(len(circy), num))
         num += 1
 
-    for var in range(len(ind_mask)):
-        frame = ind_mask[var]
-        frame = np.invert(frame)
-        ind_mask[var] = frame
-
-    mask = mask.astype(bool)
-    mask = np.invert(mask)
+    if num == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(pix_idx), np.concatenate(drop_no)
+
+def circle_mask(img, cx, cy, radii, fn, figures='raster'):
+    '''Create a mask using all detected circles, and the pixels of each individual circle (see circle_pixels).
+    The masked image is saved by mask_image.'''
+    drop_pix = circle_pixels(img.shape, cx, cy, radii)
+    mask = np.ones(img.shape, dtype=bool)
+    mask.ravel()[drop_pix[0]] = False
+    mask_image(img, mask, fn, figures)
+    return mask, drop_pix
+
+def mask_image(img, mask, fn, figures='raster'):
+    '''Saves the image with everything outside the circles set to 0 as a .png at the image resolution, or as a
+    matplotlib figure with figures='matplotlib', or not at all with figures='none'.'''
+    if figures == 'none':
+        return
     img_m = img.copy()
     img_m[mask] = 0
-    
+    if figures == 'raster':
+        write_png('_figs/%s_mask.%s' % (fn.replace("/","__"), 'png'), img_m)
+        return
+
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.imshow(img_m)
     fig.tight_layout()
     fig.savefig('_figs/%s_mask.%s' % (fn.replace("/","__"), 'png'), dpi=700)
     plt.close()
 
-    # if np.max(circy) < len(img[:,0,0]) and  np.max(circx) < len(img[0,:,0]):
-    #     img[circy, circx] = (220, 20, 20)
-    # else:
-    #     continue
-    return mask, ind_mask
-
-def intensity_of_droplets(img, ind_mask, radii, fn):
-    '''Using the raw .nd2 image with full bit depth, and the mask of detected circles, extract the pixel value histogram
-    for each circle. Save the resulting pixel value histogram data with the circle ID and radius to a .csv file.'''
-    full_dhist = pd.DataFrame()
-    num = 0
-    for val in range(len(ind_mask)):
-        mask = ind_mask[val]
-        radd = np.array(radii[val])
-        temp = extract_intensities(img, mask, num, radd, fn)
-        full_dhist = full_dhist.append(temp)
-        num += 1
-    full_dhist = full_dhist.reset_index(drop=True)
-    full_dhist.to_csv('_figs/%s_intensity.%s' % (fn.replace("/","__"), 'csv'))
-
-def extract_intensities(img, mask, num, radd, fn):
-    '''This function extracts the pixel values for a an image with a given mask.
-    Currently, I have all areas outside the ROI set to 0. There may be a 
-    better way to do this in the future, although all of our image counts in the 
-    circles are far enough away from 0 that this does not yet cause confusion...'''
-    temp = img.copy()
-    temp = np.ma.array(temp, mask=mask, dtype=int)
-    # fig, ax = plt.subplots()
-    # ax.imshow(temp)
-    # fig.tight_layout()
-    # fig.savefig('_figs/%s_mask_d%s.%s' % (fn.replace("/","__"), num, 'png'), dpi=700)
-    # plt.close()
-    temp = temp.compressed()
-    # temp[mask] = 0
-
-    dhist, dbin = np.histogram(temp, bins=256)
-    dbin = dbin[:-1]
-    dno = np.array([str(num)])
-    dno = np.repeat(dno, len(dbin))
-    radd = np.repeat(radd, len(dbin))
-    dict = {'bin start': dbin, 'count': dhist, 'radius': radd, 'droplet number': dno}
-    drop_hist = pd.DataFrame(dict)
-    drop_hist.reset_index(inplace=True)
-    drop_hist.rename(columns={'index':'bin number'}, inplace=True)
-    return drop_hist
-
-def comparison_image(comp_img, cx, cy, radii, accums, fn):
+def intensity_of_droplets(img, drop_pix, radii, fn, fmt='csv', store='', writer=None):
+    '''Using the raw .nd2 image with full bit depth, and the pixels of detected circles, extract the pixel value histogram
+    for each circle. Save the resulting pixel value histogram data with the circle ID and radius to a .csv file, or
+    as a dense droplets x 256 matrix in a binary file of the format fmt (see droplet_io.py). If store is given, the
+    histograms are also added to that results store in the long format of the .csv file. The files are written on
+    the thread of writer if one is given.'''
+    num_drops = len(radii)
+    dhist, dbin = extract_intensities(img, drop_pix, num_drops)
+    path = '_figs/%s_intensity%s' % (fn.replace("/","__"), FORMATS[fmt])
+    output(writer, write_intensity_matrix, path, np.arange(num_drops), radii, dhist, dbin)
+    if store:
+        output(writer, store_result, store, 'intensity', intensity_long(np.arange(num_drops), radii, dhist, dbin), fn)
+
+def extract_intensities(img, drop_pix, num_drops, bins=256):
+    '''This function extracts the pixel value histogram of every droplet at once. Each droplet gets the same 256 bins
+    np.histogram would give its pixels (evenly spaced from the droplet's min to max pixel value), and all counts
+    are found with a single bincount over (droplet, bin) pairs. Returns the counts and the bin starts, each as a
+    (num_drops, bins) array.'''
+    pix_idx, drop_no = drop_pix
+    vals = img.ravel()[pix_idx].astype(int)
+
+    npix = np.bincount(drop_no, minlength=num_drops)
+    starts = np.concatenate(([0], np.cumsum(npix)[:-1]))
+    full = npix > 0
+    lo = np.zeros(num_drops)
+    hi = np.ones(num_drops)
+    lo[full] = np.minimum.reduceat(vals, starts[full])
+    hi[full] = np.maximum.reduceat(vals, starts[full])
+    same = lo == hi
+    lo[same] -= 0.5
+    hi[same] += 0.5
+    edges = np.linspace(lo, hi, bins + 1, axis=1)
+
+    # same bin index arithmetic as np.histogram, including its corrections at the bin edges
+    vals = vals.astype(float)
+    ind = ((vals - lo[drop_no]) / (hi - lo)[drop_no] * bins).astype(int)
+    ind[ind == bins] -= 1
+    ind[vals < edges[drop_no, ind]] -= 1
+    ind[(vals >= edges[drop_no, ind + 1]) & (ind != bins - 1)] += 1
+
+    dhist = np.bincount(drop_no*bins + ind, minlength=num_drops*bins).reshape(num_drops, bins)
+    dbin = edges[:, :-1]
+    return dhist, dbin
+
+def comparison_image(comp_img, cx, cy, radii, accums, fn, figures='raster'):
     '''Prepare a figure of the brightness-adjusted image with detected circles drawn in red and their IDs
     written near the upper-right side of the circle in colors corresponding to groups of 100. The different
-    colors only aid in distnguishing circle IDs on busy comparison images, to aid removal of artificacts by ID.'''
+    colors only aid in distnguishing circle IDs on busy comparison images, to aid removal of artificacts by ID.
+    By default the circles and IDs are drawn straight into the image pixels (see droplet_render.py), which is much
+    faster for many droplets. figures='matplotlib' makes the 700 dpi matplotlib figure instead, and
+    figures='none' skips the image.'''
+    if figures == 'none':
+        return
+    if figures == 'raster':
+        write_png('_figs/%s_compimg.%s' % (fn.replace("/","__"), 'png'), overlay_image(comp_img, cx, cy, radii))
+        return
+
     img_circles = draw_circles(comp_img, cx, cy, radii)
 
+    plt = pyplot()
     fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(10, 10))
     # ax[0].imshow(comp_img, cmap='gray')
     # ax[0].set_title('Original image of droplets')
@@ -380,8 +796,17 @@ def comparison_image(comp_img, cx, cy, radii, accums, fn):
     fig.savefig('_figs/%s_compimg.%s' % (fn.replace("/","__"), 'png'), dpi=700)
     plt.close()
 
+def pyplot():
+    '''matplotlib.pyplot with the non-interactive Agg backend, which only writes image files. matplotlib is imported
+    here, the first time a matplotlib figure is made, so runs without matplotlib figures never load it.'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 def diagnostics_plot(edges, hough_res,fn, hgroup):
     '''Plots of the hough transform at each radius tested.'''
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.imshow(edges)
     ax.set_title('edges')
@@ -414,6 +839,7 @@ def hist_full_img(img, fn):
 
 def labeled_drop(img, cx, cy, drop_no_array):
     '''Plotting the mask with circle labels for troubleshooting. Needs to be added/cleaned.'''
+    plt = pyplot()
     fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(10, 4))
     ax.imshow(label_img)
     for i in range(len(cx)):
@@ -425,6 +851,7 @@ def labeled_drop(img, cx, cy, drop_no_array):
 def radii_hist(radii, pix_micron, fn):
     '''Plot a histogram of the detected circle radii.'''
     radii_um = pix_micron*radii
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.hist(radii_um, bins=len(np.arange(10, 50, 2)), rwidth=0.8)
     ax.set_title('A histogram of detected droplet radii (um)')
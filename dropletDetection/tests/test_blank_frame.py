@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+pytest.importorskip('nd2reader')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import headless_nd2_scaled_droplet as headless
+
+'''Frames without droplets, and frames which fail, in the headless script.'''
+
+@pytest.fixture
+def params(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('_figs')
+    params = headless.read_params()
+    params['brightness'] = 'auto'
+    params['figures'] = 'none'
+    return params
+
+def blank():
+    return np.zeros((200, 200), dtype=np.uint16), np.zeros((200, 200), dtype=np.uint8)
+
+def test_blank_frame(params):
+    full_img, comp_img = blank()
+    df = headless.process_frame('blank.nd2', full_img, comp_img, 'blank_t0', '0', 0.5, params)
+    assert df.empty
+    values = pd.read_csv(os.path.join('_figs', 'blank_t0_values.csv'), index_col=0)
+    assert values.empty
+    assert 'Radius (pixels)' in values.columns
+    assert os.path.exists(os.path.join('_figs', 'blank_t0_intensity.csv'))
+
+def test_failed_frame_does_not_stop_the_file(params, monkeypatch):
+    def frames(fn, channels=None):
+        for t in range(3):
+            yield {'t': t, 'v': 0, 'c': 0}, blank()[0], 0.5
+    process_frame = headless.process_frame
+    def fail_t1(fn, full_img, comp_img, fname, *args):
+        if fname.endswith('_t1'):
+            raise ValueError('bad frame')
+        return process_frame(fn, full_img, comp_img, fname, *args)
+    monkeypatch.setattr(headless, 'nd2_frames', frames)
+    monkeypatch.setattr(headless, 'process_frame', fail_t1)
+    with pytest.raises(RuntimeError, match='blank_v0_c0_t1'):
+        headless.process_nd2_frames('blank.nd2', params)
+    assert os.path.exists(os.path.join('_figs', 'blank_v0_c0_t0_values.csv'))
+    assert os.path.exists(os.path.join('_figs', 'blank_v0_c0_t2_values.csv'))
+    assert not os.path.exists(os.path.join('_figs', 'blank_v0_c0_t1_values.csv'))
+
+def test_failed_write_belongs_to_its_frame(params, monkeypatch):
+    def frames(fn, channels=None):
+        for t in range(3):
+            yield {'t': t, 'v': 0, 'c': 0}, blank()[0], 0.5
+    write_drops_csv = headless.write_drops_csv
+    def fail_t0(cx, cy, radii, accums, fn, *args):
+        if fn.endswith('_t0'):
+            raise IOError('disk full')
+        return write_drops_csv(cx, cy, radii, accums, fn, *args)
+    monkeypatch.setattr(headless, 'nd2_frames', frames)
+    monkeypatch.setattr(headless, 'write_drops_csv', fail_t0)
+    with pytest.raises(RuntimeError, match='1 frames failed: blank_v0_c0_t0$'):
+        headless.process_nd2_frames('blank.nd2', params)
+    assert os.path.exists(os.path.join('_figs', 'blank_v0_c0_t1_values.csv'))
+    assert os.path.exists(os.path.join('_figs', 'blank_v0_c0_t2_values.csv'))
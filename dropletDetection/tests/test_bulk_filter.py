@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '_figs'))
+from bulk_filter import filter_directory
+
+'''bulk_filter.py on a directory holding the _values and _intensity files of two samples.'''
+
+def write_results(directory, fn_short, num_drops=5):
+    '''Writes the _values.csv and _intensity.csv files of one image with num_drops droplets.'''
+    drops = np.arange(num_drops)
+    pd.DataFrame({'droplet number': drops, 'Radius (pixels)': drops + 10}).to_csv(
+        os.path.join(directory, fn_short + '_values.csv'))
+    pd.DataFrame({'bin number': 0, 'count': 1, 'droplet number': drops}).to_csv(
+        os.path.join(directory, fn_short + '_intensity.csv'))
+
+def kept(directory, fn_short):
+    '''Droplet numbers left in the _val_filtered.csv file of an image.'''
+    df = pd.read_csv(os.path.join(directory, fn_short + '_val_filtered.csv'), index_col=0)
+    return list(df['droplet number'])
+
+@pytest.fixture
+def two_samples(tmp_path):
+    for fn_short in ['geneA_t1', 'geneA_t2', 'geneB_t1']:
+        write_results(str(tmp_path), fn_short)
+    return tmp_path
+
+def test_timepoint_lines_need_a_sample(two_samples):
+    artifacts = two_samples / 'artifacts.txt'
+    artifacts.write_text('1: 3\n')
+    with pytest.raises(ValueError):
+        filter_directory(str(artifacts), str(two_samples))
+    assert not list(two_samples.glob('*_filtered.csv'))
+
+def test_timepoint_lines_filter_one_sample(two_samples):
+    artifacts = two_samples / 'artifacts.txt'
+    artifacts.write_text('1: 3\n')
+    filter_directory(str(artifacts), str(two_samples), sample='geneA')
+    assert kept(str(two_samples), 'geneA_t1') == [0, 1, 2, 4]
+    assert kept(str(two_samples), 'geneA_t2') == [0, 1, 2, 3, 4]
+    assert not (two_samples / 'geneB_t1_val_filtered.csv').exists()
+    assert not (two_samples / 'geneB_t1_intensity_filtered.csv').exists()
+
+def test_full_names_and_existing_filtered_files(two_samples):
+    # geneA_t2 was filtered by hand before, and has no line
+    (two_samples / 'geneA_t2_val_filtered.csv').write_text('manual')
+    (two_samples / 'geneA_t2_intensity_filtered.csv').write_text('manual')
+    artifacts = two_samples / 'artifacts.txt'
+    artifacts.write_text('geneA_t1: 0, 4\n')
+    filter_directory(str(artifacts), str(two_samples))
+    assert kept(str(two_samples), 'geneA_t1') == [1, 2, 3]
+    assert (two_samples / 'geneA_t2_val_filtered.csv').read_text() == 'manual'
+    assert (two_samples / 'geneA_t2_intensity_filtered.csv').read_text() == 'manual'
+    assert not (two_samples / 'geneB_t1_val_filtered.csv').exists()
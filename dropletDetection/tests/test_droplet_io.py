@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '_figs'))
+from droplet_io import FORMATS, read_table, read_intensity, write_intensity_matrix
+from headless_nd2_scaled_droplet import write_drops_csv, volume
+from bad_filter import filter_df_val_revamp, filter_df_int_revamp
+from generating_skew_kurt_dno import skew_kurt_file
+
+'''Result files written by the headless script in every format, and read back through droplet_io and the _figs
+scripts (bad_filter.py and generating_skew_kurt_dno.py).'''
+
+NAME = 'gene_t05'
+
+def droplets(num_drops=6, bins=256, seed=0):
+    rng = np.random.default_rng(seed)
+    cx, cy = rng.integers(20, 200, num_drops), rng.integers(20, 200, num_drops)
+    radii = rng.integers(12, 40, num_drops)
+    accums = rng.random(num_drops)
+    counts = rng.integers(0, 50, (num_drops, bins))
+    starts = np.tile(np.arange(bins)*16, (num_drops, 1))
+    return cx, cy, radii, accums, counts, starts
+
+def write_results(fmt):
+    '''_values and _intensity files of NAME in the format fmt, as the headless script writes them.'''
+    cx, cy, radii, accums, counts, starts = droplets()
+    write_drops_csv(cx, cy, radii, accums, NAME, '05', 0.5, fmt)
+    write_intensity_matrix('_figs/%s_intensity%s' % (NAME, FORMATS[fmt]), np.arange(len(cx)), radii, counts, starts)
+
+@pytest.fixture
+def figs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('_figs')
+    return tmp_path / '_figs'
+
+def test_csv_values_unchanged(figs):
+    '''The _values.csv file is written as before the binary formats, with the timepoint as given.'''
+    write_results('csv')
+    cx, cy, radii, accums, counts, starts = droplets()
+    vol = [np.round(volume(r, 0.5)*(10**-3), decimals=5) for r in radii]
+    df = pd.DataFrame({'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii,
+                       'Probability count': np.round(accums, decimals=5), 'Time': '05', 'Volume (pL)': vol})
+    df = df.reset_index().rename(columns={'index': 'droplet number'})
+    assert (figs / (NAME + '_values.csv')).read_text() == df.to_csv()
+    assert '05' in [line.split(',')[6] for line in (figs / (NAME + '_values.csv')).read_text().splitlines()]
+
+@pytest.mark.parametrize('fmt', ['npz', 'parquet', 'feather'])
+def test_round_trip(figs, fmt):
+    if fmt != 'npz':
+        pytest.importorskip('pyarrow', exc_type=ImportError)
+    write_results('csv')
+    write_results(fmt)
+    csv_values = read_table('_figs/%s_values.csv' % NAME)
+    values = read_table('_figs/%s_values%s' % (NAME, FORMATS[fmt]))
+    assert list(values['Time']) == ['05']*len(values)
+    pd.testing.assert_frame_equal(values.drop(columns='Time'), csv_values.drop(columns='Time'), check_dtype=False)
+    pd.testing.assert_frame_equal(read_intensity('_figs/%s_intensity%s' % (NAME, FORMATS[fmt])),
+                                  read_intensity('_figs/%s_intensity.csv' % NAME), check_dtype=False)
+
+    # artifact filtering and the skew and kurtosis script keep the format and give the same results
+    os.chdir('_figs')
+    final = {}
+    for ext in ['.csv', FORMATS[fmt]]:
+        filter_df_val_revamp(NAME + '_values' + ext, [1, 4], NAME, '_val_filtered' + ext)
+        filter_df_int_revamp(NAME + '_intensity' + ext, [1, 4], NAME, '_intensity_filtered' + ext)
+        skew_kurt_file(NAME + '_intensity_filtered' + ext, exact=True)
+        final[ext] = read_table(NAME + '_final_data' + ext)
+    assert list(final['.csv']['droplet number']) == [0, 2, 3, 5]
+    pd.testing.assert_frame_equal(final[FORMATS[fmt]].drop(columns='Time').reset_index(drop=True),
+                                  final['.csv'].drop(columns='Time').reset_index(drop=True), check_dtype=False)
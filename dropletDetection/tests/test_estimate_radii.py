@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from synthetic_droplets import synthetic_image
+from auto_brightness import auto_brightness
+from droplet_hough import estimate_radii
+
+'''Radius range estimation on synthetic images with a known answer.'''
+
+MIN_RAD, MAX_RAD = 5, 100
+
+@pytest.mark.parametrize('seed, min_rad, max_rad', [(0, 12, 40), (1, 12, 40), (0, 25, 50), (2, 25, 50)])
+def test_range_holds_the_true_radii(seed, min_rad, max_rad):
+    raw, truth = synthetic_image((512, 512), 50, min_rad, max_rad, seed)
+    lo, hi, step, num_circles = estimate_radii(auto_brightness(raw), MIN_RAD, MAX_RAD)
+    radii = truth['Radius (pixels)']
+    assert lo <= radii.min() and radii.max() < hi
+    # much tighter than the range given
+    assert hi - lo < (MAX_RAD - MIN_RAD)/2
+    assert step == 1
+    assert num_circles > 0
+
+def test_auto_step():
+    raw, truth = synthetic_image((768, 768), 20, 60, 90, 0)
+    lo, hi, step, num_circles = estimate_radii(auto_brightness(raw), MIN_RAD, 120, auto_step=True)
+    assert lo <= truth['Radius (pixels)'].min() and truth['Radius (pixels)'].max() < hi
+    assert step == lo//25 == 2
+
+def test_blank_image_keeps_the_range():
+    assert estimate_radii(np.zeros((256, 256), dtype=np.uint8), MIN_RAD, MAX_RAD, 2) == (MIN_RAD, MAX_RAD, 2, 0)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from synthetic_droplets import synthetic_image
+from benchmark_droplets import match_droplets
+from auto_brightness import auto_brightness
+from droplet_trace import StageTrace
+from headless_nd2_scaled_droplet import group_radii, sequential_drop_detection, read_params
+from headless_nd2_scaled_droplet import remove_low_accum, remove_overlap
+
+'''Gradient-directed Hough voting against whole-circle voting on synthetic images with a known answer.'''
+
+MIN_AC_RELATIVE = 0.45
+
+def detect(raw, comp_img, hr_group, voting):
+    '''sequential_drop_detection and the final filtering of process_frame with the given voting.'''
+    params = read_params()
+    params['voting'] = voting
+    df, num_drops = sequential_drop_detection(raw, comp_img, hr_group, MIN_AC_RELATIVE, 'test', 400, 1, None,
+                                              params, StageTrace())
+    cx, cy, radii, accums = [np.array(df[c]) for c in ['X (pixels)', 'Y (pixels)', 'Radius (pixels)',
+                                                       'Probability count']]
+    cx, cy, radii, accums = remove_overlap(*remove_low_accum(accums, cx, cy, radii, MIN_AC_RELATIVE, 'test'))
+    return pd.DataFrame({'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii})
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_gradient_voting_finds_the_droplets(seed):
+    raw, truth = synthetic_image((512, 512), 60, 12, 40, seed)
+    comp_img = auto_brightness(raw)
+    hr_group = group_radii(np.arange(10, 43, 1))
+    circle = detect(raw, comp_img, hr_group, 'circle')
+    gradient = detect(raw, comp_img, hr_group, 'gradient')
+    assert len(match_droplets(gradient, truth)[0]) == len(match_droplets(circle, truth)[0]) == len(truth)
+    assert len(gradient) == len(truth)
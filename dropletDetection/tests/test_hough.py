@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from skimage.transform import hough_circle
+import droplet_hough
+from droplet_hough import hough_accumulators, vote_values
+
+'''droplet_hough search engine against skimage's hough_circle.'''
+
+RADII = [3, 12, 13, 30, 44, 45, 60]
+
+@pytest.mark.parametrize('path, votes_per_pixel', [('voting', np.inf), ('fourier', 0)])
+@pytest.mark.parametrize('density', [0.01, 0.2])
+def test_accumulators_match_hough_circle(monkeypatch, path, votes_per_pixel, density):
+    monkeypatch.setattr(droplet_hough, 'FFT_VOTES_PER_PIXEL', votes_per_pixel)
+    rng = np.random.default_rng(1)
+    edges = rng.random((97, 130)) < density
+    expected = hough_circle(edges, RADII)
+    for (radius, votes, num_points), acc in zip(hough_accumulators(edges, RADII), expected):
+        assert votes.dtype == np.min_scalar_type(num_points)
+        np.testing.assert_array_equal(vote_values(num_points)[votes], acc)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from headless_nd2_scaled_droplet import circle_mask, extract_intensities
+
+'''Droplet masks and intensity histograms from bounding-box pixel lists against the full-frame mask of each droplet
+the script used before.'''
+
+def baseline_masks(shape, cx, cy, radii):
+    '''Mask of all circles (True outside them) and one full-frame mask per circle, as circle_mask made them.'''
+    y, x = np.indices(shape)
+    ind_mask = [(x-center_x)**2 + (y-center_y)**2 < int(radius)**2
+                for center_y, center_x, radius in zip(cy, cx, radii)]
+    return ~np.any(ind_mask, axis=0), ind_mask
+
+@pytest.fixture
+def droplets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 4096, (150, 220)).astype(np.uint16)
+    # overlapping circles, circles crossing every border and one over a flat patch of pixels
+    cx = np.array([30, 45, 0, 219, 110, 100, 180])
+    cy = np.array([30, 40, 75, 75, 0, 149, 100])
+    radii = np.array([20, 15, 12, 25, 30, 18, 6])
+    img[94:107, 174:187] = 1000
+    return img, cx, cy, radii
+
+def test_mask_matches_full_frame_masks(droplets):
+    img, cx, cy, radii = droplets
+    mask, drop_pix = circle_mask(img, cx, cy, radii, 'test', figures='none')
+    base_mask, ind_mask = baseline_masks(img.shape, cx, cy, radii)
+    np.testing.assert_array_equal(mask, base_mask)
+    pix_idx, drop_no = drop_pix
+    for num, circle in enumerate(ind_mask):
+        np.testing.assert_array_equal(pix_idx[drop_no == num], np.flatnonzero(circle))
+
+def test_histograms_match_np_histogram(droplets):
+    img, cx, cy, radii = droplets
+    mask, drop_pix = circle_mask(img, cx, cy, radii, 'test', figures='none')
+    dhist, dbin = extract_intensities(img, drop_pix, len(radii))
+    for num, circle in enumerate(baseline_masks(img.shape, cx, cy, radii)[1]):
+        hist, bins = np.histogram(np.ma.array(img, mask=~circle, dtype=int).compressed(), bins=256)
+        np.testing.assert_array_equal(dhist[num], hist)
+        np.testing.assert_array_equal(dbin[num], bins[:-1])
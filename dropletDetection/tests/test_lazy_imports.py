@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import os
+import sys
+import subprocess
+
+'''headless_nd2_scaled_droplet.py with --no-tif --no-figures loads neither matplotlib nor imageio (nor nd2reader,
+which would load both through pims) when it is given the image already read.'''
+
+DETECT_ONLY = '''
+import sys
+import numpy as np
+sys.path.insert(0, %r)
+sys.argv = ['headless_nd2_scaled_droplet.py', 'lazy_t0.nd2', '--no-tif', '--no-figures']
+import headless_nd2_scaled_droplet as headless
+rng = np.random.default_rng(0)
+headless.nd2_read = lambda fn: (rng.integers(0, 4000, (128, 128)).astype(np.uint16), 0.5)
+headless.main()
+for module in ['matplotlib', 'imageio', 'nd2reader']:
+    print(module, module in sys.modules)
+'''
+
+def test_detection_only_imports(tmp_path):
+    package = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    out = subprocess.run([sys.executable, '-c', DETECT_ONLY % os.path.abspath(package)], cwd=str(tmp_path),
+                         capture_output=True, text=True, check=True).stdout
+    assert (tmp_path / '_figs' / 'lazy_t0_values.csv').exists()
+    assert 'matplotlib False' in out
+    assert 'imageio False' in out
+    assert 'nd2reader False' in out
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_hough import suppress_overlap
+from headless_nd2_scaled_droplet import distance, remove_overlap
+
+'''KD-tree overlap suppression against the O(n^2) loop of the original remove_overlap.'''
+
+def baseline_remove_overlap(cx, cy, radii, accums_prob):
+    '''remove_overlap as it was before suppress_overlap.'''
+    good = []
+    bad = []
+
+    for i in range(np.array(cx.shape[0])):
+        if i in bad:
+            continue
+        for j in range(i+1, np.array(cx.shape[0])):
+            ovr = distance(cx[i], cy[i], radii[i], cx[j], cy[j], radii[j])
+            if ovr == True:
+                bad.append(j)
+        good.append(i)
+
+    cx_nodup = np.array([cx[i] for i in good])
+    cy_nodup = np.array([cy[i] for i in good])
+    radii_nodup = np.array([radii[i] for i in good])
+    accums_nodup = np.array([accums_prob[i] for i in good])
+    return cx_nodup, cy_nodup, radii_nodup, accums_nodup
+
+@pytest.mark.parametrize('seed', range(200))
+def test_matches_baseline_loop(seed):
+    rng = np.random.default_rng(seed)
+    num = rng.integers(1, 150)
+    size = rng.integers(50, 600)
+    cx, cy = rng.integers(0, size, num), rng.integers(0, size, num)
+    radii = rng.integers(3, 60, num)
+    accums = np.sort(rng.random(num))[::-1]
+    ours = remove_overlap(cx, cy, radii, accums)
+    theirs = baseline_remove_overlap(cx, cy, radii, accums)
+    for a, b in zip(ours, theirs):
+        np.testing.assert_array_equal(a, b)
+
+def test_no_circles():
+    assert len(suppress_overlap(np.zeros(0), np.zeros(0), np.zeros(0))) == 0
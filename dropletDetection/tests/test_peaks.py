@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from skimage.transform import hough_circle, hough_circle_peaks
+from synthetic_droplets import synthetic_image
+from auto_brightness import auto_brightness
+from droplet_hough import detect_edges
+from droplet_trace import StageTrace
+from headless_nd2_scaled_droplet import group_radii, hough_peaks_groups, sequential_drop_detection, read_params
+from headless_nd2_scaled_droplet import remove_low_accum, remove_overlap, lim_num_drops
+
+'''Bounded and unbounded peak search against the baseline detection (skimage hough_circle and hough_circle_peaks
+on each radii group) on a synthetic image where one pair of tied circles is resolved differently.'''
+
+MIN_AC_RELATIVE = 0.45
+NUM_DROPS = 400
+
+@pytest.fixture(scope='module')
+def image():
+    raw, truth = synthetic_image((600, 600), 120, 30, 55, 5)
+    return raw, auto_brightness(raw), group_radii(np.arange(28, 58, 1))
+
+def filter_groups(accums, cx, cy, radii, hr_group):
+    '''remove_low_accum, remove_overlap and lim_num_drops of each radii group, as sequential_drop_detection does.'''
+    groups = []
+    for i in hr_group:
+        g = np.isin(radii, i)
+        drops = remove_low_accum(accums[g], cx[g], cy[g], radii[g], MIN_AC_RELATIVE, 'test')
+        drops = lim_num_drops(*remove_overlap(*drops), NUM_DROPS)
+        groups.append(pd.DataFrame({'X (pixels)': drops[0], 'Y (pixels)': drops[1], 'Radius (pixels)': drops[2],
+                                    'Probability count': np.round(drops[3], decimals=5)}))
+    return pd.concat(groups)
+
+def final_circles(df):
+    '''Final remove_low_accum and remove_overlap of process_frame, as a set of (x, y, radius, accum).'''
+    cx, cy, radii, accums = [np.array(df[c]) for c in ['X (pixels)', 'Y (pixels)', 'Radius (pixels)',
+                                                       'Probability count']]
+    cx, cy, radii, accums = remove_low_accum(accums, cx, cy, radii, MIN_AC_RELATIVE, 'test')
+    cx, cy, radii, accums = remove_overlap(cx, cy, radii, accums)
+    return set(zip(cx.tolist(), cy.tolist(), radii.tolist(), np.round(accums, 5).tolist()))
+
+def baseline_peaks(comp_img, hr_group):
+    edges = detect_edges(comp_img)
+    peaks = [hough_circle_peaks(hough_circle(edges, i), i) for i in hr_group]
+    return [np.concatenate(col) for col in zip(*peaks)]
+
+def test_peaks_match_hough_circle_peaks(image):
+    raw, comp_img, hr_group = image
+    accums, cx, cy, radii = hough_peaks_groups(detect_edges(comp_img), hr_group, StageTrace())
+    base = baseline_peaks(comp_img, hr_group)
+    ours = sorted(zip(radii.tolist(), cy.tolist(), cx.tolist(), np.round(accums, 12).tolist()))
+    theirs = sorted(zip(base[3].tolist(), base[2].tolist(), base[1].tolist(), np.round(base[0], 12).tolist()))
+    assert ours == theirs
+
+def test_bounded_and_unbounded_against_baseline(image):
+    raw, comp_img, hr_group = image
+    df, num_drops = sequential_drop_detection(raw, comp_img, hr_group, MIN_AC_RELATIVE, 'test', NUM_DROPS, 1, None,
+                                              read_params(), StageTrace())
+    bounded = final_circles(df)
+    unbounded = final_circles(filter_groups(*hough_peaks_groups(detect_edges(comp_img), hr_group, StageTrace()),
+                                            hr_group))
+    baseline = final_circles(filter_groups(*baseline_peaks(comp_img, hr_group), hr_group))
+    assert bounded == unbounded
+    # ties in accum value are ordered by sort_peaks now: only circles with an equal accum on the other side differ
+    # (one pair here, although the baseline order of ties depends on the sort numpy uses)
+    ours, theirs = bounded - baseline, baseline - bounded
+    assert len(ours) == len(theirs)
+    assert {c[3] for c in ours} == {c[3] for c in theirs}
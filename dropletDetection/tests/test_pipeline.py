@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_pipeline import OutputWriter
+
+'''Write errors of droplet_pipeline.OutputWriter belong to the job which submitted the write.'''
+
+class FailOnce:
+    '''Write function which fails the first time it is called and records the later calls.'''
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, value):
+        if not self.calls:
+            self.calls.append(None)
+            raise IOError('disk full')
+        self.calls.append(value)
+
+def test_error_belongs_to_its_job():
+    write = FailOnce()
+    with OutputWriter() as writer:
+        writer.name = 'first'
+        writer.submit(write, 1)
+        writer.wait()
+        writer.name = 'second'
+        writer.submit(write, 2)
+        writer.wait()
+        errors = writer.take_errors()
+        assert [name for name, e in errors] == ['first']
+        assert isinstance(errors[0][1], IOError)
+        assert writer.take_errors() == []
+    assert write.calls == [None, 2]
+
+def test_close_raises_once():
+    writer = OutputWriter()
+    writer.submit(FailOnce(), 1)
+    with pytest.raises(IOError):
+        writer.close()
+    writer.close()
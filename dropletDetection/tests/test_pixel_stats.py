@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from droplet_stats import pixel_stats, percentile_column
+from headless_nd2_scaled_droplet import circle_pixels
+
+'''Grouped per-droplet pixel statistics against pandas and np.percentile on the pixels of each droplet.'''
+
+PERCENTILES = [5, 25, 75, 95, 2.5]
+
+def test_pixel_stats_match_pandas():
+    rng = np.random.default_rng(0)
+    img = rng.gamma(2., 300., (120, 160)).astype(np.uint16)
+    img[50:70, 100:120] = 700
+    # overlapping circles, one across the border, a flat one, and circles of 1 and 0 pixels
+    cx = np.array([40, 55, 0, 110, 80, 140])
+    cy = np.array([40, 50, 100, 60, 110, 10])
+    radii = np.array([25, 18, 15, 8, 1, 0])
+    drop_pix = circle_pixels(img.shape, cx, cy, radii)
+    stats = pixel_stats(img, drop_pix, len(radii), PERCENTILES)
+    assert len(stats) == len(radii)
+
+    pix_idx, drop_no = drop_pix
+    for num in range(len(radii)):
+        vals = pd.Series(img.ravel()[pix_idx[drop_no == num]].astype(float))
+        row = stats.iloc[num]
+        assert row['Pixel count'] == len(vals)
+        expected = {'Intensity mean': vals.mean(), 'Intensity median': vals.median(), 'Intensity std': vals.std(),
+                    'Intensity skew': vals.skew(), 'Intensity kurtosis': vals.kurt()}
+        for q in PERCENTILES:
+            expected[percentile_column(q)] = np.percentile(vals, q) if len(vals) else np.nan
+        for col, value in expected.items():
+            np.testing.assert_allclose(row[col], np.round(value, 5), atol=1e-5, err_msg=col)
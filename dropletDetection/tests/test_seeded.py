@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from synthetic_droplets import synthetic_image
+from benchmark_droplets import match_droplets
+from auto_brightness import auto_brightness
+from droplet_trace import StageTrace
+from headless_nd2_scaled_droplet import group_radii, sequential_drop_detection, read_params
+from headless_nd2_scaled_droplet import remove_low_accum, remove_overlap
+
+'''Detection seeded with the droplets of a previous timepoint against the full search on synthetic images.'''
+
+MIN_AC_RELATIVE = 0.45
+
+@pytest.fixture(scope='module', params=[0, 1])
+def image(request):
+    raw, truth = synthetic_image((512, 512), 40, 25, 50, request.param)
+    return raw, auto_brightness(raw), truth, group_radii(np.arange(23, 53, 1))
+
+def detect(raw, comp_img, hr_group, prior=None):
+    '''sequential_drop_detection, seeded with prior if given, and the final filtering of process_frame.'''
+    df, num_drops = sequential_drop_detection(raw, comp_img, hr_group, MIN_AC_RELATIVE, 'test', 400, 1, prior,
+                                              read_params(), StageTrace())
+    cx, cy, radii, accums = [np.array(df[c]) for c in ['X (pixels)', 'Y (pixels)', 'Radius (pixels)',
+                                                       'Probability count']]
+    cx, cy, radii, accums = remove_overlap(*remove_low_accum(accums, cx, cy, radii, MIN_AC_RELATIVE, 'test'))
+    return pd.DataFrame({'X (pixels)': cx, 'Y (pixels)': cy, 'Radius (pixels)': radii, 'Probability count': accums})
+
+def circles(df):
+    return set(map(tuple, df.values.tolist()))
+
+def test_unchanged_droplets(image):
+    '''Seeded with its own droplets, an image gives the droplets of the full search.'''
+    raw, comp_img, truth, hr_group = image
+    full = detect(raw, comp_img, hr_group)
+    assert circles(detect(raw, comp_img, hr_group, full)) == circles(full)
+
+def test_moved_and_new_droplets(image):
+    '''Droplets which moved and grew within the seed window and band are found from their prior, and droplets with
+    no prior by the search of the uncovered edges.'''
+    raw, comp_img, truth, hr_group = image
+    full = detect(raw, comp_img, hr_group)
+    prior = truth.iloc[::2].copy()
+    prior['X (pixels)'] += 3
+    prior['Y (pixels)'] -= 2
+    prior['Radius (pixels)'] -= 2
+    seeded = detect(raw, comp_img, hr_group, prior)
+    matched = len(match_droplets(seeded, truth)[0])
+    assert matched >= len(match_droplets(full, truth)[0])
+    assert matched == len(seeded)
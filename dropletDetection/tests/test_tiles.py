@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+__author__ = "Melissa A. Klocke"
+__email__ = "klocke@ucr.edu"
+__version__ = "1.0"
+
+import numpy as np
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark'))
+from synthetic_droplets import synthetic_image
+from auto_brightness import auto_brightness
+from droplet_hough import detect_edges, hough_peaks_all_radii, tile_size, tile_boxes, tiled_edges, tiled_peaks
+from droplet_trace import StageTrace
+from headless_nd2_scaled_droplet import group_radii, sequential_drop_detection, read_params
+from headless_nd2_scaled_droplet import remove_low_accum, remove_overlap
+
+'''Searches in tiles (a memory budget) against the search of the whole image on a synthetic image.'''
+
+MIN_AC_RELATIVE = 0.45
+
+@pytest.fixture(scope='module')
+def image():
+    raw, truth = synthetic_image((512, 512), 200, 12, 40, 0)
+    return raw, auto_brightness(raw), group_radii(np.arange(10, 43, 1))
+
+def final_circles(raw, comp_img, hr_group, memory_mb, workers=1):
+    '''Circles left by sequential_drop_detection and the final filtering of process_frame, as a set.'''
+    params = read_params()
+    params['memory_mb'] = memory_mb
+    df, num_drops = sequential_drop_detection(raw, comp_img, hr_group, MIN_AC_RELATIVE, 'test', 400, workers, None,
+                                              params, StageTrace())
+    cx, cy, radii, accums = [np.array(df[c]) for c in ['X (pixels)', 'Y (pixels)', 'Radius (pixels)',
+                                                       'Probability count']]
+    drops = remove_overlap(*remove_low_accum(accums, cx, cy, radii, MIN_AC_RELATIVE, 'test'))
+    return set(zip(*[col.tolist() for col in drops]))
+
+@pytest.mark.parametrize('memory_mb', [3, 5])
+def test_tiled_edges_match_detect_edges(image, memory_mb):
+    raw, comp_img, hr_group = image
+    tile = tile_size(memory_mb, 42)
+    assert len(tile_boxes(comp_img.shape, tile)) > 1
+    np.testing.assert_array_equal(tiled_edges(comp_img, tile), detect_edges(comp_img))
+
+@pytest.mark.parametrize('memory_mb, workers', [(3, 1), (5, 1), (3, 2)])
+def test_tiled_peaks_match_whole_image(image, memory_mb, workers):
+    raw, comp_img, hr_group = image
+    hough_radii = np.concatenate(hr_group)
+    edges = detect_edges(comp_img)
+    whole = hough_peaks_all_radii(edges, hough_radii)
+    tiled = tiled_peaks(edges, hough_radii, tile_size(memory_mb, np.max(hough_radii)), workers)
+    assert set(zip(*[col.tolist() for col in tiled])) == set(zip(*[col.tolist() for col in whole]))
+
+@pytest.mark.parametrize('memory_mb', [3, 5])
+def test_tiled_detection_finds_the_same_droplets(image, memory_mb):
+    raw, comp_img, hr_group = image
+    assert final_circles(raw, comp_img, hr_group, memory_mb) == final_circles(raw, comp_img, hr_group, 0)